@@ -2,12 +2,24 @@
 Admin module - Dashboard and post editor
 """
 import os
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify, Response, stream_with_context
 from werkzeug.utils import secure_filename
-from models import db, Post, User, Comment, Like, ReadEvent
+from models import db, Post, User, Comment, Like
 from auth import admin_required
+from ingest import read_event_buffer
+from rollup import run_rollup
+from stats import (post_metrics, site_totals, post_reading_summary, completion_histogram,
+                   time_on_page_distribution, daily_series, range_readers, post_viewers)
+from cache import content_cache
+from search import index_post, remove_post
+from images import image_pipeline
+from sql_metrics import sql_metrics
+from content import compile_post
+from prerender import prerender
+from related import forget_post, listing_posts, publish as publish_related
+from export import EXPORTS, FORMATS, parse_date, stream_export, export_filename
 from datetime import datetime
-from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -22,38 +34,23 @@ def allowed_file(filename):
 @admin_required
 def dashboard():
     """Admin dashboard with overview stats"""
+    # Fold a bounded chunk of new read events in; cron does the rest
+    run_rollup(chunk_size=current_app.config['ROLLUP_REQUEST_CHUNK'], max_chunks=1)
+    
     # Get overall stats
-    total_posts = Post.query.filter_by(status='published').count()
-    total_users = User.query.count()
-    total_comments = Comment.query.count()
-    total_likes = Like.query.count()
+    totals = site_totals()
     
-    # Get recent posts with stats
-    posts = Post.query.order_by(Post.created_at.desc()).limit(10).all()
+    # Get a page of posts with stats
+    page = request.args.get('page', 1, type=int)
+    pagination = Post.query.order_by(Post.created_at.desc()).paginate(page=page, per_page=20, error_out=False)
+    metrics = post_metrics(post.id for post in pagination.items)
     
-    post_stats = []
-    for post in posts:
-        views = db.session.query(ReadEvent.user_id).filter_by(post_id=post.id).distinct().count()
-        likes = Like.query.filter_by(post_id=post.id).count()
-        comments = Comment.query.filter_by(post_id=post.id).count()
-        
-        # Calculate average completion
-        avg_completion = db.session.query(func.avg(ReadEvent.percent)).filter_by(post_id=post.id).scalar() or 0
-        
-        post_stats.append({
-            'post': post,
-            'views': views,
-            'likes': likes,
-            'comments': comments,
-            'avg_completion': round(avg_completion, 1)
-        })
+    post_stats = [dict(metrics[post.id], post=post) for post in pagination.items]
     
     return render_template('admin/dashboard.html', 
-                          total_posts=total_posts,
-                          total_users=total_users,
-                          total_comments=total_comments,
-                          total_likes=total_likes,
-                          post_stats=post_stats)
+                          post_stats=post_stats,
+                          pagination=pagination,
+                          **totals)
 
 
 @admin_bp.route('/posts')
@@ -77,7 +74,6 @@ def post_new():
             html_content = request.form.get('html_content', '')
             excerpt = request.form.get('excerpt', '').strip()
             category = request.form.get('category', '').strip()
-            read_time = request.form.get('read_time', 0)
             
             # Validate required fields
             if not title or not slug or not month_key:
@@ -121,13 +117,22 @@ def post_new():
                 html_content=html_content,
                 excerpt=excerpt,
                 category=category,
-                read_time=read_time,
                 hero_image_path=hero_image_path,
                 published_at=published_at
             )
             
+            # Sanitized/minified body, TOC, read time and excerpt
+            compile_post(post, excerpt=excerpt)
+            
             db.session.add(post)
+            db.session.flush()
+            index_post(post)
             db.session.commit()
+            content_cache.bump()
+            prerender.refresh(slugs=[post.slug], months=[post.month_key])
+            
+            if hero_image_path:
+                image_pipeline.submit(hero_image_path)
             
             flash('Post created successfully', 'success')
             return redirect(url_for('admin.posts_list'))
@@ -148,6 +153,9 @@ def post_edit(post_id):
     
     if request.method == 'POST':
         try:
+            new_hero_image = None
+            previous_html = post.html_content
+            previous_slug, previous_month = post.slug, post.month_key
             post.title = request.form.get('title', '').strip()
             post.slug = request.form.get('slug', '').strip()
             post.month_key = request.form.get('month_key', '').strip()
@@ -155,7 +163,6 @@ def post_edit(post_id):
             post.html_content = request.form.get('html_content', '')
             post.excerpt = request.form.get('excerpt', '').strip()
             post.category = request.form.get('category', '').strip()
-            post.read_time = request.form.get('read_time', 0)
             
             # Validate required fields
             if not post.title or not post.slug or not post.month_key:
@@ -185,11 +192,23 @@ def post_edit(post_id):
                     filename = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{filename}"
                     filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
                     file.save(filepath)
-                    post.hero_image_path = f"/{filepath}"
+                    post.hero_image_path = new_hero_image = f"/{filepath}"
             
             post.updated_at = datetime.utcnow()
             
+            # Sanitized/minified body, TOC, read time and excerpt
+            compile_post(post, excerpt=post.excerpt, previous_html=previous_html)
+            
+            index_post(post)
             db.session.commit()
+            content_cache.bump()
+            # Only this post's page, its month(s) and the menus
+            prerender.refresh(slugs=[previous_slug, post.slug], months=[previous_month, post.month_key])
+            # and the pages linking to it; python related.py recomputes the lists
+            publish_related(listing_posts(post.id))
+            
+            if new_hero_image:
+                image_pipeline.submit(new_hero_image)
             
             flash('Post updated successfully', 'success')
             return redirect(url_for('admin.posts_list'))
@@ -208,8 +227,14 @@ def post_delete(post_id):
     """Delete a post"""
     try:
         post = Post.query.get_or_404(post_id)
+        slug, month_key = post.slug, post.month_key
+        remove_post(post.id)
+        listed_by = forget_post(post.id)
         db.session.delete(post)
         db.session.commit()
+        content_cache.bump()
+        prerender.refresh(slugs=[slug], months=[month_key])
+        publish_related(listed_by)
         flash('Post deleted successfully', 'success')
     except Exception as e:
         current_app.logger.error(f"Post delete error: {e}")
@@ -224,27 +249,40 @@ def post_stats(post_id):
     """Detailed stats for a specific post"""
     post = Post.query.get_or_404(post_id)
     
-    # Get unique viewers
-    viewers = db.session.query(User).join(ReadEvent).filter(ReadEvent.post_id == post_id).distinct().all()
+    # Fold a bounded chunk of new read events in; cron does the rest
+    run_rollup(chunk_size=current_app.config['ROLLUP_REQUEST_CHUNK'], max_chunks=1)
     
-    # Get all read events
-    read_events = ReadEvent.query.filter_by(post_id=post_id).order_by(ReadEvent.created_at.desc()).all()
+    # Aggregates over the rollups; nothing here loads rows per reader
+    days = request.args.get('days', 30, type=int)
+    days = days if days in (7, 30, 90, 365) else 30
+    summary = post_reading_summary(post_id)
+    histogram = completion_histogram(post_id)
+    time_on_page = time_on_page_distribution(post_id)
+    series = daily_series(post_id, days=days)
+    series_readers = range_readers(post_id, days=days)
     
-    # Calculate stats
-    total_views = len(viewers)
-    avg_completion = db.session.query(func.avg(ReadEvent.percent)).filter_by(post_id=post_id).scalar() or 0
-    avg_time = db.session.query(func.avg(ReadEvent.seconds)).filter_by(post_id=post_id).scalar() or 0
-    
-    # Get likes and comments
-    likes = Like.query.filter_by(post_id=post_id).all()
-    comments = Comment.query.filter_by(post_id=post_id).order_by(Comment.created_at.desc()).all()
+    # One page of each list, with the users joined in
+    viewers = post_viewers(post_id, page=request.args.get('viewers_page', 1, type=int))
+    likes = Like.query.filter_by(post_id=post_id).options(joinedload(Like.user)).order_by(
+        Like.created_at.desc(), Like.id.desc()
+    ).paginate(page=request.args.get('likes_page', 1, type=int), per_page=20, error_out=False)
+    comments = Comment.query.filter_by(post_id=post_id).options(joinedload(Comment.user)).order_by(
+        Comment.created_at.desc(), Comment.id.desc()
+    ).paginate(page=request.args.get('comments_page', 1, type=int), per_page=20, error_out=False)
     
     return render_template('admin/post_stats.html',
                           post=post,
+                          summary=summary,
+                          avg_time=round(summary['avg_read_seconds'] / 60, 1),
+                          histogram=histogram,
+                          histogram_max=max(histogram) or 1,
+                          time_on_page=time_on_page,
+                          time_on_page_max=max(count for _, count in time_on_page) or 1,
+                          series=series,
+                          series_max=max(day['reads'] for day in series) or 1,
+                          series_readers=series_readers,
+                          days=days,
                           viewers=viewers,
-                          total_views=total_views,
-                          avg_completion=round(avg_completion, 1),
-                          avg_time=round(avg_time / 60, 1) if avg_time else 0,
                           likes=likes,
                           comments=comments)
 
@@ -257,6 +295,82 @@ def users_list():
     return render_template('admin/users_list.html', users=users)
 
 
+@admin_bp.route('/ingest-stats')
+@admin_required
+def ingest_stats():
+    """Read-event buffer counters for this worker"""
+    return jsonify(read_event_buffer.stats())
+
+
+@admin_bp.route('/sql-stats')
+@admin_required
+def sql_stats():
+    """Endpoints with the most SQL time, statements and suspected N+1 queries"""
+    sort = request.args.get('sort', 'db_ms')
+    if sort not in ('db_ms', 'avg_queries', 'max_total_ms', 'n_plus_one'):
+        sort = 'db_ms'
+    return render_template('admin/sql_stats.html',
+                          endpoints=sql_metrics.endpoints(sort=sort),
+                          sort=sort,
+                          enabled=sql_metrics.enabled,
+                          pid=os.getpid(),
+                          slow_request_ms=sql_metrics.slow_request_ms,
+                          max_queries=sql_metrics.max_queries)
+
+
+@admin_bp.route('/sql-stats/reset', methods=['POST'])
+@admin_required
+def sql_stats_reset():
+    """Clear this worker's endpoint totals"""
+    sql_metrics.reset()
+    flash('SQL stats reset for this worker', 'success')
+    return redirect(url_for('admin.sql_stats'))
+
+
+@admin_bp.route('/export/<kind>')
+@admin_required
+def export(kind):
+    """Stream read events, likes or comments as CSV or NDJSON
+    
+    Query parameters: format (csv, ndjson), gzip=1, post_id, user_id,
+    since/until (YYYY-MM-DD, inclusive), after_id to resume, limit.
+    """
+    if kind not in EXPORTS:
+        return jsonify({'error': f'Unknown export: {kind}'}), 404
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        return jsonify({'error': f'Unknown format: {fmt}'}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+    
+    try:
+        filters = {
+            'post_id': request.args.get('post_id', type=int),
+            'user_id': request.args.get('user_id', type=int),
+            'since': parse_date(request.args.get('since')),
+            'until': parse_date(request.args.get('until')),
+            'after_id': request.args.get('after_id', 0, type=int),
+            'limit': request.args.get('limit', type=int),
+        }
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    
+    def generate():
+        try:
+            yield from stream_export(kind, fmt, compress, **filters)
+        except Exception as e:
+            # Headers are gone by now; the client resumes with after_id
+            current_app.logger.error(f"Export error ({kind}): {e}")
+            raise
+    
+    filename = export_filename(kind, fmt, compress)
+    response = Response(stream_with_context(generate()),
+                        mimetype='application/gzip' if compress else FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'  # let nginx pass chunks through
+    return response
+
+
 @admin_bp.route('/upload-image', methods=['POST'])
 @admin_required
 def upload_image():
@@ -274,6 +388,7 @@ def upload_image():
             filename = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{filename}"
             filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
             file.save(filepath)
+            image_pipeline.submit(f"/{filepath}")
             
             return jsonify({
                 'success': True,
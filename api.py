@@ -1,9 +1,11 @@
 """
 API endpoints for comments, likes, and read tracking
 """
-from flask import Blueprint, request, jsonify, session, current_app
-from models import db, Post, Comment, Like, ReadEvent, User
+from flask import Blueprint, request, jsonify, session, current_app, url_for
+from models import db, Post, Comment, Like, User
 from auth import login_required
+from ingest import read_event_buffer, MAX_BEACON_BYTES, parse_beacon, published_post_ids
+from search import search, SearchUnavailable
 from datetime import datetime
 
 api_bp = Blueprint('api', __name__)
@@ -18,25 +20,12 @@ def toggle_like(post_id):
         if not user_id:
             return jsonify({'error': 'Not authenticated'}), 401
         
-        post = Post.query.get_or_404(post_id)
-        
-        # Check if already liked
-        existing_like = Like.query.filter_by(post_id=post_id, user_id=user_id).first()
-        
-        if existing_like:
-            # Unlike
-            db.session.delete(existing_like)
-            db.session.commit()
-            liked = False
-        else:
-            # Like
-            new_like = Like(post_id=post_id, user_id=user_id)
-            db.session.add(new_like)
-            db.session.commit()
-            liked = True
-        
-        # Get updated count
-        like_count = Like.query.filter_by(post_id=post_id).count()
+        # One transaction: delete-or-insert, counter update and the new count
+        liked, like_count = Like.toggle(post_id, user_id)
+        if like_count is None:
+            db.session.rollback()
+            return jsonify({'error': 'Post not found'}), 404
+        db.session.commit()
         
         return jsonify({
             'success': True,
@@ -45,6 +34,7 @@ def toggle_like(post_id):
         })
         
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Like toggle error: {e}")
         return jsonify({'error': 'Failed to toggle like'}), 500
 
@@ -76,6 +66,7 @@ def add_comment(post_id):
         )
         
         db.session.add(comment)
+        Post.adjust_counters(post_id, comment_count=1)
         db.session.commit()
         
         # Get user info
@@ -113,6 +104,7 @@ def delete_comment(comment_id):
             return jsonify({'error': 'Permission denied'}), 403
         
         db.session.delete(comment)
+        Post.adjust_counters(comment.post_id, comment_count=-1)
         db.session.commit()
         
         return jsonify({'success': True})
@@ -125,7 +117,12 @@ def delete_comment(comment_id):
 @api_bp.route('/read-event/<int:post_id>', methods=['POST'])
 @login_required
 def track_read_event(post_id):
-    """Track reading progress"""
+    """Track reading progress, one event per request
+    
+    Kept for older pages and scripts; post.html sends /api/beacon. Events
+    are queued in the per-worker write-behind buffer and written in batches;
+    the post existence check happens once per batch at flush time.
+    """
     try:
         user_id = session.get('user_id')
         if not user_id:
@@ -139,52 +136,181 @@ def track_read_event(post_id):
         percent = max(0, min(100, int(percent)))
         seconds = max(0, int(seconds))
         
-        post = Post.query.get_or_404(post_id)
+        if not read_event_buffer.enqueue(post_id, user_id, percent, seconds):
+            # Buffer full - shed load, the next heartbeat carries newer totals anyway
+            response = jsonify({'error': 'Too many read events, retry later'})
+            response.headers['Retry-After'] = '30'
+            return response, 429
         
-        # Create read event
-        read_event = ReadEvent(
-            post_id=post_id,
-            user_id=user_id,
-            percent=percent,
-            seconds=seconds
-        )
-        
-        db.session.add(read_event)
-        db.session.commit()
-        
-        return jsonify({'success': True})
+        return jsonify({'success': True}), 202
         
     except Exception as e:
         current_app.logger.error(f"Read event error: {e}")
         return jsonify({'error': 'Failed to track read event'}), 500
 
 
+def _comment_json(comment):
+    return {
+        'id': comment.id,
+        'body': comment.body,
+        'created_at': comment.created_at.isoformat(),
+        'user_name': comment.user.name or comment.user.email,
+        'can_delete': session.get('user_id') == comment.user_id or session.get('is_admin', False)
+    }
+
+
+@api_bp.route('/beacon', methods=['POST'])
+@login_required
+def read_beacon():
+    """Batched reading progress from navigator.sendBeacon
+    
+    The body is JSON, whatever the Content-Type (sendBeacon sends text/plain):
+    {"k": key, "e": [[post_id, percent, seconds, seq], ...]}. Events for posts
+    that don't exist or aren't published are dropped here; a resent key is
+    acknowledged too, and its events are dropped when the buffer writes them.
+    """
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Not authenticated'}), 401
+        
+        if (request.content_length or 0) > MAX_BEACON_BYTES:
+            return jsonify({'error': 'Beacon too large'}), 413
+        try:
+            key, events = parse_beacon(request.get_data(cache=False))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # One existence check for every post the batch mentions
+        existing = published_post_ids({post_id for post_id, _, _ in events})
+        events = [event for event in events if event[0] in existing]
+        
+        if events and read_event_buffer.enqueue_many(user_id, events, beacon_key=key) < len(events):
+            response = jsonify({'error': 'Too many read events, retry later'})
+            response.headers['Retry-After'] = '30'
+            return response, 429
+        
+        return '', 204
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Beacon error: {e}")
+        return jsonify({'error': 'Failed to track reading progress'}), 500
+
+
 @api_bp.route('/comments/<int:post_id>', methods=['GET'])
 @login_required
 def get_comments(post_id):
-    """Get all comments for a post"""
+    """Get a page of comments for a post, newest first
+    
+    Pass the returned next_cursor as ?cursor= to fetch the following page.
+    """
     try:
         post = Post.query.get_or_404(post_id)
         
-        comments = Comment.query.filter_by(post_id=post_id).order_by(Comment.created_at.desc()).all()
-        
-        comment_list = []
-        for comment in comments:
-            user = User.query.get(comment.user_id)
-            comment_list.append({
-                'id': comment.id,
-                'body': comment.body,
-                'created_at': comment.created_at.isoformat(),
-                'user_name': user.name or user.email,
-                'can_delete': session.get('user_id') == comment.user_id or session.get('is_admin', False)
-            })
+        limit = max(1, min(100, request.args.get('limit', 20, type=int)))
+        try:
+            comments, next_cursor = Comment.page(post_id, cursor=request.args.get('cursor'), limit=limit)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
         
         return jsonify({
             'success': True,
-            'comments': comment_list
+            'comments': [_comment_json(comment) for comment in comments],
+            'next_cursor': next_cursor
         })
         
     except Exception as e:
         current_app.logger.error(f"Get comments error: {e}")
         return jsonify({'error': 'Failed to fetch comments'}), 500
 
+
+@api_bp.route('/hydrate/post/<int:post_id>', methods=['GET'])
+@login_required
+def hydrate_post(post_id):
+    """Per-user state for a pre-rendered post page
+    
+    The viewer's like, the current counts and the first page of comments.
+    """
+    try:
+        counts = db.session.query(Post.like_count, Post.comment_count, Post.unique_viewer_count).filter_by(
+            id=post_id, status='published'
+        ).first()
+        if counts is None:
+            return jsonify({'error': 'Post not found'}), 404
+        
+        liked = db.session.query(
+            Like.query.filter_by(post_id=post_id, user_id=session.get('user_id')).exists()
+        ).scalar()
+        comments, next_cursor = Comment.page(post_id)
+        
+        return jsonify({
+            'success': True,
+            'liked': liked,
+            'like_count': counts.like_count,
+            'comment_count': counts.comment_count,
+            'unique_viewer_count': counts.unique_viewer_count,
+            'comments': [_comment_json(comment) for comment in comments],
+            'next_cursor': next_cursor
+        })
+        
+    except Exception as e:
+        current_app.logger.error(f"Hydrate post error: {e}")
+        return jsonify({'error': 'Failed to load post state'}), 500
+
+
+@api_bp.route('/hydrate/archive/<month_key>', methods=['GET'])
+@login_required
+def hydrate_archive(month_key):
+    """Current like counts for a pre-rendered month archive, by post id"""
+    try:
+        rows = db.session.query(Post.id, Post.like_count).filter_by(month_key=month_key, status='published').all()
+        return jsonify({
+            'success': True,
+            'like_counts': {post_id: like_count for post_id, like_count in rows}
+        })
+        
+    except Exception as e:
+        current_app.logger.error(f"Hydrate archive error: {e}")
+        return jsonify({'error': 'Failed to load archive state'}), 500
+
+
+@api_bp.route('/search', methods=['GET'])
+@login_required
+def search_posts():
+    """Full-text search over published posts, best matches first"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Query is required'}), 400
+    
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(50, request.args.get('per_page', 10, type=int)))
+    
+    try:
+        found = search(query, page=page, per_page=per_page)
+    except SearchUnavailable:
+        return jsonify({'error': 'Search is not available'}), 501
+    except Exception as e:
+        current_app.logger.error(f"Search error: {e}")
+        return jsonify({'error': 'Search failed'}), 500
+    
+    results = []
+    for row in found['results']:
+        results.append({
+            'id': row['id'],
+            'title': row['title'],
+            'excerpt': row['excerpt'],
+            'category': row['category'],
+            'month_key': row['month_key'],
+            'url': url_for('post_detail', slug=row['slug']),
+            'snippet': row['snippet']
+        })
+    
+    return jsonify({
+        'success': True,
+        'query': query,
+        'page': page,
+        'per_page': per_page,
+        'total': found['total'],
+        'results': results
+    })
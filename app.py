@@ -1,158 +1,264 @@
 """
 Wide Angle Blog - Flask Application
 Tenant-only blog with Entra ID authentication
+
+create_app() builds a configured application. The module-level ``app`` used
+by gunicorn (app:app) and the maintenance scripts is created on first access.
 """
 import os
+import weakref
 from datetime import datetime
-from flask import Flask, render_template, redirect, url_for, session
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__, static_folder='assets', static_url_path='/assets')
-
-# Configuration
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///blogsite.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-
-# Entra ID Configuration
-app.config['ENTRA_CLIENT_ID'] = os.environ.get('CLIENT_ID', '423dd38a-439a-4b99-a313-9472d2c0dad6')
-app.config['ENTRA_CLIENT_SECRET'] = os.environ.get('CLIENT_SECRET', '')
-app.config['ENTRA_TENANT_ID'] = os.environ.get('TENANT_ID', '6b8b8296-bdff-4ad8-93ad-84bcbf3842f5')
-app.config['ENTRA_REDIRECT_URI'] = os.environ.get('REDIRECT_URI', 'http://localhost:5000/auth/callback')
-
-# Admin email allowlist
-admin_emails_str = os.environ.get('ADMIN_EMAILS', '')
-app.config['ADMIN_EMAILS'] = [email.strip() for email in admin_emails_str.split(',') if email.strip()]
-
-# Initialize database
-from models import db
-db.init_app(app)
-
-# Create uploads directory
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-# Import models after db init
-from models import User, Post, Comment, Like, ReadEvent
-
-# Register blueprints
-from auth import auth_bp
-from api import api_bp
-from admin import admin_bp
-
-app.register_blueprint(auth_bp, url_prefix='/auth')
-app.register_blueprint(api_bp, url_prefix='/api')
-app.register_blueprint(admin_bp, url_prefix='/admin')
-
-# Make login_required available
-from auth import login_required
-
-# Import models - must be after db init
-import models
+# Applications created in this process, for the after-fork hook
+_apps = weakref.WeakSet()
 
-# Register blueprints
-from auth import auth_bp
-from api import api_bp
-from admin import admin_bp
 
-app.register_blueprint(auth_bp, url_prefix='/auth')
-app.register_blueprint(api_bp, url_prefix='/api')
-app.register_blueprint(admin_bp, url_prefix='/admin')
-
-# Make login_required available
-from auth import login_required
-
-
-# Routes
-@app.route('/')
-def index():
-    """Redirect to latest month archive"""
-    latest_post = Post.query.filter_by(status='published').order_by(Post.published_at.desc()).first()
-    if latest_post:
-        return redirect(url_for('archive', month_key=latest_post.month_key))
+def create_app(config_name=None, web=True):
+    """Create the application.
     
-    # Get all available months
-    months = db.session.query(Post.month_key).filter_by(status='published').distinct().order_by(Post.month_key.desc()).all()
-    months = [m[0] for m in months]
+    config_name picks the class in config.py (FLASK_CONFIG / FLASK_ENV by
+    default). web=False sets up only the configuration and the database,
+    which is all the maintenance scripts need. Imports of the extensions and
+    blueprints happen here rather than at module import.
+    """
+    from config import get_config
+    from models import db
+    from db_engine import configure_engine, install_hooks
     
-    return render_template('archive.html', posts=[], month_key=None, months=months)
-
-
-@app.route('/archive/<month_key>')
-@login_required
-def archive(month_key):
-    """Show posts for a specific month"""
-    # Get all posts for the month
-    all_posts = Post.query.filter_by(month_key=month_key, status='published').order_by(Post.published_at.desc()).all()
+    app = Flask(__name__, static_folder='assets', static_url_path='/assets')
+    app.config.from_object(get_config(config_name))
     
-    # Use first 2 posts as featured for carousel
-    featured_posts = all_posts[:2] if len(all_posts) >= 2 else all_posts
+    # Initialize database with the environment's engine profile
+    configure_engine(app)
+    db.init_app(app)
+    install_hooks(app, db)
+    _apps.add(app)
     
-    # Get all available months
-    months = db.session.query(Post.month_key).filter_by(status='published').distinct().order_by(Post.month_key.desc()).all()
-    months = [m[0] for m in months]
+    if not web:
+        return app
     
-    return render_template('archive.html', posts=all_posts, featured_posts=featured_posts, month_key=month_key, months=months)
-
-
-@app.route('/post/<slug>')
-@login_required
-def post_detail(slug):
-    """Show full post with comments and likes"""
-    post = Post.query.filter_by(slug=slug, status='published').first_or_404()
+    # Statement counts, Server-Timing header and N+1 detection per request
+    from sql_metrics import sql_metrics
+    sql_metrics.init_app(app)
     
-    # Get comments
-    comments = Comment.query.filter_by(post_id=post.id).order_by(Comment.created_at.desc()).all()
+    # Prometheus /metrics, aggregated across gunicorn workers
+    from metrics import metrics
+    metrics.init_app(app)
     
-    # Get like count
-    like_count = Like.query.filter_by(post_id=post.id).count()
+    # Batched read-event ingestion (per worker)
+    from ingest import read_event_buffer
+    read_event_buffer.init_app(app)
     
-    # Check if current user liked
-    user_liked = False
-    if 'user_id' in session:
-        user_liked = Like.query.filter_by(post_id=post.id, user_id=session['user_id']).first() is not None
+    # Per-worker cache for navigation data, invalidated across workers on publish
+    from cache import content_cache
+    content_cache.init_app(app)
     
-    # Get all available months for menu
-    months = db.session.query(Post.month_key).filter_by(status='published').distinct().order_by(Post.month_key.desc()).all()
-    months = [m[0] for m in months]
+    # Background resizing of uploaded images
+    from images import image_pipeline
+    image_pipeline.init_app(app)
     
-    return render_template('post.html', post=post, comments=comments, like_count=like_count, 
-                          user_liked=user_liked, months=months)
-
-
-@app.context_processor
-def inject_now():
-    """Make current year available in all templates"""
-    return {'now': datetime.utcnow()}
-
-
-@app.context_processor
-def inject_months():
-    """Expose published month list for navigation and error pages."""
-    months = db.session.query(Post.month_key).filter_by(status='published').distinct().order_by(Post.month_key.desc()).all()
-    months = [m[0] for m in months]
-    return {'months': months}
-
-
-@app.errorhandler(404)
-def not_found(e):
-    return render_template('404.html'), 404
+    # Fingerprinted static files (asset_url() in templates, immutable caching)
+    from static_assets import static_assets
+    static_assets.init_app(app)
+    
+    # Pre-rendered archive and post pages (answered from files when enabled)
+    from prerender import prerender
+    prerender.init_app(app)
+    
+    # Create uploads directory
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    
+    # Register blueprints
+    from auth import auth_bp
+    from api import api_bp
+    from admin import admin_bp
+    
+    app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.register_blueprint(api_bp, url_prefix='/api')
+    app.register_blueprint(admin_bp, url_prefix='/admin')
+    
+    register_routes(app)
+    
+    if app.config.get('WARM_UP'):
+        warm_up(app)
+    
+    return app
+
+
+def register_routes(app):
+    """Site pages, template context and error handlers"""
+    from flask import render_template, redirect, url_for, session, make_response
+    from sqlalchemy import func
+    from sqlalchemy.orm import undefer
+    from models import db, Post, Comment, Like
+    from auth import login_required
+    from cache import published_months
+    from http_cache import Validators
+    from prerender import prerender
+    from related import related_for, list_changed_at
+    
+    @app.route('/')
+    def index():
+        """Redirect to latest month archive"""
+        latest_post = Post.query.filter_by(status='published').order_by(Post.published_at.desc()).first()
+        if latest_post:
+            return redirect(url_for('archive', month_key=latest_post.month_key))
+        
+        return render_template('archive.html', posts=[], month_key=None)
+    
+    @app.route('/archive/<month_key>')
+    @login_required
+    def archive(month_key):
+        """Show posts for a specific month"""
+        # Answer repeat visits from a single aggregate over the month's posts
+        count, last_id, updated_at, engaged_at = db.session.query(
+            func.count(Post.id), func.max(Post.id), func.max(Post.updated_at), func.max(Post.engaged_at)
+        ).filter_by(month_key=month_key, status='published').one()
+        validators = Validators('archive', month_key, count, last_id, updated_at, engaged_at,
+                                last_modified=max(filter(None, [updated_at, engaged_at]), default=None))
+        not_modified = validators.not_modified()
+        if not_modified:
+            return not_modified
+        
+        page = prerender.page('archive', month_key, not_before=updated_at)
+        if page is not None:
+            return validators.apply(make_response(page))
+        
+        # Get all posts for the month
+        all_posts = Post.query.filter_by(month_key=month_key, status='published').order_by(Post.published_at.desc()).all()
+        
+        # Use first 2 posts as featured for carousel
+        featured_posts = all_posts[:2] if len(all_posts) >= 2 else all_posts
+        
+        return validators.apply(make_response(render_template('archive.html', posts=all_posts, featured_posts=featured_posts, month_key=month_key)))
+    
+    @app.route('/post/<slug>')
+    @login_required
+    def post_detail(slug):
+        """Show full post with comments and likes"""
+        # Answer repeat visits from the post row alone. Every like, unlike and
+        # comment change bumps engaged_at, which covers the viewer's own like
+        # state as well; related_at moves when the related-posts list does.
+        state = db.session.query(
+            Post.id, Post.updated_at, Post.engaged_at, Post.like_count, Post.comment_count, Post.unique_viewer_count,
+            list_changed_at(Post.id).label('related_at')
+        ).filter_by(slug=slug, status='published').first_or_404()
+        validators = Validators('post', *state, last_modified=max(
+            filter(None, [state.updated_at, state.engaged_at, state.related_at]), default=None
+        ))
+        not_modified = validators.not_modified()
+        if not_modified:
+            return not_modified
+        
+        # Static copy with the per-user parts fetched by the page itself
+        page = prerender.page('post', slug, not_before=max(filter(None, [state.updated_at, state.related_at]), default=None))
+        if page is not None:
+            return validators.apply(make_response(page))
+        
+        # The compiled body and TOC are deferred on lists; load them with the row
+        post = Post.query.options(undefer(Post.compiled_html), undefer(Post.toc)).filter_by(
+            slug=slug, status='published'
+        ).first_or_404()
+        
+        # Get the first page of comments, the rest are fetched on demand
+        comments, next_comment_cursor = Comment.page(post.id)
+        
+        # Get like count (denormalized on the post row)
+        like_count = post.like_count
+        
+        # Check if current user liked
+        user_liked = False
+        if 'user_id' in session:
+            user_liked = Like.query.filter_by(post_id=post.id, user_id=session['user_id']).first() is not None
+        
+        # Precomputed by related.py: one indexed lookup
+        related_posts = related_for(post.id)
+        
+        return validators.apply(make_response(render_template('post.html', post=post, comments=comments, like_count=like_count, 
+                                                              user_liked=user_liked, next_comment_cursor=next_comment_cursor,
+                                                              related_posts=related_posts)))
+    
+    @app.context_processor
+    def inject_now():
+        """Make current year available in all templates"""
+        return {'now': datetime.utcnow()}
+    
+    @app.context_processor
+    def inject_months():
+        """Expose published month list for navigation and error pages."""
+        return {'months': published_months()}
+    
+    @app.errorhandler(404)
+    def not_found(e):
+        return render_template('404.html'), 404
+    
+    @app.errorhandler(500)
+    def server_error(e):
+        return render_template('500.html'), 500
 
 
-@app.errorhandler(500)
-def server_error(e):
-    return render_template('500.html'), 500
+def warm_up(app):
+    """Prime per-process caches and compile templates before taking traffic.
+    
+    Runs at the end of create_app() when WARM_UP is set. Under gunicorn
+    --preload that happens once in the master and the forked workers share
+    the result; otherwise every worker warms itself before it accepts
+    connections. Anything that fails here is retried lazily by the first
+    request, so errors are only logged.
+    """
+    for name in app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html')):
+        try:
+            app.jinja_env.get_template(name)
+        except Exception as e:
+            app.logger.error(f"Warm-up error (template {name}): {e}")
+    
+    with app.app_context():
+        from cache import published_months
+        try:
+            published_months()
+        except Exception as e:
+            app.logger.error(f"Warm-up error (published months): {e}")
+        
+        from oidc import oidc_cache
+        try:
+            oidc_cache.metadata()
+        except Exception as e:
+            app.logger.error(f"Warm-up error (OIDC metadata): {e}")
+
+
+def _after_fork_in_child():
+    # Pooled connections opened before a fork (gunicorn --preload, warm-up)
+    # belong to the parent. Drop them without closing the parent's sockets.
+    from models import db
+    for app in list(_apps):
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def __getattr__(name):
+    # gunicorn app:app and "from app import app" get a default application,
+    # created once on first access
+    if name == 'app':
+        app = create_app()
+        globals()['app'] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == '__main__':
+    from models import db
+    
+    app = create_app()
     with app.app_context():
         db.create_all()
     app.run(debug=True, host='0.0.0.0', port=5000)
-
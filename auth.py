@@ -7,6 +7,7 @@ from flask import Blueprint, session, redirect, url_for, request, flash, current
 from authlib.integrations.flask_client import OAuth
 from datetime import datetime
 from models import User, db
+from oidc import oidc_cache, CachedOAuth2App
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -17,12 +18,15 @@ oauth = OAuth()
 def init_oauth(app):
     """Initialize OAuth with app context"""
     oauth.init_app(app)
+    oidc_cache.init_app(app)
     
+    # Discovery metadata and signing keys come from the shared disk cache
+    # instead of being fetched by every worker on its first login
     oauth.register(
         name='entra',
         client_id=app.config['ENTRA_CLIENT_ID'],
         client_secret=app.config['ENTRA_CLIENT_SECRET'],
-        server_metadata_url=f"https://login.microsoftonline.com/{app.config['ENTRA_TENANT_ID']}/v2.0/.well-known/openid-configuration",
+        client_cls=CachedOAuth2App,
         client_kwargs={
             'scope': 'openid profile email'
         }
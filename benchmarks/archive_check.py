@@ -0,0 +1,129 @@
+"""
+Read-event archive round trip check
+
+Archives the same read events in several runs with shrinking retention
+windows, the way the nightly cron job does as a table ages, and checks that
+every event is still there afterwards: each id is either in the live table
+or read back exactly once by retention.iter_archived(), with its values
+intact.
+
+Event ids don't follow created_at (the seeded events are inserted in random
+time order, and real beacons arrive late), so each run writes files whose id
+ranges interleave with the earlier ones'. A small hand-made month covers the
+simplest such case, then a seeded data set covers the general one.
+
+    python benchmarks/archive_check.py [--reads 20000]
+
+Exits 1 when an event is missing, duplicated or changed.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Retention windows of the successive archive runs, in days
+RUNS = (365, 180, 90, 30, 10)
+
+
+def _snapshot():
+    from models import db, ReadEvent
+    
+    return {row[0]: tuple(row) for row in db.session.query(
+        ReadEvent.id, ReadEvent.post_id, ReadEvent.user_id, ReadEvent.percent, ReadEvent.seconds, ReadEvent.created_at
+    )}
+
+
+def _verify(label, expected):
+    """Compare the live table plus the archive with the events before archiving"""
+    from retention import iter_archived
+    
+    live = _snapshot()
+    archived = {}
+    duplicates = 0
+    for row in iter_archived():
+        if row[0] in archived:
+            duplicates += 1
+        archived[row[0]] = row
+    
+    missing = sorted(set(expected) - set(live) - set(archived))
+    changed = sorted(event_id for event_id, row in archived.items() if expected.get(event_id) != row)
+    both = sorted(set(live) & set(archived))
+    print(f"{label}: {len(live)} live, {len(archived)} archived, {len(missing)} missing, "
+          f"{duplicates} duplicated, {len(changed)} changed, {len(both)} in both")
+    return not (missing or duplicates or changed or both)
+
+
+def _reset(app, archive_dir):
+    from models import db
+    
+    db.drop_all()
+    db.create_all()
+    app.config['READ_EVENT_ARCHIVE_DIR'] = archive_dir
+
+
+def check_interleaved_month(app, archive_dir):
+    """Six events of one month whose ids run against their times"""
+    from models import db, User, Post, ReadEvent
+    from retention import archive_read_events
+    from rollup import run_rollup
+    
+    _reset(app, archive_dir)
+    db.session.add(User(entra_oid='check', email='check@example.com', name='Check'))
+    db.session.add(Post(slug='check', title='Check', month_key='2026-01', status='published'))
+    db.session.commit()
+    # A month two months back: ids 1, 3, 5, 6 early in it, 2 and 4 late
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    month = (today.replace(day=1) - timedelta(days=40)).replace(day=1)
+    for day in (5, 25, 5, 25, 5, 5):
+        db.session.add(ReadEvent(post_id=1, user_id=1, percent=50, seconds=30,
+                                 created_at=month.replace(day=day, hour=12)))
+    db.session.commit()
+    run_rollup()
+    expected = _snapshot()
+    
+    # First a cutoff between the two groups (the 15th), then one past both
+    for days in ((today - month.replace(day=15)).days, 0):
+        archive_read_events(days, chunk_size=5, pause=0)
+    return _verify('interleaved month', expected)
+
+
+def check_seeded(app, archive_dir, reads):
+    from seed import seed
+    from retention import archive_read_events
+    
+    _reset(app, archive_dir)
+    seed(posts=60, users=40, likes=200, comments=100, reads=reads, months=12)
+    expected = _snapshot()
+    
+    for days in RUNS:
+        archive_read_events(days, chunk_size=1000, pause=0)
+    return _verify('seeded', expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that archived read events read back complete')
+    parser.add_argument('--reads', type=int, default=20000, help='read events in the seeded data set')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        # Before the app is imported: config.py reads it at import time
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'check.db')}"
+        from app import create_app
+        
+        app = create_app(web=False)
+        with app.app_context():
+            ok = check_interleaved_month(app, os.path.join(tmp, 'archive-interleaved'))
+            ok = check_seeded(app, os.path.join(tmp, 'archive-seeded'), args.reads) and ok
+    
+    if not ok:
+        print("✗ Archived read events were lost or duplicated")
+        sys.exit(1)
+    print("✓ Every read event is live or archived exactly once")
+
+
+if __name__ == '__main__':
+    main()
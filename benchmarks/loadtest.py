@@ -0,0 +1,295 @@
+"""
+Load-test driver and latency report
+
+Exercises the real routes against a seeded database (see seed.py) and
+reports p50/p95/p99 latency, throughput and SQL queries per request for
+each endpoint. Two modes:
+
+- in-process (default): the Flask test client, one request at a time, with
+  SQL statements counted through an engine event
+- --url http://127.0.0.1:8000: a running gunicorn, with --concurrency
+  threads; query counts are not available in this mode
+
+Login is bypassed by signing a session cookie with the app's SECRET_KEY, so
+the server under test must use the same key (and have the seeded admin,
+bench-admin@example.com, in ADMIN_EMAILS for the admin endpoints).
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/loadtest.py --save-baseline
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/loadtest.py --compare
+
+--compare reports the change against benchmarks/baseline.json and exits
+non-zero if an endpoint's p95 or query count regressed beyond --tolerance.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from seed import ADMIN_EMAIL, zipf_weights  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+class Targets:
+    """Month keys, posts and users to spread the requests over"""
+    
+    def __init__(self, rng):
+        from models import db, User, Post
+        
+        self.rng = rng
+        self.months = [m for (m,) in db.session.query(Post.month_key).filter_by(status='published').distinct()]
+        # Popular posts are requested more often, like real traffic
+        posts = db.session.query(Post.id, Post.slug).filter_by(status='published').order_by(
+            Post.unique_viewer_count.desc(), Post.id
+        ).all()
+        self.posts = posts
+        self.post_weights = zipf_weights(len(posts))
+        self.user_ids = [uid for (uid,) in db.session.query(User.id).filter(User.email != ADMIN_EMAIL)]
+        admin = User.query.filter_by(email=ADMIN_EMAIL).first()
+        if not (self.months and self.posts and self.user_ids and admin):
+            raise RuntimeError('No benchmark data found; run benchmarks/seed.py first')
+        self.admin = (admin.id, admin.name)
+    
+    def post(self):
+        return self.rng.choices(self.posts, weights=self.post_weights, k=1)[0]
+    
+    def month(self):
+        return self.rng.choice(self.months)
+
+
+def build_endpoints(targets, rng):
+    """name -> (method, admin?, request factory returning (path, json body))"""
+    words = ['startup', 'data', 'product', 'engineering', 'growth', 'design', 'model']
+    return {
+        'index': ('GET', False, lambda: ('/', None)),
+        'archive': ('GET', False, lambda: (f'/archive/{targets.month()}', None)),
+        'post_detail': ('GET', False, lambda: (f'/post/{targets.post().slug}', None)),
+        'api_comments': ('GET', False, lambda: (f'/api/comments/{targets.post().id}', None)),
+        'api_search': ('GET', False, lambda: (f'/api/search?q={rng.choice(words)}', None)),
+        'api_like': ('POST', False, lambda: (f'/api/like/{targets.post().id}', None)),
+        'api_comment': ('POST', False, lambda: (f'/api/comment/{targets.post().id}', {'body': 'Benchmark comment'})),
+        'api_read_event': ('POST', False, lambda: (f'/api/read-event/{targets.post().id}',
+                                                   {'percent': rng.randint(0, 100), 'seconds': rng.randint(1, 300)})),
+        'api_beacon': ('POST', False, lambda: ('/api/beacon', {
+            'k': f'bench.{rng.getrandbits(64):016x}',
+            'e': [[targets.post().id, rng.randint(0, 100), rng.randint(1, 300), seq] for seq in range(1, 4)],
+        })),
+        'admin_dashboard': ('GET', True, lambda: ('/admin/', None)),
+        'admin_post_stats': ('GET', True, lambda: (f'/admin/posts/{targets.post().id}/stats', None)),
+    }
+
+
+def check_status(name, method, path, status):
+    """Fail on errors and on redirects (a login or admin check that bounced)"""
+    if status >= 400 or (300 <= status < 400 and name != 'index'):
+        raise RuntimeError(f'{name}: {method} {path} returned {status}')
+
+
+def session_data(user_id, user_name, is_admin):
+    return {'user_id': user_id, 'user_name': user_name, 'is_admin': is_admin, '_permanent': True}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[max(0, rank - 1)]
+
+
+def summarize(latencies, elapsed, queries):
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'queries': round(sum(queries) / len(queries), 1) if queries else None,
+    }
+
+
+class QueryCounter:
+    """Counts SQL statements executed on the app's engines"""
+    
+    def __init__(self, app):
+        from sqlalchemy import event
+        from models import db
+        
+        self.count = 0
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._on_execute)
+    
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def run_in_process(requests_per_endpoint, targets_seed, only):
+    from app import create_app
+    from models import db
+    
+    app = create_app()
+    app.config['ADMIN_EMAILS'] = list(app.config['ADMIN_EMAILS']) + [ADMIN_EMAIL]
+    counter = QueryCounter(app)
+    rng = random.Random(targets_seed)
+    
+    with app.app_context():
+        targets = Targets(rng)
+        user_sessions = [session_data(uid, f'Bench User {uid}', False) for uid in targets.user_ids[:50]]
+        admin_session = session_data(targets.admin[0], targets.admin[1], True)
+        endpoints = build_endpoints(targets, rng)
+        db.session.remove()
+    
+    results = {}
+    client = app.test_client()
+    for name, (method, admin, make_request) in endpoints.items():
+        if only and name not in only:
+            continue
+        latencies, queries = [], []
+        # A few unmeasured requests first, so one-off costs don't skew p99
+        for measured in [False] * 3 + [True] * requests_per_endpoint:
+            with client.session_transaction() as sess:
+                sess.clear()
+                sess.update(admin_session if admin else rng.choice(user_sessions))
+            path, body = make_request()
+            counter.count = 0
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            latency = (time.perf_counter() - started) * 1000
+            check_status(name, method, path, response.status_code)
+            if measured:
+                latencies.append(latency)
+                queries.append(counter.count)
+        results[name] = summarize(latencies, sum(latencies) / 1000, queries)
+    return results
+
+
+def run_against_server(base_url, targets_seed, requests_per_endpoint, concurrency, only):
+    import requests
+    from app import create_app
+    
+    app = create_app()
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookie_name = app.config['SESSION_COOKIE_NAME']
+    rng = random.Random(targets_seed)
+    
+    with app.app_context():
+        targets = Targets(rng)
+        user_cookies = [serializer.dumps(session_data(uid, f'Bench User {uid}', False)) for uid in targets.user_ids[:50]]
+        admin_cookie = serializer.dumps(session_data(targets.admin[0], targets.admin[1], True))
+        endpoints = build_endpoints(targets, rng)
+    
+    local = threading.local()
+    lock = threading.Lock()
+    
+    def send(name, method, admin, make_request):
+        if not hasattr(local, 'http'):
+            local.http = requests.Session()
+        with lock:  # the shared Random is not thread-safe
+            path, body = make_request()
+            cookie = admin_cookie if admin else rng.choice(user_cookies)
+        # Drop cookies the previous response set; only the forged one counts
+        local.http.cookies.clear()
+        started = time.perf_counter()
+        response = local.http.request(method, base_url.rstrip('/') + path, json=body,
+                                      cookies={cookie_name: cookie}, allow_redirects=False)
+        latency = (time.perf_counter() - started) * 1000
+        check_status(name, method, path, response.status_code)
+        return latency
+    
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for name, (method, admin, make_request) in endpoints.items():
+            if only and name not in only:
+                continue
+            list(pool.map(lambda _: send(name, method, admin, make_request), range(concurrency)))
+            started = time.perf_counter()
+            latencies = list(pool.map(lambda _: send(name, method, admin, make_request), range(requests_per_endpoint)))
+            results[name] = summarize(latencies, time.perf_counter() - started, [])
+    return results
+
+
+def _delta(current, previous):
+    if current is None or not previous:
+        return ''
+    return f'{(current - previous) / previous * 100:+.0f}%'
+
+
+def report(results, baseline=None, tolerance=0.2):
+    """Print the table; returns the names of regressed endpoints"""
+    header = f"{'endpoint':<18}{'n':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'queries':>9}"
+    if baseline:
+        header += f"{'Δp50':>8}{'Δp95':>8}{'Δqueries':>10}"
+    print(header)
+    print('-' * len(header))
+    
+    regressions = []
+    for name, row in results.items():
+        queries = '-' if row['queries'] is None else f"{row['queries']:g}"
+        line = (f"{name:<18}{row['requests']:>6}{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}"
+                f"{row['p99_ms']:>9.1f}{row['rps'] or 0:>9.1f}{queries:>9}")
+        previous = (baseline or {}).get(name)
+        if previous:
+            line += (f"{_delta(row['p50_ms'], previous['p50_ms']):>8}{_delta(row['p95_ms'], previous['p95_ms']):>8}"
+                     f"{_delta(row['queries'], previous.get('queries')):>10}")
+            slower = row['p95_ms'] > previous['p95_ms'] * (1 + tolerance)
+            # Averages wobble when an endpoint has branches (like/unlike);
+            # a whole extra query per request is a real change
+            more_queries = (row['queries'] is not None and previous.get('queries') is not None
+                            and row['queries'] >= previous['queries'] + 1)
+            if slower or more_queries:
+                regressions.append(name)
+                line += '  ✗'
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the blog endpoints')
+    parser.add_argument('--url', help='benchmark a running server instead of the in-process test client')
+    parser.add_argument('--requests', type=int, default=100, help='measured requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads with --url')
+    parser.add_argument('--endpoint', action='append', help='only run these endpoints (repeatable)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the request mix')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--compare', action='store_true', help='compare with the baseline, exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown (0.2 = 20%%)')
+    args = parser.parse_args()
+    
+    if args.url:
+        results = run_against_server(args.url, args.seed, args.requests, args.concurrency, args.endpoint)
+    else:
+        results = run_in_process(args.requests, args.seed, args.endpoint)
+    
+    baseline = None
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['endpoints']
+    regressions = report(results, baseline, args.tolerance)
+    
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+                'mode': args.url or 'test-client',
+                'requests': args.requests,
+                'endpoints': results,
+            }, f, indent=2)
+        print(f"\n✓ Baseline saved to {args.baseline}")
+    
+    if regressions:
+        print(f"\n✗ Regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
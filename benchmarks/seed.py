@@ -0,0 +1,228 @@
+"""
+Synthetic data generator for the benchmarks
+
+Fills a database with N posts, M users and K likes, comments and read events.
+Engagement is skewed the way real traffic is: post popularity and user
+activity both follow a Zipf-like distribution, so a handful of posts collect
+most of the reads and likes while the long tail gets a few each. Posts are
+spread over the last --months months.
+
+Rows are bulk inserted, then the engagement counters, the read rollups and
+the search index are rebuilt so every page sees consistent data.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/seed.py --posts 500 --users 200
+
+The target database must be empty unless --force is given.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The first seeded user; add it to ADMIN_EMAILS on a server under test
+ADMIN_EMAIL = 'bench-admin@example.com'
+SLUG_PREFIX = 'bench-post-'
+
+CATEGORIES = ['Startups', 'AI', 'Engineering', 'Product', 'Design', 'Leadership', 'Events']
+WORDS = (
+    'startup founder product market growth team engineering model data search '
+    'design culture hiring scale customer revenue launch feedback research '
+    'latency cache database query index worker deploy release insight story '
+    'lesson mentor strategy vision pivot funding metric experiment prototype'
+).split()
+
+BATCH_SIZE = 5000
+
+
+def zipf_weights(n, exponent=1.1):
+    """Weights for ranks 1..n, heaviest first"""
+    return [1.0 / (rank ** exponent) for rank in range(1, n + 1)]
+
+
+def _sentence(rng, length):
+    words = [rng.choice(WORDS) for _ in range(length)]
+    return ' '.join(words).capitalize() + '.'
+
+
+def _html_body(rng):
+    """A post body of a few hundred to a few thousand words"""
+    paragraphs = max(3, int(rng.lognormvariate(2.3, 0.6)))
+    parts = []
+    for i in range(paragraphs):
+        if i and i % 4 == 0:
+            parts.append(f'<h2>{_sentence(rng, rng.randint(3, 7))}</h2>')
+        text = ' '.join(_sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(3, 6)))
+        parts.append(f'<p>{text}</p>')
+    return '\n'.join(parts)
+
+
+def _month_start(now, months_back):
+    year, month = now.year, now.month - months_back
+    while month <= 0:
+        month += 12
+        year -= 1
+    return datetime(year, month, 1)
+
+
+def _bulk_insert(db, table, rows):
+    from sqlalchemy import insert
+    
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(table), rows[start:start + BATCH_SIZE])
+    db.session.commit()
+
+
+def seed(posts=500, users=200, likes=20000, comments=5000, reads=100000, months=24, random_seed=1, force=False):
+    """Generate the data set in the current app context. Returns row counts."""
+    from models import db, User, Post, Like, Comment, ReadEvent
+    
+    if not force and db.session.query(Post.id).first() is not None:
+        raise RuntimeError('The database already has posts; use --force to add benchmark data anyway')
+    
+    rng = random.Random(random_seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    
+    # Users: the first one is the benchmark admin
+    user_rows = [{
+        'entra_oid': f'bench-user-{i}',
+        'email': ADMIN_EMAIL if i == 0 else f'bench-user-{i}@example.com',
+        'name': f'Bench User {i}',
+        'created_at': now - timedelta(days=rng.randint(0, 720)),
+    } for i in range(users)]
+    _bulk_insert(db, User.__table__, user_rows)
+    user_ids = [uid for (uid,) in db.session.query(User.id).filter(User.entra_oid.like('bench-user-%')).order_by(User.id)]
+    
+    # Posts spread over the last `months` months, newest month first
+    post_rows = []
+    for i in range(posts):
+        month_start = _month_start(now, rng.randrange(months))
+        published_at = min(now, month_start + timedelta(days=rng.randint(0, 27), hours=rng.randint(0, 23)))
+        title = _sentence(rng, rng.randint(4, 10)).rstrip('.')
+        body = _html_body(rng)
+        post_rows.append({
+            'slug': f'{SLUG_PREFIX}{i}',
+            'title': title,
+            'excerpt': _sentence(rng, rng.randint(15, 30)),
+            'category': rng.choice(CATEGORIES),
+            'month_key': published_at.strftime('%Y-%m'),
+            'status': 'draft' if rng.random() < 0.05 else 'published',
+            'published_at': published_at,
+            'html_content': body,
+            'read_time': max(1, len(body.split()) // 200),
+            'created_at': published_at,
+            'updated_at': published_at,
+        })
+    _bulk_insert(db, Post.__table__, post_rows)
+    published = db.session.query(Post.id, Post.published_at).filter(
+        Post.slug.like(f'{SLUG_PREFIX}%'), Post.status == 'published'
+    ).all()
+    
+    # Popularity ranks are shuffled so they don't follow the post ids
+    post_pool = list(published)
+    rng.shuffle(post_pool)
+    post_weights = zipf_weights(len(post_pool))
+    user_pool = list(user_ids)
+    rng.shuffle(user_pool)
+    user_weights = zipf_weights(len(user_pool), exponent=0.8)
+    
+    def pick_posts(k):
+        return rng.choices(post_pool, weights=post_weights, k=k)
+    
+    def pick_users(k):
+        return rng.choices(user_pool, weights=user_weights, k=k)
+    
+    def after(published_at):
+        span = max(60, int((now - published_at).total_seconds()))
+        return published_at + timedelta(seconds=rng.randrange(span))
+    
+    # Likes: unique per post and user (capped well below every possible
+    # pair, which skewed sampling would take very long to fill)
+    like_rows = []
+    seen = set()
+    max_likes = min(likes, len(post_pool) * len(user_pool) // 2)
+    while len(like_rows) < max_likes:
+        for (post_id, published_at), user_id in zip(pick_posts(max_likes), pick_users(max_likes)):
+            if (post_id, user_id) in seen:
+                continue
+            seen.add((post_id, user_id))
+            like_rows.append({'post_id': post_id, 'user_id': user_id, 'created_at': after(published_at)})
+            if len(like_rows) >= max_likes:
+                break
+    _bulk_insert(db, Like.__table__, like_rows)
+    
+    comment_rows = [{
+        'post_id': post_id,
+        'user_id': user_id,
+        'body': _sentence(rng, rng.randint(5, 40)),
+        'created_at': after(published_at),
+    } for (post_id, published_at), user_id in zip(pick_posts(comments), pick_users(comments))]
+    _bulk_insert(db, Comment.__table__, comment_rows)
+    
+    # Read events: most readers bounce early, some finish the post
+    read_rows = []
+    for (post_id, published_at), user_id in zip(pick_posts(reads), pick_users(reads)):
+        percent = 100 if rng.random() < 0.25 else min(99, int(rng.expovariate(1 / 30)))
+        read_rows.append({
+            'post_id': post_id,
+            'user_id': user_id,
+            'percent': percent,
+            'seconds': int(percent * rng.uniform(1.0, 4.0)),
+            'created_at': after(published_at),
+        })
+    _bulk_insert(db, ReadEvent.__table__, read_rows)
+    
+    # Derived data the pages read
+    from counters import reconcile_counters
+    from rollup import run_rollup
+    import search
+    
+    reconcile_counters()
+    run_rollup()
+    if search.is_supported():
+        search.rebuild_index()
+    db.session.commit()
+    
+    return {
+        'users': len(user_rows),
+        'posts': len(post_rows),
+        'likes': len(like_rows),
+        'comments': len(comment_rows),
+        'read_events': len(read_rows),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic benchmark data')
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--likes', type=int, default=20000)
+    parser.add_argument('--comments', type=int, default=5000)
+    parser.add_argument('--reads', type=int, default=100000)
+    parser.add_argument('--months', type=int, default=24, help='spread posts over this many months')
+    parser.add_argument('--seed', type=int, default=1, help='random seed, for repeatable data sets')
+    parser.add_argument('--force', action='store_true', help='seed even if the database has posts')
+    args = parser.parse_args()
+    
+    from app import create_app
+    from models import db
+    
+    app = create_app(web=False)
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        counts = seed(args.posts, args.users, args.likes, args.comments, args.reads,
+                      months=args.months, random_seed=args.seed, force=args.force)
+        elapsed = time.perf_counter() - started
+    
+    for name, count in counts.items():
+        print(f"✓ {count} {name}")
+    print(f"✓ Seeded {app.config['SQLALCHEMY_DATABASE_URI']} in {elapsed:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
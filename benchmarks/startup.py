@@ -0,0 +1,120 @@
+"""
+Worker startup benchmark: import -> create_app() -> first response
+
+Each run starts a fresh interpreter (like a new gunicorn worker), imports
+the app module, builds the application and serves one logged-in archive
+page through the test client against a small seeded SQLite database.
+Timings are reported per phase, with and without the warm-up step, so the
+cost moved from the first request into startup is visible.
+
+    python benchmarks/startup.py [--runs 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child interpreter; prints one JSON line of timings (ms)
+CHILD = r'''
+import json, os, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, os.environ['BENCH_ROOT'])
+import app as app_module
+t1 = time.perf_counter()
+app = app_module.create_app()
+t2 = time.perf_counter()
+client = app.test_client()
+with client.session_transaction() as sess:
+    sess['user_id'] = 1
+    sess['user_name'] = 'Bench'
+response = client.get('/archive/2026-01')
+t3 = time.perf_counter()
+response = client.get('/archive/2026-01', headers={'Cache-Control': 'no-cache'})
+t4 = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({
+    'import': (t1 - t0) * 1000,
+    'create_app': (t2 - t1) * 1000,
+    'first_response': (t3 - t2) * 1000,
+    'total': (t3 - t0) * 1000,
+    'second_response': (t4 - t3) * 1000,
+}))
+'''
+
+PHASES = ('import', 'create_app', 'first_response', 'total', 'second_response')
+
+
+def seed_database(path):
+    """Create the schema and a few published posts in a fresh database"""
+    script = r'''
+import os, sys
+from datetime import datetime
+sys.path.insert(0, os.environ['BENCH_ROOT'])
+from app import create_app
+from models import db, User, Post
+app = create_app(web=False)
+with app.app_context():
+    db.create_all()
+    db.session.add(User(entra_oid='bench', email='bench@example.com', name='Bench'))
+    for i in range(20):
+        db.session.add(Post(slug=f'bench-{i}', title=f'Benchmark post {i}', month_key='2026-01',
+                            status='published', published_at=datetime(2026, 1, 1 + i),
+                            excerpt='Benchmark excerpt', html_content='<p>Benchmark body</p>' * 50))
+    db.session.commit()
+'''
+    subprocess.run([sys.executable, '-c', script], env=_env(path, warm_up=False), check=True, cwd=ROOT)
+
+
+def _env(db_path, warm_up):
+    env = dict(os.environ)
+    env.update({
+        'BENCH_ROOT': ROOT,
+        'DATABASE_URL': f'sqlite:///{db_path}',
+        'WARM_UP': 'true' if warm_up else 'false',
+        'CONTENT_GENERATION_FILE': os.path.join(os.path.dirname(db_path), 'content_generation'),
+        # Keep the warm-up's OIDC step off the network
+        'OIDC_CACHE_FILE': os.path.join(os.path.dirname(db_path), 'oidc_cache.json'),
+        'OIDC_METADATA_URL': 'http://127.0.0.1:9/.well-known/openid-configuration',
+        'OIDC_HTTP_TIMEOUT': '0.2',
+    })
+    return env
+
+
+def run(db_path, warm_up, runs):
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', CHILD], env=_env(db_path, warm_up),
+                                capture_output=True, text=True, cwd=ROOT)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else 'child failed')
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {phase: [s[phase] for s in samples] for phase in PHASES}
+
+
+def report(label, timings):
+    print(f"\n{label}")
+    print(f"  {'phase':<16}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for phase in PHASES:
+        values = timings[phase]
+        print(f"  {phase:<16}{statistics.median(values):>12.1f}{min(values):>10.1f}{max(values):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters per mode')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        seed_database(db_path)
+        report('Without warm-up (WARM_UP=false)', run(db_path, False, args.runs))
+        report('With warm-up (WARM_UP=true)', run(db_path, True, args.runs))
+
+
+if __name__ == '__main__':
+    main()
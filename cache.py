@@ -0,0 +1,120 @@
+"""
+Process-local cache for navigation data, versioned by a content generation
+
+The published-months menu is needed on every page but only changes when a
+post is created, edited or deleted. Each worker keeps its own copy and checks
+a small generation file shared by all gunicorn workers: the admin views bump
+it after committing a post change, and every worker drops its cached values
+as soon as it sees the file change. The check is a single os.stat().
+"""
+import os
+import tempfile
+import threading
+from datetime import datetime
+from models import db, Post
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+
+class ContentCache:
+    """Values cached per worker until the shared content generation changes"""
+    
+    def __init__(self, app=None):
+        self.path = None
+        self._lock = threading.Lock()
+        self._signature = None
+        self._generation = 0
+        self._values = {}
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """Locate the generation file (instance folder by default)"""
+        self.path = app.config.get('CONTENT_GENERATION_FILE') or os.path.join(app.instance_path, 'content_generation')
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        app.extensions['content_cache'] = self
+    
+    def _stat_signature(self):
+        # The file is replaced on every bump, so the inode changes even if
+        # two workers race and write the same number.
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    
+    def _sync(self):
+        """Drop cached values if another worker bumped the generation"""
+        signature = self._stat_signature()
+        if signature == self._signature:
+            return
+        with self._lock:
+            self._values.clear()
+            self._generation = self._read_generation()
+            self._signature = signature
+    
+    def _read_generation(self):
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+    
+    def generation(self):
+        """Current content generation number"""
+        self._sync()
+        return self._generation
+    
+    def changed_at(self):
+        """UTC time of the last generation bump, or None if there never was one"""
+        self._sync()
+        if self._signature is None:
+            return None
+        return datetime.utcfromtimestamp(self._signature[1] / 1e9)
+    
+    def get(self, key, loader):
+        """Return the cached value for key, calling loader() on a miss"""
+        self._sync()
+        signature = self._signature
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        value = loader()
+        with self._lock:
+            # Don't keep a value loaded while a bump was in progress
+            if self._signature == signature:
+                self._values[key] = value
+        return value
+    
+    def bump(self):
+        """Start a new content generation. Call after committing a content change."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with open(self.path + '.lock', 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            generation = self._read_generation() + 1
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.content_generation')
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(generation))
+            os.replace(tmp_path, self.path)
+        
+        with self._lock:
+            self._values.clear()
+            self._signature = None
+        return generation
+
+
+content_cache = ContentCache()
+
+
+def published_months():
+    """Published month keys, newest first, for the navigation menu"""
+    def load():
+        months = db.session.query(Post.month_key).filter_by(status='published').distinct().order_by(Post.month_key.desc()).all()
+        return [m[0] for m in months]
+    
+    return content_cache.get('months', load)
@@ -5,11 +5,52 @@ import os
 from datetime import timedelta
 
 
+# Database engine profiles, per dialect (applied by db_engine.py). SQLite
+# pragmas are set on every new connection; engine_options go to
+# SQLALCHEMY_ENGINE_OPTIONS.
+ENGINE_PROFILES = {
+    'development': {
+        'sqlite': {
+            'pragmas': {
+                'busy_timeout': 5000,  # ms to wait for a write lock
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+            },
+        },
+        'postgresql': {
+            'engine_options': {'pool_size': 5, 'max_overflow': 5, 'pool_pre_ping': True, 'pool_recycle': 1800},
+        },
+    },
+    'production': {
+        'sqlite': {
+            'pragmas': {
+                'busy_timeout': 15000,
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',  # durable with WAL except on power loss
+                'mmap_size': 256 * 1024 * 1024,
+                'cache_size': -64000,  # KiB per connection
+                'temp_store': 'MEMORY',
+            },
+        },
+        'postgresql': {
+            'engine_options': {
+                'pool_size': 10,       # per gunicorn worker
+                'max_overflow': 10,
+                'pool_timeout': 10,
+                'pool_pre_ping': True,
+                'pool_recycle': 1800,  # below typical server/proxy idle timeouts
+            },
+        },
+    },
+}
+
+
 class Config:
     """Base configuration"""
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///blogsite.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DB_ENGINE_PROFILE = os.environ.get('DB_ENGINE_PROFILE', 'development')
     
     # Session configuration
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)
@@ -21,15 +62,65 @@ class Config:
     UPLOAD_FOLDER = 'uploads'
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))  # processes for resizing uploads
+    IMAGE_SIZES = {'card': 600, 'hero': 1200}  # derivative widths in pixels
     
     # Entra ID
-    ENTRA_CLIENT_ID = os.environ.get('CLIENT_ID', '')
+    ENTRA_CLIENT_ID = os.environ.get('CLIENT_ID', '423dd38a-439a-4b99-a313-9472d2c0dad6')
     ENTRA_CLIENT_SECRET = os.environ.get('CLIENT_SECRET', '')
-    ENTRA_TENANT_ID = os.environ.get('TENANT_ID', '')
+    ENTRA_TENANT_ID = os.environ.get('TENANT_ID', '6b8b8296-bdff-4ad8-93ad-84bcbf3842f5')
     ENTRA_REDIRECT_URI = os.environ.get('REDIRECT_URI', 'http://localhost:5000/auth/callback')
-    ENTRA_AUTHORITY = f"https://login.microsoftonline.com/{os.environ.get('TENANT_ID', '')}"
+    ENTRA_AUTHORITY = f"https://login.microsoftonline.com/{ENTRA_TENANT_ID}"
     ENTRA_SCOPE = ['openid', 'profile', 'email']
     
+    # OIDC discovery/JWKS cache shared by workers (defaults to instance/oidc_cache.json)
+    OIDC_METADATA_URL = os.environ.get('OIDC_METADATA_URL')  # override for a local stand-in
+    OIDC_CACHE_FILE = os.environ.get('OIDC_CACHE_FILE')
+    OIDC_METADATA_TTL = int(os.environ.get('OIDC_METADATA_TTL', 24 * 3600))  # seconds
+    OIDC_REFRESH_MARGIN = int(os.environ.get('OIDC_REFRESH_MARGIN', 3600))  # refresh in background this early
+    OIDC_HTTP_TIMEOUT = float(os.environ.get('OIDC_HTTP_TIMEOUT', 5))
+    
+    # Read-event write-behind buffer (per worker)
+    READ_EVENT_BUFFER_SIZE = int(os.environ.get('READ_EVENT_BUFFER_SIZE', 10000))  # queued events before 429
+    READ_EVENT_BATCH_SIZE = int(os.environ.get('READ_EVENT_BATCH_SIZE', 500))
+    READ_EVENT_FLUSH_INTERVAL = float(os.environ.get('READ_EVENT_FLUSH_INTERVAL', 2.0))  # seconds, 0 = write-through
+    BEACON_KEY_TTL_HOURS = int(os.environ.get('BEACON_KEY_TTL_HOURS', 48))  # idempotency keys kept, pruned by rollup.py
+    ROLLUP_REQUEST_CHUNK = int(os.environ.get('ROLLUP_REQUEST_CHUNK', 2000))  # events an admin page view folds in; cron does the rest
+    ROLLUP_SAFETY_LAG_SECONDS = int(os.environ.get('ROLLUP_SAFETY_LAG_SECONDS', 60))  # events younger than this wait for the next run
+    
+    # Raw read events older than this (and rolled up) move to gzip NDJSON files (retention.py)
+    READ_EVENT_RETENTION_DAYS = int(os.environ.get('READ_EVENT_RETENTION_DAYS', 90))
+    READ_EVENT_ARCHIVE_DIR = os.environ.get('READ_EVENT_ARCHIVE_DIR')  # defaults to instance/archive/read_events
+    READ_EVENT_ARCHIVE_CHUNK = int(os.environ.get('READ_EVENT_ARCHIVE_CHUNK', 5000))  # rows per file and DELETE
+    READ_EVENT_ARCHIVE_PAUSE = float(os.environ.get('READ_EVENT_ARCHIVE_PAUSE', 0.05))  # seconds between chunks
+    
+    # Shared content generation file checked by every worker (defaults to instance/)
+    CONTENT_GENERATION_FILE = os.environ.get('CONTENT_GENERATION_FILE')
+    
+    # Per-request SQL instrumentation (sql_metrics.py)
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', 'true').lower() == 'true'
+    SQL_SERVER_TIMING = os.environ.get('SQL_SERVER_TIMING', 'true').lower() == 'true'
+    SQL_SLOW_REQUEST_MS = float(os.environ.get('SQL_SLOW_REQUEST_MS', 500))  # log requests slower than this
+    SQL_MAX_QUERIES = int(os.environ.get('SQL_MAX_QUERIES', 30))  # log requests running more statements
+    SQL_N_PLUS_ONE_THRESHOLD = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5))  # repeats of one statement shape
+    
+    # Prometheus metrics at /metrics (metrics.py); workers share METRICS_DIR (defaults to instance/metrics)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5.0))  # seconds between worker snapshots
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # require "Authorization: Bearer <token>" when set
+    
+    # Static pre-rendered archive/post pages (prerender.py), in PRERENDER_DIR (defaults to instance/prerendered)
+    PRERENDER_ENABLED = os.environ.get('PRERENDER_ENABLED', 'false').lower() == 'true'
+    PRERENDER_DIR = os.environ.get('PRERENDER_DIR')
+    
+    # Precomputed related posts (related.py): list length and the share of content vs co-reading
+    RELATED_POSTS_COUNT = int(os.environ.get('RELATED_POSTS_COUNT', 5))
+    RELATED_CONTENT_WEIGHT = float(os.environ.get('RELATED_CONTENT_WEIGHT', 0.6))  # at least this much TF-IDF
+    
+    # Compile templates and prime caches in create_app() before serving
+    WARM_UP = os.environ.get('WARM_UP', 'false').lower() == 'true'
+    
     # Admin emails
     ADMIN_EMAILS = [email.strip() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()]
 
@@ -44,7 +135,16 @@ class ProductionConfig(Config):
     """Production configuration"""
     DEBUG = False
     FLASK_ENV = 'production'
-    SESSION_COOKIE_SECURE = True
+    DB_ENGINE_PROFILE = os.environ.get('DB_ENGINE_PROFILE', 'production')
+    WARM_UP = os.environ.get('WARM_UP', 'true').lower() == 'true'
+    # Set SESSION_COOKIE_SECURE=false while the site is served over plain HTTP
+    SESSION_COOKIE_SECURE = os.environ.get('SESSION_COOKIE_SECURE', 'true').lower() == 'true'
+
+
+def get_config(name=None):
+    """Config class for name, FLASK_CONFIG or FLASK_ENV (development by default)"""
+    name = name or os.environ.get('FLASK_CONFIG') or os.environ.get('FLASK_ENV') or 'default'
+    return config.get(name, config['default'])
 
 
 config = {
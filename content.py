@@ -0,0 +1,380 @@
+"""
+Publish-time compilation of post HTML
+
+The editor's HTML (Post.html_content) is kept as the source. When a post is
+saved, compile_post() derives everything the pages need from it, once:
+
+- compiled_html: the body with only allowed tags and attributes (scripts,
+  event handlers and javascript: URLs removed), unclosed tags closed,
+  whitespace between blocks minified, ids on h2/h3 headings, and
+  loading="lazy" plus the intrinsic width/height on every <img> whose
+  file is local, so the page doesn't shift as images arrive
+- toc: the h2/h3 headings as [{'level', 'id', 'text'}]
+- word_count and read_time (WORDS_PER_MINUTE)
+- excerpt, from the first paragraph, unless the author wrote one
+
+post.html renders compiled_html as-is. Posts saved before this existed
+fall back to the source until they are compiled.
+
+python content.py compiles every post whose artifact is missing or was
+made by an older COMPILER_VERSION, over a process pool (--all recompiles
+everything, --workers N sets the pool size).
+"""
+import json
+import math
+import multiprocessing
+import os
+import re
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from html import escape
+from html.parser import HTMLParser
+from sqlalchemy.orm.attributes import flag_modified
+
+# Bump when the output changes, so `python content.py` recompiles old posts
+COMPILER_VERSION = 1
+
+WORDS_PER_MINUTE = 200
+EXCERPT_LENGTH = 200
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'caption', 'cite', 'code', 'del', 'div', 'em', 'figcaption',
+    'figure', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'ins', 'li', 'mark', 'ol', 'p',
+    'picture', 'pre', 's', 'small', 'source', 'span', 'strong', 'sub', 'sup', 'table', 'tbody', 'td',
+    'tfoot', 'th', 'thead', 'tr', 'u', 'ul',
+}
+ALLOWED_ATTRIBUTES = {
+    '*': {'class', 'id', 'title'},
+    'a': {'href', 'target', 'rel'},
+    'img': {'src', 'alt', 'width', 'height', 'srcset', 'sizes'},
+    'source': {'srcset', 'type', 'media', 'sizes'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan', 'scope'},
+    'ol': {'start'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+ALLOWED_SCHEMES = {'http', 'https', 'mailto'}
+# Removed together with everything inside them
+DROPPED_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'noscript', 'template', 'form', 'textarea', 'select'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+# Whitespace next to these is not rendered, so it can go
+BLOCK_TAGS = {
+    'blockquote', 'br', 'caption', 'div', 'figcaption', 'figure', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'hr', 'li', 'ol', 'p', 'picture', 'pre', 'source', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead',
+    'tr', 'ul',
+}
+TOC_LEVELS = {'h2': 2, 'h3': 3}
+
+_WHITESPACE = re.compile(r'\s+')
+_WORD = re.compile(r"\w[\w'’-]*")
+
+
+def slugify(text):
+    """Heading text -> an id usable in a URL fragment"""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-') or 'section'
+
+
+def _safe_url(value):
+    # Browsers ignore whitespace and control characters in the scheme
+    url = re.sub(r'[\x00-\x20]', '', value)
+    scheme = url.split(':', 1)[0].lower() if ':' in url.split('/', 1)[0] else None
+    return scheme is None or scheme in ALLOWED_SCHEMES
+
+
+def image_size(src):
+    """(width, height) of a local image referenced by URL path, or None"""
+    if not src.startswith(('/uploads/', '/assets/')) or '..' in src:
+        return None
+    path = src.split('?', 1)[0].lstrip('/')
+    try:
+        from PIL import Image
+        with Image.open(path) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+class _Compiler(HTMLParser):
+    """Single pass over the source HTML producing the compiled parts"""
+    
+    def __init__(self, image_sizes=None):
+        super().__init__(convert_charrefs=True)
+        self.image_sizes = image_sizes if image_sizes is not None else {}
+        self.out = []
+        self.open_tags = []
+        self.dropping = None      # [tag, nesting] while inside a dropped element
+        self.pre_depth = 0
+        self.words = 0
+        self.toc = []
+        self.heading = None       # [out index, tag, attrs, text parts] while inside h2/h3
+        self.used_ids = set()
+        self.first_paragraph = None
+        self.paragraph = None     # text parts of the <p> being read
+    
+    # -- output helpers --------------------------------------------------
+    
+    def _last_is_block_boundary(self):
+        if not self.out:
+            return True
+        match = re.match(r'</?([a-z0-9]+)', self.out[-1])
+        return bool(match) and self.out[-1].startswith('<') and match.group(1) in BLOCK_TAGS
+    
+    def _trim_trailing_space(self):
+        if self.pre_depth:
+            return
+        if self.out and not self.out[-1].startswith('<') and self.out[-1].endswith(' '):
+            self.out[-1] = self.out[-1].rstrip(' ')
+            if not self.out[-1]:
+                self.out.pop()
+    
+    def _unique_id(self, value):
+        candidate, n = value, 2
+        while candidate in self.used_ids:
+            candidate = f'{value}-{n}'
+            n += 1
+        self.used_ids.add(candidate)
+        return candidate
+    
+    @staticmethod
+    def _start_tag(tag, attrs):
+        parts = [tag] + [f'{name}="{escape(value, quote=True)}"' for name, value in attrs]
+        return '<' + ' '.join(parts) + '>'
+    
+    def _clean_attrs(self, tag, attrs):
+        allowed = ALLOWED_ATTRIBUTES['*'] | ALLOWED_ATTRIBUTES.get(tag, set())
+        cleaned = []
+        for name, value in attrs:
+            name = name.lower()
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRIBUTES and not _safe_url(value):
+                continue
+            cleaned.append((name, value))
+        if tag == 'a' and dict(cleaned).get('target') == '_blank':
+            cleaned = [(n, v) for n, v in cleaned if n != 'rel'] + [('rel', 'noopener noreferrer')]
+        return cleaned
+    
+    def _image_attrs(self, attrs):
+        values = dict(attrs)
+        src = values.get('src')
+        if src and 'width' not in values and 'height' not in values:
+            size = self.image_sizes.get(src)
+            if size is None and src not in self.image_sizes:
+                size = self.image_sizes[src] = image_size(src)
+            if size:
+                attrs += [('width', str(size[0])), ('height', str(size[1]))]
+        return attrs + [('loading', 'lazy'), ('decoding', 'async')]
+    
+    # -- parser callbacks ------------------------------------------------
+    
+    def handle_starttag(self, tag, attrs):
+        if self.dropping:
+            if tag == self.dropping[0]:
+                self.dropping[1] += 1
+            return
+        if tag in DROPPED_TAGS:
+            if tag not in VOID_TAGS:
+                self.dropping = [tag, 1]
+            return
+        if tag not in ALLOWED_TAGS:
+            return  # unwrap: keep the text, lose the tag
+        
+        attrs = self._clean_attrs(tag, attrs)
+        if tag == 'img':
+            attrs = self._image_attrs(attrs)
+        if tag in BLOCK_TAGS:
+            self._trim_trailing_space()
+        
+        self.out.append(self._start_tag(tag, attrs))
+        if tag in TOC_LEVELS and self.heading is None:
+            # Rewritten at the end tag, once the text (and so the id) is known
+            self.heading = [len(self.out) - 1, tag, attrs, []]
+        
+        if tag == 'p' and self.first_paragraph is None:
+            self.paragraph = []
+        if tag == 'pre':
+            self.pre_depth += 1
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+    
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+    
+    def handle_endtag(self, tag):
+        if self.dropping:
+            if tag == self.dropping[0]:
+                self.dropping[1] -= 1
+                if not self.dropping[1]:
+                    self.dropping = None
+            return
+        if tag not in self.open_tags:
+            return  # stray end tag
+        
+        # Close anything left open inside this element
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self._close(open_tag)
+            if open_tag == tag:
+                break
+    
+    def _close(self, tag):
+        if tag == 'pre':
+            self.pre_depth -= 1
+        elif tag in BLOCK_TAGS:
+            self._trim_trailing_space()
+        self.out.append(f'</{tag}>')
+        if tag == 'p' and self.paragraph is not None:
+            text = _WHITESPACE.sub(' ', ''.join(self.paragraph)).strip()
+            if text:
+                self.first_paragraph = text
+            self.paragraph = None
+        if self.heading is not None and tag == self.heading[1]:
+            index, _, attrs, parts = self.heading
+            text = _WHITESPACE.sub(' ', ''.join(parts)).strip()
+            values = dict(attrs)
+            heading_id = self._unique_id(values.get('id') or slugify(text))
+            attrs = [(n, v) for n, v in attrs if n != 'id'] + [('id', heading_id)]
+            self.out[index] = self._start_tag(tag, attrs)
+            if text:
+                self.toc.append({'level': TOC_LEVELS[tag], 'id': heading_id, 'text': text})
+            self.heading = None
+    
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        if not self.pre_depth:
+            data = _WHITESPACE.sub(' ', data)
+            if data.startswith(' ') and self._last_is_block_boundary():
+                data = data[1:]
+            if data.startswith(' ') and self.out and self.out[-1].endswith(' '):
+                data = data[1:]
+            if not data:
+                return
+        
+        self.words += len(_WORD.findall(data))
+        if self.heading is not None:
+            self.heading[3].append(data)
+        if self.paragraph is not None:
+            self.paragraph.append(data)
+        self.out.append(escape(data, quote=False))
+    
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self._close(self.open_tags.pop())
+        self._trim_trailing_space()
+
+
+def make_excerpt(text, length=EXCERPT_LENGTH):
+    """text shortened to at most length characters at a word boundary"""
+    if len(text) <= length:
+        return text
+    cut = text[:length - 1].rsplit(' ', 1)[0].rstrip(' ,;:.-')
+    return cut + '…'
+
+
+def compile_html(source, image_sizes=None):
+    """Compile post HTML. Pure function, safe to run in a worker process.
+    
+    Returns {'html', 'toc', 'word_count', 'read_time', 'excerpt'}.
+    """
+    compiler = _Compiler(image_sizes)
+    compiler.feed(source or '')
+    compiler.close()
+    
+    return {
+        'html': ''.join(compiler.out),
+        'toc': compiler.toc,
+        'word_count': compiler.words,
+        'read_time': max(1, math.ceil(compiler.words / WORDS_PER_MINUTE)),
+        'excerpt': make_excerpt(compiler.first_paragraph or ''),
+    }
+
+
+def _apply(post, result, manual_excerpt):
+    post.compiled_html = result['html']
+    post.toc = json.dumps(result['toc'])
+    post.word_count = result['word_count']
+    post.read_time = result['read_time']
+    post.compiled_version = COMPILER_VERSION
+    post.compiled_at = datetime.utcnow()
+    post.excerpt = manual_excerpt or result['excerpt'] or None
+
+
+def compile_post(post, excerpt=None, previous_html=None):
+    """Compile post.html_content into the post's stored artifact.
+    
+    excerpt is what the author typed; empty means generate one. On an edit,
+    pass the source as it was before (previous_html): an excerpt equal to
+    the one generated from it is treated as generated and refreshed.
+    """
+    result = compile_html(post.html_content)
+    manual_excerpt = (excerpt or '').strip() or None
+    if manual_excerpt and previous_html is not None and manual_excerpt == compile_html(previous_html)['excerpt']:
+        manual_excerpt = None
+    _apply(post, result, manual_excerpt)
+    return result
+
+
+def _compile_job(job):
+    post_id, source = job
+    return post_id, compile_html(source)
+
+
+def recompile_posts(force=False, workers=None, chunk_size=100):
+    """Compile stale posts (or all with force=True) over a process pool.
+    
+    Excerpts are only filled in where the post has none. Returns the number
+    of posts compiled.
+    """
+    from models import db, Post
+    from cache import content_cache
+    
+    query = db.session.query(Post.id).order_by(Post.id)
+    if not force:
+        query = query.filter(db.or_(Post.compiled_version.is_(None), Post.compiled_version != COMPILER_VERSION))
+    post_ids = [post_id for (post_id,) in query]
+    if not post_ids:
+        return 0
+    
+    compiled = 0
+    # spawn, like the image pipeline: children don't inherit threads or sockets
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        for start in range(0, len(post_ids), chunk_size):
+            chunk = post_ids[start:start + chunk_size]
+            jobs = db.session.query(Post.id, Post.html_content).filter(Post.id.in_(chunk)).all()
+            posts = {post.id: post for post in Post.query.filter(Post.id.in_(chunk))}
+            for post_id, result in pool.map(_compile_job, jobs):
+                post = posts[post_id]
+                changed = post.compiled_html != result['html']
+                _apply(post, result, post.excerpt)
+                if changed:
+                    post.updated_at = datetime.utcnow()  # new validators for cached pages
+                else:
+                    flag_modified(post, 'updated_at')  # written as-is, so onupdate doesn't fire
+            db.session.commit()
+            compiled += len(jobs)
+    
+    content_cache.bump()
+    return compiled
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import create_app
+    
+    parser = argparse.ArgumentParser(description='Compile post HTML into the stored artifacts')
+    parser.add_argument('--all', action='store_true', help='recompile every post, not just stale ones')
+    parser.add_argument('--workers', type=int, help='worker processes (default: CPU count)')
+    args = parser.parse_args()
+    
+    app = create_app()
+    
+    with app.app_context():
+        count = recompile_posts(force=args.all, workers=args.workers)
+        print(f"✓ Compiled {count} posts (compiler version {COMPILER_VERSION})")
@@ -0,0 +1,52 @@
+"""
+Reconcile the denormalized engagement counters on Post
+
+The api module keeps Post.like_count, comment_count and unique_viewer_count
+up to date as likes, comments and read events are written. This script
+rebuilds them from the base tables, e.g. after a manual data fix or when the
+columns are first added to an existing database. Readers are counted from
+read_daily as well as read_events, since raw events past the retention
+window are archived (retention.py) but their rollups are kept.
+"""
+from sqlalchemy import func, select
+from models import db, Post, Comment, Like, ReadEvent, ReadDaily
+
+
+def reconcile_counters(post_ids=None):
+    """Recompute stored counters from likes, comments and read_events/read_daily.
+    
+    Runs as one UPDATE with correlated subqueries so every post is rebuilt
+    in a single transaction. Returns the number of posts updated.
+    """
+    like_count = select(func.count(Like.id)).where(Like.post_id == Post.id).scalar_subquery()
+    comment_count = select(func.count(Comment.id)).where(Comment.post_id == Post.id).scalar_subquery()
+    rolled_up_readers = select(ReadDaily.user_id).where(ReadDaily.post_id == Post.id)
+    viewer_count = (
+        select(func.count(func.distinct(ReadDaily.user_id))).where(ReadDaily.post_id == Post.id).scalar_subquery()
+        + select(func.count(func.distinct(ReadEvent.user_id))).where(
+            ReadEvent.post_id == Post.id, ReadEvent.user_id.notin_(rolled_up_readers)
+        ).scalar_subquery()
+    )
+    
+    query = Post.query
+    if post_ids is not None:
+        query = query.filter(Post.id.in_(post_ids))
+    
+    updated = query.update({
+        Post.like_count: like_count,
+        Post.comment_count: comment_count,
+        Post.unique_viewer_count: viewer_count,
+        Post.updated_at: Post.updated_at,
+    }, synchronize_session=False)
+    db.session.commit()
+    return updated
+
+
+if __name__ == '__main__':
+    from app import create_app
+    
+    app = create_app(web=False)
+    
+    with app.app_context():
+        updated = reconcile_counters()
+        print(f"✓ Reconciled engagement counters for {updated} posts")
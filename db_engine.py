@@ -0,0 +1,121 @@
+"""
+Database engine profiles
+
+config.py defines named profiles (ENGINE_PROFILES) with per-dialect settings
+and each Config class picks one through DB_ENGINE_PROFILE. configure_engine()
+turns the chosen profile into SQLALCHEMY_ENGINE_OPTIONS before db.init_app(),
+and install_hooks() registers a connect-event hook that applies the SQLite
+pragmas to every new connection:
+
+- journal_mode=WAL lets readers run while one gunicorn worker writes
+- busy_timeout makes a writer wait for the lock instead of failing with
+  "database is locked"
+- synchronous=NORMAL is safe with WAL and avoids an fsync per commit
+- mmap_size / cache_size keep hot pages in memory
+
+For PostgreSQL the profile holds the pool settings (size, overflow,
+pre-ping, recycle). python db_engine.py prints the effective settings.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# busy_timeout goes first so switching journal_mode waits for the lock too
+_SQLITE_PRAGMA_ORDER = ('busy_timeout', 'journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store')
+
+
+def _backend(uri):
+    return make_url(uri).get_backend_name()
+
+
+def get_profile(app):
+    """(profile name, settings for the app's database dialect)"""
+    from config import ENGINE_PROFILES
+    
+    name = app.config.get('DB_ENGINE_PROFILE', 'development')
+    profile = ENGINE_PROFILES.get(name, ENGINE_PROFILES['development'])
+    return name, profile.get(_backend(app.config['SQLALCHEMY_DATABASE_URI']), {})
+
+
+def configure_engine(app):
+    """Fill SQLALCHEMY_ENGINE_OPTIONS from the profile. Call before db.init_app().
+    
+    Options set explicitly in the app config win over the profile.
+    """
+    _, settings = get_profile(app)
+    options = dict(settings.get('engine_options', {}))
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def _sqlite_pragma_hook(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name in _SQLITE_PRAGMA_ORDER:
+                if name in pragmas:
+                    cursor.execute(f"PRAGMA {name}={pragmas[name]}")
+            for name, value in pragmas.items():
+                if name not in _SQLITE_PRAGMA_ORDER:
+                    cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+def install_hooks(app, db):
+    """Register the profile's connect hooks on the app's engines. Call after db.init_app()."""
+    _, settings = get_profile(app)
+    pragmas = settings.get('pragmas')
+    if not pragmas:
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _sqlite_pragma_hook(pragmas))
+
+
+def describe(app, db):
+    """Effective engine settings, read back from a live connection"""
+    name, settings = get_profile(app)
+    with app.app_context():
+        engine = db.engine
+        pool = engine.pool
+        info = {
+            'profile': name,
+            'url': engine.url.render_as_string(hide_password=True),
+            'dialect': engine.dialect.name,
+            'pool': type(pool).__name__,
+            'engine_options': app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+        }
+        if hasattr(pool, 'size'):
+            info['pool_size'] = pool.size()
+        if engine.dialect.name == 'sqlite':
+            with engine.connect() as conn:
+                info['pragmas'] = {
+                    pragma: conn.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+                    for pragma in _SQLITE_PRAGMA_ORDER
+                }
+                info['sqlite_version'] = conn.exec_driver_sql("SELECT sqlite_version()").scalar()
+        elif engine.dialect.name == 'postgresql':
+            with engine.connect() as conn:
+                info['server_version'] = conn.exec_driver_sql("SHOW server_version").scalar()
+                info['max_connections'] = conn.exec_driver_sql("SHOW max_connections").scalar()
+        return info
+
+
+if __name__ == '__main__':
+    from app import create_app
+    from models import db
+    
+    app = create_app(web=False)
+    info = describe(app, db)
+    print(f"✓ Engine profile: {info['profile']} ({info['dialect']})")
+    print(f"✓ URL: {info['url']}")
+    print(f"✓ Pool: {info['pool']}" + (f" size={info['pool_size']}" if 'pool_size' in info else ''))
+    for key, value in sorted(info['engine_options'].items()):
+        print(f"  {key} = {value}")
+    for pragma, value in info.get('pragmas', {}).items():
+        print(f"  PRAGMA {pragma} = {value}")
+    for key in ('sqlite_version', 'server_version', 'max_connections'):
+        if key in info:
+            print(f"  {key} = {info[key]}")
@@ -0,0 +1,62 @@
+"""
+Conditional GET support (ETag / Last-Modified / 304)
+
+Views build a Validators object from a cheap lookup of whatever the page
+depends on, return validators.not_modified() when the browser's copy is still
+current, and otherwise pass the rendered response through validators.apply().
+Pages are per user, so responses are marked private and revalidated on every
+use rather than cached blindly.
+"""
+import hashlib
+from datetime import datetime, timezone
+from flask import current_app, request, session
+from cache import content_cache
+
+
+class Validators:
+    """ETag and Last-Modified for one page view"""
+    
+    def __init__(self, *parts, last_modified=None):
+        # Every page carries the menu, the footer year and the logged-in
+        # user's name/admin link, so those are part of every tag.
+        common = (
+            content_cache.generation(),
+            datetime.utcnow().year,
+            session.get('user_id'),
+            session.get('user_name'),
+            session.get('is_admin', False),
+        )
+        digest = hashlib.sha1(repr(common + parts).encode('utf-8')).hexdigest()
+        self.etag = digest[:32]
+        # The menu can change without any of this page's rows changing
+        last_modified = max(filter(None, [last_modified, content_cache.changed_at()]), default=None)
+        self.last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc) if last_modified else None
+        # A pending flash message is rendered once - never answer 304 over it
+        self.enabled = '_flashes' not in session
+    
+    def not_modified(self):
+        """Return a 304 response if the client's copy is current, else None"""
+        if not self.enabled:
+            return None
+        
+        if request.if_none_match:
+            matched = request.if_none_match.contains_weak(self.etag)
+        elif request.if_modified_since and self.last_modified:
+            matched = self.last_modified <= request.if_modified_since
+        else:
+            matched = False
+        
+        if not matched:
+            return None
+        return self.apply(current_app.response_class(status=304))
+    
+    def apply(self, response):
+        """Attach the validators to a response"""
+        if self.enabled:
+            response.set_etag(self.etag, weak=True)
+            if self.last_modified:
+                response.last_modified = self.last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+        return response
@@ -0,0 +1,216 @@
+"""
+Background image derivative pipeline
+
+Uploads (hero images and editor images) are stored as-is, which can be many
+megabytes. After an upload the admin views call image_pipeline.submit(),
+which records a pending ImageAsset and hands the resize work to a process
+pool so the request thread never waits on it. Each image gets a card-sized
+and a hero-sized copy, each as JPEG (PNG for transparent images) and WebP,
+with EXIF/XMP metadata dropped. When a job finishes, its derivative URLs
+are written to the ImageAsset row and the templates start emitting srcset.
+
+python images.py processes every pending or failed asset and every hero
+image that has no asset yet, e.g. after a deploy or for existing posts.
+"""
+import atexit
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from werkzeug.utils import secure_filename
+from models import db, Post, ImageAsset
+from cache import content_cache
+from prerender import prerender
+
+# Target widths in pixels; images are never upscaled
+DEFAULT_SIZES = {
+    'card': 600,   # archive.html post cards
+    'hero': 1200,  # post.html hero image
+}
+
+
+def render_derivatives(source_file, output_dir, stem, sizes):
+    """Resize one image into every size, as JPEG/PNG and WebP (runs in the pool).
+    
+    Returns {'width', 'height', 'variants': {size: {'width', 'height',
+    'jpeg'|'png', 'webp'}}} with filesystem paths, or None for animated
+    images, which are left as they are.
+    """
+    from PIL import Image, ImageOps
+    
+    os.makedirs(output_dir, exist_ok=True)
+    with Image.open(source_file) as original:
+        if getattr(original, 'is_animated', False):
+            return None
+        
+        # Apply the EXIF rotation before the metadata is dropped
+        image = ImageOps.exif_transpose(original)
+        width, height = image.size
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+        
+        variants = {}
+        for name, target_width in sizes.items():
+            new_width = min(target_width, width)
+            new_height = max(1, round(height * new_width / width))
+            resized = image.resize((new_width, new_height), Image.LANCZOS) if new_width < width else image
+            
+            # Nothing from the original's info dict is passed on, so EXIF,
+            # XMP and comments are not written to the derivatives.
+            variant = {'width': new_width, 'height': new_height}
+            if has_alpha:
+                path = os.path.join(output_dir, f'{stem}-{name}.png')
+                resized.save(path, 'PNG', optimize=True)
+                variant['png'] = path
+            else:
+                path = os.path.join(output_dir, f'{stem}-{name}.jpg')
+                resized.save(path, 'JPEG', quality=82, optimize=True, progressive=True)
+                variant['jpeg'] = path
+            
+            webp_path = os.path.join(output_dir, f'{stem}-{name}.webp')
+            resized.save(webp_path, 'WEBP', quality=80, method=4)
+            variant['webp'] = webp_path
+            variants[name] = variant
+    
+    return {'width': width, 'height': height, 'variants': variants}
+
+
+def _to_url(path):
+    return '/' + path.replace(os.sep, '/').lstrip('/')
+
+
+class ImagePipeline:
+    """Process pool that turns uploaded images into ImageAsset derivatives"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.workers = 2
+        self.sizes = dict(DEFAULT_SIZES)
+        self.output_dir = os.path.join('uploads', 'derived')
+        self._pid = None
+        self._executor = None
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('IMAGE_WORKERS', self.workers)
+        self.sizes = app.config.get('IMAGE_SIZES', self.sizes)
+        self.output_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'derived')
+        app.extensions['image_pipeline'] = self
+        atexit.register(self.shutdown)
+    
+    def _get_executor(self):
+        # One pool per worker process, created after any gunicorn fork. The
+        # pool uses spawn so its children don't inherit our threads or sockets.
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+            self._pid = os.getpid()
+        return self._executor
+    
+    def _job(self, source_path):
+        """Arguments for render_derivatives() for an image URL path"""
+        source_file = source_path.lstrip('/')
+        name = os.path.splitext(secure_filename(os.path.basename(source_file)))[0] or 'image'
+        stem = f"{name}-{hashlib.sha1(source_path.encode('utf-8')).hexdigest()[:8]}"
+        return source_file, self.output_dir, stem, self.sizes
+    
+    def _mark_pending(self, source_path):
+        asset = ImageAsset.query.filter_by(source_path=source_path).first()
+        if asset is None:
+            asset = ImageAsset(source_path=source_path)
+            db.session.add(asset)
+        asset.status = 'pending'
+        db.session.commit()
+    
+    def submit(self, source_path):
+        """Queue derivatives for an image URL path such as /uploads/x.jpg.
+        
+        Call after the upload (and any post change) is committed. Returns the
+        future, or None if the job could not be queued; the asset then stays
+        pending for python images.py to pick up.
+        """
+        try:
+            self._mark_pending(source_path)
+            future = self._get_executor().submit(render_derivatives, *self._job(source_path))
+        except Exception as e:
+            db.session.rollback()
+            self.app.logger.error(f"Image pipeline submit error for {source_path}: {e}")
+            return None
+        future.add_done_callback(partial(self._record, source_path))
+        return future
+    
+    def _record(self, source_path, future):
+        """Store a finished job's result (runs on a pool callback thread)"""
+        with self.app.app_context():
+            try:
+                asset = ImageAsset.query.filter_by(source_path=source_path).first()
+                if asset is None:
+                    return
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.app.logger.error(f"Image derivative error for {source_path}: {e}")
+                    asset.status = 'failed'
+                else:
+                    if result is None:
+                        asset.status = 'skipped'
+                    else:
+                        for variant in result['variants'].values():
+                            for fmt in ('jpeg', 'png', 'webp'):
+                                if fmt in variant:
+                                    variant[fmt] = _to_url(variant[fmt])
+                        asset.width = result['width']
+                        asset.height = result['height']
+                        asset.variants = json.dumps(result['variants'])
+                        asset.status = 'ready'
+                db.session.commit()
+                # Pages embedding this image now render differently
+                content_cache.bump()
+                prerender.refresh_image(source_path)
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.error(f"Image asset update error for {source_path}: {e}")
+    
+    def shutdown(self, wait=False):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+            self._executor = None
+
+
+image_pipeline = ImagePipeline()
+
+
+def process_backlog():
+    """Generate derivatives for pending/failed assets and hero images without one"""
+    paths = {asset.source_path for asset in ImageAsset.query.filter(ImageAsset.status.in_(['pending', 'failed']))}
+    known = db.session.query(ImageAsset.source_path)
+    heroes = db.session.query(Post.hero_image_path).filter(
+        Post.hero_image_path.isnot(None), Post.hero_image_path.notin_(known)
+    ).distinct()
+    paths.update(path for (path,) in heroes)
+    
+    futures = [image_pipeline.submit(path) for path in sorted(paths)]
+    for future in futures:
+        if future is not None:
+            try:
+                future.result()
+            except Exception:
+                pass  # recorded as failed by the callback
+    image_pipeline.shutdown(wait=True)
+    return len(paths)
+
+
+if __name__ == '__main__':
+    from app import create_app
+    
+    app = create_app()
+    
+    with app.app_context():
+        count = process_backlog()
+        print(f"✓ Processed {count} images")
@@ -0,0 +1,347 @@
+"""
+Write-behind buffer for read-event ingestion
+
+Reading heartbeats arrive far more often than anything else we write. Instead
+of one INSERT and one commit per heartbeat, the api blueprint hands events to
+this per-worker buffer, which writes them in batches (one executemany and one
+commit per batch) when the batch fills up or the flush interval elapses.
+
+Pages send their reading progress as beacons: one small POST to /api/beacon
+when the tab is hidden or closed (navigator.sendBeacon) and every couple of
+minutes while it stays open, instead of a request per heartbeat. A beacon
+carries a batch of events and an idempotency key; parse_beacon() validates
+it in one pass and the events are queued with the key. The flusher writes
+the keys (beacon_batches) in the same transaction as the events and drops
+the events of a key that was written before, so a resent beacon is counted
+once without an extra write per request.
+"""
+import atexit
+import itertools
+import json
+import os
+import queue
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from models import db, Post, ReadEvent, ReadDaily, BeaconBatch
+from hll import add_readers
+
+MAX_BEACON_BYTES = 16 * 1024
+MAX_BEACON_EVENTS = 50
+MAX_READ_SECONDS = 24 * 3600
+_BEACON_KEY = re.compile(r'^[A-Za-z0-9._-]{8,64}$')
+
+# Tells apart two copies of the same beacon waiting in one batch
+_beacon_serial = itertools.count()
+
+
+class ReadEventBuffer:
+    """Bounded in-process queue of read events with a background flusher"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.max_size = 10000
+        self.batch_size = 500
+        self.flush_interval = 2.0
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = self._empty_stats()
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """Read buffer settings from the app config and flush on exit"""
+        self.app = app
+        self.max_size = app.config.get('READ_EVENT_BUFFER_SIZE', self.max_size)
+        self.batch_size = app.config.get('READ_EVENT_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('READ_EVENT_FLUSH_INTERVAL', self.flush_interval)
+        app.extensions['read_event_buffer'] = self
+        atexit.register(self.close)
+    
+    @staticmethod
+    def _empty_stats():
+        return {
+            'enqueued': 0,
+            'rejected': 0,
+            'written': 0,
+            'discarded': 0,
+            'failed': 0,
+            'flushes': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+        }
+    
+    def _ensure_started(self):
+        """Create the queue and flusher thread in the current process.
+        
+        Done lazily so that a gunicorn worker forked from a preloaded master
+        gets its own queue and thread rather than the parent's.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._flush_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_size)
+            self._stats = self._empty_stats()
+            self._thread = None
+            if self.flush_interval > 0:
+                self._thread = threading.Thread(target=self._run, name='read-event-flusher', daemon=True)
+                self._thread.start()
+            self._pid = os.getpid()
+    
+    def enqueue(self, post_id, user_id, percent, seconds):
+        """Queue one read event. Returns False if the buffer is full."""
+        return self.enqueue_many(user_id, [(post_id, percent, seconds)]) == 1
+    
+    def enqueue_many(self, user_id, events, beacon_key=None):
+        """Queue (post_id, percent, seconds) events of one reader.
+        
+        With a beacon_key, the events are written only if no beacon with the
+        same key was written before. Returns how many were queued; the rest
+        didn't fit in the buffer.
+        """
+        self._ensure_started()
+        created_at = datetime.utcnow()
+        beacon = (user_id, beacon_key, next(_beacon_serial)) if beacon_key else None
+        queued = 0
+        for post_id, percent, seconds in events:
+            event = {
+                'post_id': post_id,
+                'user_id': user_id,
+                'percent': percent,
+                'seconds': seconds,
+                'created_at': created_at,
+                'beacon': beacon,
+            }
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                break
+            queued += 1
+        
+        with self._stats_lock:
+            self._stats['enqueued'] += queued
+            self._stats['rejected'] += len(events) - queued
+        
+        if not queued:
+            return 0
+        if self.flush_interval <= 0:
+            # Write-through mode (tests, single-process debugging)
+            self.flush()
+        elif self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+        return queued
+    
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.app.logger.error(f"Read event flush error: {e}")
+    
+    def _drain(self):
+        events = []
+        while len(events) < self.batch_size:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+    
+    def flush(self):
+        """Write all queued events in batches. Returns the number written."""
+        if self._queue is None or self._pid != os.getpid():
+            return 0
+        
+        written = 0
+        with self._flush_lock:
+            while True:
+                events = self._drain()
+                if not events:
+                    break
+                written += self._write_batch(events)
+        return written
+    
+    def _write_batch(self, events):
+        started = time.perf_counter()
+        with self.app.app_context():
+            try:
+                try:
+                    rows = self._insert_batch(events)
+                except IntegrityError:
+                    # Another worker wrote one of these beacon keys meanwhile;
+                    # try again, its events are dropped this time
+                    db.session.rollback()
+                    rows = self._insert_batch(events)
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.error(f"Read event batch write error: {e}")
+                with self._stats_lock:
+                    self._stats['failed'] += len(events)
+                return 0
+        
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self._stats['written'] += len(rows)
+            self._stats['discarded'] += len(events) - len(rows)
+            self._stats['flushes'] += 1
+            self._stats['last_flush_ms'] = elapsed_ms
+            self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], elapsed_ms)
+            self._stats['total_flush_ms'] += elapsed_ms
+        return len(rows)
+    
+    def _insert_batch(self, events):
+        """Insert one batch and commit. Returns the rows written."""
+        events = self._new_beacon_events(events)
+        post_ids = {e['post_id'] for e in events}
+        user_ids = {e['user_id'] for e in events}
+        
+        # One existence check for the whole batch instead of one per event
+        existing = {pid for (pid,) in db.session.query(Post.id).filter(Post.id.in_(post_ids))}
+        rows = [e for e in events if e['post_id'] in existing]
+        
+        # Pairs already present in read_events, or rolled up into read_daily
+        # (their raw events may be archived by now), are not new viewers
+        seen = set(
+            db.session.query(ReadEvent.post_id, ReadEvent.user_id)
+            .filter(ReadEvent.post_id.in_(existing), ReadEvent.user_id.in_(user_ids))
+            .union(
+                db.session.query(ReadDaily.post_id, ReadDaily.user_id)
+                .filter(ReadDaily.post_id.in_(existing), ReadDaily.user_id.in_(user_ids))
+            )
+        )
+        new_viewers = Counter(post_id for post_id, _ in {(r['post_id'], r['user_id']) for r in rows} - seen)
+        
+        if rows:
+            db.session.execute(insert(ReadEvent.__table__), [
+                {name: r[name] for name in ('post_id', 'user_id', 'percent', 'seconds', 'created_at')} for r in rows
+            ])
+        for post_id, count in new_viewers.items():
+            Post.adjust_counters(post_id, unique_viewer_count=count)
+        # After the INSERT, so on SQLite the write lock is already ours
+        add_readers((r['post_id'], r['user_id'], r['created_at'].date()) for r in rows)
+        db.session.commit()
+        return rows
+    
+    def _new_beacon_events(self, events):
+        """Drop events of beacons whose key was written already, and add the new keys.
+        
+        A key queued twice (the same beacon received twice before a flush)
+        keeps only the events of its first copy.
+        """
+        first = {}
+        for e in events:
+            if e['beacon'] is not None:
+                user_id, key, serial = e['beacon']
+                first[(user_id, key)] = min(serial, first.get((user_id, key), serial))
+        if not first:
+            return events
+        
+        known = set(
+            db.session.query(BeaconBatch.user_id, BeaconBatch.key)
+            .filter(db.tuple_(BeaconBatch.user_id, BeaconBatch.key).in_(list(first)))
+        )
+        events = [
+            e for e in events
+            if e['beacon'] is None or (e['beacon'][:2] not in known and first[e['beacon'][:2]] == e['beacon'][2])
+        ]
+        counts = Counter(e['beacon'][:2] for e in events if e['beacon'] is not None)
+        if counts:
+            db.session.execute(insert(BeaconBatch.__table__), [
+                {'user_id': user_id, 'key': key, 'event_count': count, 'received_at': datetime.utcnow()}
+                for (user_id, key), count in counts.items()
+            ])
+        return events
+    
+    def stats(self):
+        """Counters for this worker's buffer"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+        stats['queue_capacity'] = self.max_size
+        stats['avg_flush_ms'] = stats['total_flush_ms'] / stats['flushes'] if stats['flushes'] else 0.0
+        return stats
+    
+    def close(self):
+        """Flush whatever is still queued (worker shutdown)"""
+        try:
+            self.flush()
+        except Exception as e:
+            if self.app is not None:
+                self.app.logger.error(f"Read event shutdown flush error: {e}")
+
+
+read_event_buffer = ReadEventBuffer()
+
+
+def parse_beacon(data):
+    """Validate a beacon body in one pass.
+    
+    The body is JSON: {"k": "<idempotency key>", "e": [[post_id, percent,
+    seconds, seq], ...]}. Progress is cumulative, so only the event with the
+    highest seq is kept per post. Returns (key, [(post_id, percent,
+    seconds)]); raises ValueError for anything malformed.
+    """
+    if len(data) > MAX_BEACON_BYTES:
+        raise ValueError('Beacon too large')
+    try:
+        payload = json.loads(data)
+    except (UnicodeDecodeError, ValueError):
+        raise ValueError('Beacon is not valid JSON')
+    if not isinstance(payload, dict):
+        raise ValueError('Beacon must be an object')
+    
+    key = payload.get('k')
+    if not isinstance(key, str) or not _BEACON_KEY.match(key):
+        raise ValueError('Invalid idempotency key')
+    events = payload.get('e')
+    if not isinstance(events, list) or not 0 < len(events) <= MAX_BEACON_EVENTS:
+        raise ValueError(f'A beacon carries 1 to {MAX_BEACON_EVENTS} events')
+    
+    latest = {}
+    for event in events:
+        if (not isinstance(event, list) or len(event) != 4
+                or not all(isinstance(v, int) and not isinstance(v, bool) for v in event)):
+            raise ValueError('Events are [post_id, percent, seconds, seq] integer lists')
+        post_id, percent, seconds, seq = event
+        if post_id <= 0:
+            raise ValueError('Invalid post id')
+        if post_id not in latest or seq > latest[post_id][0]:
+            latest[post_id] = (seq, max(0, min(100, percent)), max(0, min(MAX_READ_SECONDS, seconds)))
+    
+    return key, [(post_id, percent, seconds) for post_id, (seq, percent, seconds) in latest.items()]
+
+
+def published_post_ids(post_ids):
+    """The subset of post_ids that are published posts.
+    
+    Checked against the set of all published ids, cached per worker until
+    the next content change (see cache.py), so a beacon needs no query.
+    """
+    from cache import content_cache
+    
+    def load():
+        return frozenset(pid for (pid,) in db.session.query(Post.id).filter(Post.status == 'published'))
+    
+    return set(post_ids) & content_cache.get('published_post_ids', load)
+
+
+def prune_beacon_batches(max_age):
+    """Delete idempotency keys older than max_age (a timedelta). Returns the count."""
+    deleted = BeaconBatch.query.filter(BeaconBatch.received_at < datetime.utcnow() - max_age).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+    return deleted
@@ -1,10 +1,52 @@
 """
 Initialize database tables
 """
-from app import app, db
+from sqlalchemy import inspect, text
+from app import create_app
+from models import db
+from search import ensure_index
+
+
+def add_missing_columns():
+    """Add model columns and indexes that are missing from existing tables.
+    
+    db.create_all() only creates tables that do not exist yet, so columns
+    added to a model later (e.g. the Post engagement counters) have to be
+    added with ALTER TABLE. Returns the list of "table.column" names added.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        
+        existing_columns = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+            
+            with db.engine.begin() as conn:
+                conn.execute(text(ddl))
+            added.append(f'{table.name}.{column.name}')
+        
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    
+    return added
+
 
 def init_database():
     """Create all database tables"""
+    app = create_app(web=False)
     with app.app_context():
         # Drop all tables (use with caution!)
         # db.drop_all()
@@ -12,10 +54,17 @@ def init_database():
         # Create all tables
         db.create_all()
         
+        # Bring existing tables up to date with the models
+        for name in add_missing_columns():
+            print(f"✓ Added column {name}")
+        
+        # Full-text search table (SQLite FTS5, not managed by create_all)
+        ensure_index()
+        db.session.commit()
+        
         print("✓ Database tables created successfully")
         print(f"✓ Database location: {app.config['SQLALCHEMY_DATABASE_URI']}")
 
 
 if __name__ == '__main__':
     init_database()
-
@@ -0,0 +1,370 @@
+"""
+Prometheus metrics for all gunicorn workers
+
+Each worker keeps its counters and histograms in memory (a dict update under
+a lock per request, cheap enough to leave on) and a background thread writes
+a snapshot to METRICS_DIR/<pid>.json every METRICS_FLUSH_INTERVAL seconds.
+GET /metrics, whichever worker answers it, adds up the snapshots of every
+worker and returns the Prometheus text format:
+
+- blog_http_requests_total{endpoint,method,status}
+- blog_http_request_duration_seconds{endpoint} (histogram)
+- blog_template_render_duration_seconds{template} (histogram)
+- blog_db_pool_size / _checked_out / _overflow (gauges, summed over workers)
+- blog_read_event_queue_depth (gauge) and the read-event buffer counters
+
+Snapshots of workers that exited are folded into dead.json (counters and
+histograms only, so totals never go backwards); their gauges are dropped.
+Other workers' numbers are up to one flush interval old.
+
+Set METRICS_TOKEN to require "Authorization: Bearer <token>" on /metrics.
+"""
+import atexit
+import bisect
+import glob
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+from flask import Response, request, g, abort, before_render_template, template_rendered
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RENDER_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'blog_http_requests_total': ('counter', 'Requests by endpoint, method and status code.', None),
+    'blog_http_request_duration_seconds': ('histogram', 'Request latency by endpoint.', LATENCY_BUCKETS),
+    'blog_template_render_duration_seconds': ('histogram', 'Template render time.', RENDER_BUCKETS),
+    'blog_read_events_enqueued_total': ('counter', 'Read events accepted into the write-behind buffer.', None),
+    'blog_read_events_rejected_total': ('counter', 'Read events rejected because the buffer was full.', None),
+    'blog_read_events_written_total': ('counter', 'Read events written to the database.', None),
+    'blog_read_event_queue_depth': ('gauge', 'Read events waiting in the write-behind buffers.', None),
+    'blog_db_pool_size': ('gauge', 'Configured connection pool size, summed over workers.', None),
+    'blog_db_pool_checked_out': ('gauge', 'Connections in use, summed over workers.', None),
+    'blog_db_pool_overflow': ('gauge', 'Connections opened beyond the pool size, summed over workers.', None),
+    'blog_workers': ('gauge', 'Worker processes that reported recently.', None),
+}
+
+DEAD_FILE = 'dead.json'
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricSet:
+    """Counter, histogram and gauge values, mergeable across processes"""
+    
+    def __init__(self):
+        self.counters = {}    # name -> {label key: value}
+        self.histograms = {}  # name -> {label key: [bucket counts..., sum, count]}
+        self.gauges = {}      # name -> {label key: value}
+    
+    def inc(self, name, labels, amount=1):
+        series = self.counters.setdefault(name, {})
+        key = _key(labels)
+        series[key] = series.get(key, 0) + amount
+    
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        series = self.histograms.setdefault(name, {})
+        key = _key(labels)
+        row = series.get(key)
+        if row is None:
+            row = series[key] = [0] * (len(buckets) + 2)
+        # Non-cumulative here; render() accumulates
+        row[bisect.bisect_left(buckets, value)] += 1
+        row[-2] += value
+        row[-1] += 1
+    
+    def set(self, name, labels, value):
+        self.gauges.setdefault(name, {})[_key(labels)] = value
+    
+    def merge(self, other, gauges=True):
+        for name, series in other.counters.items():
+            target = self.counters.setdefault(name, {})
+            for key, value in series.items():
+                target[key] = target.get(key, 0) + value
+        for name, series in other.histograms.items():
+            target = self.histograms.setdefault(name, {})
+            for key, row in series.items():
+                if key in target:
+                    target[key] = [a + b for a, b in zip(target[key], row)]
+                else:
+                    target[key] = list(row)
+        if gauges:
+            for name, series in other.gauges.items():
+                target = self.gauges.setdefault(name, {})
+                for key, value in series.items():
+                    target[key] = target.get(key, 0) + value
+    
+    def to_json(self):
+        def dump(table):
+            return {name: [[dict(key), value] for key, value in series.items()] for name, series in table.items()}
+        return {'counters': dump(self.counters), 'histograms': dump(self.histograms), 'gauges': dump(self.gauges)}
+    
+    @classmethod
+    def from_json(cls, data):
+        metric_set = cls()
+        for attr in ('counters', 'histograms', 'gauges'):
+            table = getattr(metric_set, attr)
+            for name, series in data.get(attr, {}).items():
+                if name in METRICS:
+                    table[name] = {_key(labels): value for labels, value in series}
+        return metric_set
+    
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            table = {'counter': self.counters, 'histogram': self.histograms, 'gauge': self.gauges}[kind]
+            series = table.get(name)
+            if not series:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key in sorted(series):
+                value = series[key]
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(key)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + [float('inf')], value[:-2]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(key, [("le", _format_value(float(bound)))])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(key)} {_format_value(float(value[-2]))}')
+                lines.append(f'{name}_count{_format_labels(key)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Per-worker collection and the /metrics endpoint"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.directory = None
+        self.flush_interval = 5.0
+        self.token = None
+        self._engines = []
+        self._lock = threading.Lock()
+        self._pid = None
+        self._values = MetricSet()
+        self._render_started = threading.local()
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """Hook requests and template rendering and add the /metrics route. Call after db.init_app()."""
+        from models import db
+        
+        self.app = app
+        self.enabled = app.config.get('METRICS_ENABLED', self.enabled)
+        self.directory = app.config.get('METRICS_DIR') or os.path.join(app.instance_path, 'metrics')
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', self.flush_interval)
+        self.token = app.config.get('METRICS_TOKEN')
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        
+        os.makedirs(self.directory, exist_ok=True)
+        with app.app_context():
+            self._engines = list(db.engines.items())
+        
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        atexit.register(self._write_snapshot)
+    
+    def _ensure_started(self):
+        """Start this process's snapshot writer (after a fork, start over)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._values = MetricSet()
+            self._pid = os.getpid()
+            if self.flush_interval > 0:
+                threading.Thread(target=self._run, name='metrics-writer', daemon=True).start()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self._write_snapshot()
+            except Exception as e:
+                self.app.logger.error(f"Metrics snapshot error: {e}")
+    
+    # -- collection ------------------------------------------------------
+    
+    @staticmethod
+    def _start_request():
+        g.metrics_started = time.perf_counter()
+    
+    def _finish_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        self._ensure_started()
+        with self._lock:
+            self._values.inc('blog_http_requests_total',
+                             {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)})
+            self._values.observe('blog_http_request_duration_seconds', {'endpoint': endpoint}, elapsed)
+        return response
+    
+    def _before_render(self, sender, template, context, **extra):
+        self._render_started.__dict__.setdefault('stack', []).append(time.perf_counter())
+    
+    def _after_render(self, sender, template, context, **extra):
+        stack = self._render_started.__dict__.get('stack')
+        if not stack:
+            return
+        elapsed = time.perf_counter() - stack.pop()
+        self._ensure_started()
+        with self._lock:
+            self._values.observe('blog_template_render_duration_seconds', {'template': template.name or 'string'}, elapsed)
+    
+    def _gauges(self):
+        """Point-in-time values for this worker"""
+        from ingest import read_event_buffer
+        
+        gauges = MetricSet()
+        for bind, engine in self._engines:
+            pool = engine.pool
+            labels = {'bind': bind or 'default'}
+            if hasattr(pool, 'checkedout'):
+                gauges.set('blog_db_pool_size', labels, pool.size())
+                gauges.set('blog_db_pool_checked_out', labels, pool.checkedout())
+                gauges.set('blog_db_pool_overflow', labels, max(0, pool.overflow()))
+        buffer_stats = read_event_buffer.stats()
+        gauges.set('blog_read_event_queue_depth', {}, buffer_stats['queue_depth'])
+        gauges.inc('blog_read_events_enqueued_total', {}, buffer_stats['enqueued'])
+        gauges.inc('blog_read_events_rejected_total', {}, buffer_stats['rejected'])
+        gauges.inc('blog_read_events_written_total', {}, buffer_stats['written'])
+        gauges.set('blog_workers', {}, 1)
+        return gauges
+    
+    def snapshot(self):
+        """This worker's metrics"""
+        self._ensure_started()
+        values = MetricSet()
+        with self._lock:
+            values.merge(self._values)
+        values.merge(self._gauges())
+        return values
+    
+    # -- sharing between workers ---------------------------------------------
+    
+    def _path(self, pid):
+        return os.path.join(self.directory, f'{pid}.json')
+    
+    def _write_json(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.metrics')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    
+    def _write_snapshot(self):
+        if self._pid != os.getpid():
+            return
+        data = self.snapshot().to_json()
+        data['pid'] = os.getpid()
+        data['updated'] = time.time()
+        self._write_json(self._path(os.getpid()), data)
+    
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _is_live(self, data):
+        """Recently updated by a process that still exists"""
+        if time.time() - data.get('updated', 0) > max(60, self.flush_interval * 6):
+            return False
+        try:
+            os.kill(data.get('pid', 0), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+    
+    def collect(self):
+        """Metrics of every worker, added up"""
+        total = self.snapshot()
+        own_path = self._path(os.getpid())
+        with open(os.path.join(self.directory, 'metrics.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            
+            dead_path = os.path.join(self.directory, DEAD_FILE)
+            dead_data = self._read_json(dead_path)
+            dead = MetricSet.from_json(dead_data) if dead_data else MetricSet()
+            folded = []
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                if path in (own_path, dead_path):
+                    continue
+                data = self._read_json(path)
+                if data is None:
+                    continue
+                if self._is_live(data):
+                    total.merge(MetricSet.from_json(data))
+                else:
+                    dead.merge(MetricSet.from_json(data), gauges=False)
+                    folded.append(path)
+            
+            if folded:
+                # Remove before writing: a crash in between loses those
+                # workers' totals (seen as a counter reset) rather than
+                # counting them twice
+                for path in folded:
+                    os.remove(path)
+                self._write_json(dead_path, dead.to_json())
+        
+        total.merge(dead, gauges=False)
+        return total
+    
+    # -- endpoint --------------------------------------------------------
+    
+    def view(self):
+        if self.token:
+            supplied = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(supplied, f'Bearer {self.token}'):
+                abort(401)
+        return Response(self.collect().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+metrics = Metrics()
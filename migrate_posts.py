@@ -2,12 +2,16 @@
 Migrate existing blog posts from HTML files to database
 """
 from datetime import datetime
-from app import app, db
+from app import create_app
+from models import db
 from models import Post
+from content import compile_post
+from search import index_post
 
 
 def migrate_posts():
     """Migrate existing HTML blog posts to database"""
+    app = create_app(web=False)
     with app.app_context():
         # Blog post 1: Aravind Srinivas
         post1_data = {
@@ -92,14 +96,20 @@ def migrate_posts():
         
         if not existing1:
             post1 = Post(**post1_data)
+            compile_post(post1, excerpt=post1_data['excerpt'])
             db.session.add(post1)
+            db.session.flush()
+            index_post(post1)
             print(f"✓ Created post: {post1_data['title']}")
         else:
             print(f"- Post already exists: {post1_data['title']}")
         
         if not existing2:
             post2 = Post(**post2_data)
+            compile_post(post2, excerpt=post2_data['excerpt'])
             db.session.add(post2)
+            db.session.flush()
+            index_post(post2)
             print(f"✓ Created post: {post2_data['title']}")
         else:
             print(f"- Post already exists: {post2_data['title']}")
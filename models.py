@@ -1,8 +1,11 @@
 """
 Database models for Wide Angle Blog
 """
+import json
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import deferred
 
 db = SQLAlchemy()
 
@@ -41,7 +44,7 @@ class Post(db.Model):
     month_key = db.Column(db.String(7), nullable=False, index=True)  # e.g., '2026-01'
     published_at = db.Column(db.DateTime)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     status = db.Column(db.String(20), default='draft', index=True)  # draft, published
     hero_image_path = db.Column(db.String(500))
     html_content = db.Column(db.Text)
@@ -49,14 +52,44 @@ class Post(db.Model):
     category = db.Column(db.String(100))
     read_time = db.Column(db.Integer)  # estimated read time in minutes
     
+    # Output of content.compile_post(): sanitized, minified HTML with lazy
+    # images and heading ids, and the table of contents. Deferred so post
+    # lists don't load a second copy of every body.
+    compiled_html = deferred(db.Column(db.Text))
+    toc = deferred(db.Column(db.Text))  # JSON list of {'level', 'id', 'text'}
+    word_count = db.Column(db.Integer)
+    compiled_version = db.Column(db.Integer)  # content.COMPILER_VERSION that produced it
+    compiled_at = db.Column(db.DateTime)
+    
+    # Denormalized engagement counters - maintained by the api module in the
+    # same transaction as the underlying write, rebuilt by counters.py
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    unique_viewer_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    engaged_at = db.Column(db.DateTime)  # last change to any of the counters above
+    
     # Relationships
     comments = db.relationship('Comment', backref='post', lazy='dynamic', cascade='all, delete-orphan')
     likes = db.relationship('Like', backref='post', lazy='dynamic', cascade='all, delete-orphan')
     read_events = db.relationship('ReadEvent', backref='post', lazy='dynamic', cascade='all, delete-orphan')
     
+    # Resized/WebP derivatives of the hero image, loaded in one query per list
+    hero_asset = db.relationship('ImageAsset',
+                                 primaryjoin='foreign(Post.hero_image_path) == ImageAsset.source_path',
+                                 viewonly=True, uselist=False, lazy='selectin')
+    
     def __repr__(self):
         return f'<Post {self.title}>'
     
+    @property
+    def body_html(self):
+        """Compiled body, or the source for posts not compiled yet"""
+        return self.compiled_html if self.compiled_html is not None else self.html_content
+    
+    @property
+    def toc_entries(self):
+        return json.loads(self.toc) if self.toc else []
+    
     def get_like_count(self):
         """Get total likes for this post"""
         return self.likes.count()
@@ -66,8 +99,22 @@ class Post(db.Model):
         return self.comments.count()
     
     def get_view_count(self):
-        """Get unique viewers count"""
-        return db.session.query(ReadEvent.user_id).filter_by(post_id=self.id).distinct().count()
+        """Get unique viewers count, estimated from the reader sketches (hll.py)"""
+        from hll import unique_readers
+        return unique_readers(self.id)
+    
+    @staticmethod
+    def adjust_counters(post_id, **deltas):
+        """Add deltas to the stored counters, e.g. adjust_counters(1, like_count=1).
+        
+        Runs as a single UPDATE in the caller's transaction, so the counter
+        change commits (or rolls back) together with the row it describes.
+        """
+        values = {getattr(Post, name): getattr(Post, name) + delta for name, delta in deltas.items()}
+        # Engagement is not an edit - keep updated_at from firing its onupdate
+        values[Post.updated_at] = Post.updated_at
+        values[Post.engaged_at] = datetime.utcnow()
+        Post.query.filter_by(id=post_id).update(values, synchronize_session=False)
 
 
 class Comment(db.Model):
@@ -80,8 +127,39 @@ class Comment(db.Model):
     body = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
+    # Serves keyset pagination of a post's comments, newest first
+    __table_args__ = (
+        db.Index('ix_comments_post_created', 'post_id', 'created_at', 'id'),
+    )
+    
     def __repr__(self):
         return f'<Comment {self.id} on Post {self.post_id}>'
+    
+    @property
+    def cursor(self):
+        """Opaque position of this comment for keyset pagination"""
+        return f'{self.created_at.isoformat()}_{self.id}'
+    
+    @staticmethod
+    def parse_cursor(cursor):
+        """Turn a cursor back into (created_at, id); raises ValueError if malformed"""
+        created_at, _, comment_id = cursor.rpartition('_')
+        return datetime.fromisoformat(created_at), int(comment_id)
+    
+    @staticmethod
+    def page(post_id, cursor=None, limit=20):
+        """One page of a post's comments, newest first, authors joined in the same query.
+        
+        Returns (comments, next_cursor); next_cursor is None on the last page.
+        """
+        query = Comment.query.options(db.joinedload(Comment.user)).filter(Comment.post_id == post_id)
+        if cursor:
+            query = query.filter(db.tuple_(Comment.created_at, Comment.id) < Comment.parse_cursor(cursor))
+        
+        comments = query.order_by(Comment.created_at.desc(), Comment.id.desc()).limit(limit + 1).all()
+        if len(comments) > limit:
+            return comments[:limit], comments[limit - 1].cursor
+        return comments, None
 
 
 class Like(db.Model):
@@ -100,6 +178,54 @@ class Like(db.Model):
     
     def __repr__(self):
         return f'<Like {self.id} on Post {self.post_id}>'
+    
+    @staticmethod
+    def _insert_ignore(post_id, user_id):
+        """INSERT the like unless it exists; returns the number of rows inserted"""
+        values = {'post_id': post_id, 'user_id': user_id, 'created_at': datetime.utcnow()}
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(Like.__table__).values(**values).on_conflict_do_nothing(index_elements=['post_id', 'user_id'])
+        elif dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(Like.__table__).values(**values).on_conflict_do_nothing(index_elements=['post_id', 'user_id'])
+        elif dialect in ('mysql', 'mariadb'):
+            stmt = db.insert(Like.__table__).values(**values).prefix_with('IGNORE')
+        else:
+            try:
+                with db.session.begin_nested():
+                    return db.session.execute(db.insert(Like.__table__).values(**values)).rowcount
+            except IntegrityError:
+                return 0
+        return db.session.execute(stmt).rowcount
+    
+    @staticmethod
+    def toggle(post_id, user_id):
+        """Like or unlike a post in the caller's transaction.
+        
+        Deletes the like if there is one, otherwise inserts it, ignoring a
+        conflicting insert from a concurrent request (a double click) instead
+        of failing on unique_post_user_like. The counter moves by the number
+        of rows actually changed. Returns (liked, like_count); like_count is
+        None, and nothing is inserted, if the post does not exist.
+        """
+        deleted = db.session.execute(
+            db.delete(Like.__table__).where(Like.post_id == post_id, Like.user_id == user_id)
+        ).rowcount
+        if deleted:
+            liked, delta = False, -deleted
+        else:
+            # Row lock on Postgres, so the post can't be deleted before the
+            # like is in; on SQLite the DELETE already holds the write lock
+            if db.session.query(Post.id).filter_by(id=post_id).with_for_update().scalar() is None:
+                return False, None
+            liked, delta = True, Like._insert_ignore(post_id, user_id)
+        
+        if delta:
+            Post.adjust_counters(post_id, like_count=delta)
+        like_count = db.session.query(Post.like_count).filter_by(id=post_id).scalar()
+        return liked, like_count
 
 
 class ReadEvent(db.Model):
@@ -113,6 +239,148 @@ class ReadEvent(db.Model):
     seconds = db.Column(db.Integer)  # time spent in seconds
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
+    # Covers the "first read of this post by this user?" check on ingestion
+    __table_args__ = (
+        db.Index('ix_read_events_post_user', 'post_id', 'user_id'),
+    )
+    
     def __repr__(self):
         return f'<ReadEvent {self.id} User {self.user_id} Post {self.post_id}>'
 
+
+
+class BeaconBatch(db.Model):
+    """BeaconBatch model - idempotency keys of accepted reading-progress beacons"""
+    __tablename__ = 'beacon_batches'
+    
+    user_id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)  # chosen by the page, unique per batch
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<BeaconBatch {self.key} User {self.user_id}>'
+
+
+class ReadDaily(db.Model):
+    """ReadDaily model - read events rolled up to one row per user, post and day"""
+    __tablename__ = 'read_daily'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    max_percent = db.Column(db.Integer, nullable=False, default=0)  # deepest scroll that day
+    seconds = db.Column(db.Integer, nullable=False, default=0)  # longest time on page that day
+    event_count = db.Column(db.Integer, nullable=False, default=0)  # raw heartbeats collapsed into this row
+    
+    __table_args__ = (
+        db.UniqueConstraint('post_id', 'user_id', 'day', name='unique_read_daily'),
+    )
+    
+    def __repr__(self):
+        return f'<ReadDaily User {self.user_id} Post {self.post_id} {self.day}>'
+
+
+class PostDailyStats(db.Model):
+    """PostDailyStats model - per-post daily reading aggregates built from read_daily"""
+    __tablename__ = 'post_daily_stats'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False, index=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    views = db.Column(db.Integer, nullable=False, default=0)  # raw read events
+    unique_readers = db.Column(db.Integer, nullable=False, default=0)
+    total_read_seconds = db.Column(db.Integer, nullable=False, default=0)
+    completion_histogram = db.Column(db.Text)  # JSON list of reader counts in 10% buckets
+    
+    __table_args__ = (
+        db.UniqueConstraint('post_id', 'day', name='unique_post_daily_stats'),
+    )
+    
+    def __repr__(self):
+        return f'<PostDailyStats Post {self.post_id} {self.day}>'
+
+
+class ReaderSketch(db.Model):
+    """ReaderSketch model - HyperLogLog registers of the readers of a post (0 = site) per day or month"""
+    __tablename__ = 'reader_sketches'
+    
+    post_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 0 for all posts
+    span = db.Column(db.String(1), primary_key=True)  # 'd' day, 'm' month (day is the 1st)
+    day = db.Column(db.Date, primary_key=True)
+    registers = db.Column(db.LargeBinary, nullable=False)  # see hll.py
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ReaderSketch Post {self.post_id} {self.span} {self.day}>'
+
+
+class RollupState(db.Model):
+    """RollupState model - high-water marks for incremental rollups"""
+    __tablename__ = 'rollup_state'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<RollupState {self.name} {self.last_id}>'
+
+
+class RelatedPost(db.Model):
+    """RelatedPost model - precomputed nearest neighbours of a post (related.py)"""
+    __tablename__ = 'related_posts'
+    
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True, autoincrement=False)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 0 = most related
+    related_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)
+    content_score = db.Column(db.Float, nullable=False, default=0.0)  # TF-IDF cosine
+    coread_score = db.Column(db.Float, nullable=False, default=0.0)  # reader-overlap cosine
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)  # last change to this post's list
+    
+    def __repr__(self):
+        return f'<RelatedPost {self.post_id} #{self.rank} -> {self.related_id}>'
+
+
+class ImageAsset(db.Model):
+    """ImageAsset model - resized and WebP derivatives of an uploaded image"""
+    __tablename__ = 'image_assets'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    source_path = db.Column(db.String(500), unique=True, nullable=False, index=True)  # URL path of the original
+    status = db.Column(db.String(20), default='pending')  # pending, ready, failed
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    variants = db.Column(db.Text)  # JSON: {size: {'width', 'height', 'jpeg'|'png', 'webp'}}
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ImageAsset {self.source_path} {self.status}>'
+    
+    def get_variants(self):
+        """Derivative info by size name, empty until processing finished"""
+        if self.status != 'ready' or not self.variants:
+            return {}
+        return json.loads(self.variants)
+    
+    def url(self, size, fmt=None):
+        """URL of one derivative, falling back to the original"""
+        variant = self.get_variants().get(size)
+        if not variant:
+            return self.source_path
+        return variant.get(fmt) or variant.get('jpeg') or variant.get('png') or self.source_path
+    
+    def srcset(self, fmt=None, max_size=None):
+        """srcset attribute value over all derivatives in the given format"""
+        entries = []
+        for size, variant in sorted(self.get_variants().items(), key=lambda item: item[1]['width']):
+            path = variant.get(fmt) if fmt else (variant.get('jpeg') or variant.get('png'))
+            if path:
+                entries.append(f"{path} {variant['width']}w")
+            if size == max_size:
+                break
+        return ', '.join(entries)
+
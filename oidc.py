@@ -0,0 +1,226 @@
+"""
+Shared cache for the Entra ID discovery document and signing keys (JWKS)
+
+authlib normally fetches the OpenID discovery document and the JWKS lazily
+in every worker process, so the first login after each deploy or worker
+recycle waits on two HTTP round trips to login.microsoftonline.com (and
+fails if they do). Here both are kept in a JSON file in the instance folder
+that all gunicorn workers share:
+
+- a worker reads the file instead of the network when it is fresh enough
+- shortly before the entry expires, one worker refreshes it in a background
+  thread while the others keep using the current copy
+- an ID token signed with an unknown key id triggers one forced JWKS refresh
+  (authlib retries with fetch_jwk_set(force=True)), rate limited so bogus
+  tokens can't make us hammer the endpoint
+- if the identity provider is unreachable, the last good copy is used
+
+python oidc.py fetches the document and keys into the cache, e.g. as a
+deploy step. Set OIDC_METADATA_URL to test against a local stand-in.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import requests
+from authlib.integrations.flask_client import FlaskOAuth2App
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+
+class OIDCMetadataCache:
+    """Discovery metadata and JWKS cached on disk and shared by workers"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.path = None
+        self.metadata_url = None
+        self.ttl = 24 * 3600
+        self.refresh_margin = 3600
+        self.timeout = 5
+        self.jwks_min_interval = 60
+        self._lock = threading.Lock()
+        self._data = None
+        self._signature = None
+        self._refreshing = False
+        self._retry_after = 0
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        self.app = app
+        self.path = app.config.get('OIDC_CACHE_FILE') or os.path.join(app.instance_path, 'oidc_cache.json')
+        self.metadata_url = app.config.get('OIDC_METADATA_URL') or (
+            f"https://login.microsoftonline.com/{app.config['ENTRA_TENANT_ID']}/v2.0/.well-known/openid-configuration"
+        )
+        self.ttl = app.config.get('OIDC_METADATA_TTL', self.ttl)
+        self.refresh_margin = app.config.get('OIDC_REFRESH_MARGIN', self.refresh_margin)
+        self.timeout = app.config.get('OIDC_HTTP_TIMEOUT', self.timeout)
+        self.jwks_min_interval = app.config.get('OIDC_JWKS_MIN_INTERVAL', self.jwks_min_interval)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        app.extensions['oidc_cache'] = self
+    
+    # -- disk ------------------------------------------------------------
+    
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    
+    def _load_disk(self):
+        """Pick up a copy written by another worker"""
+        signature = self._stat_signature()
+        if signature is None or signature == self._signature:
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self._signature = signature
+            # Ignore a cache written for another tenant or endpoint
+            if data.get('url') == self.metadata_url and data.get('metadata') and data.get('jwks'):
+                self._data = data
+    
+    def _write_disk(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.oidc_cache')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self._data = data
+            self._signature = self._stat_signature()
+    
+    # -- network ---------------------------------------------------------
+    
+    def _get_json(self, url):
+        response = requests.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+    
+    def _fetch_jwks(self, metadata):
+        jwks_uri = metadata.get('jwks_uri')
+        if not jwks_uri:
+            raise RuntimeError('Missing "jwks_uri" in OIDC metadata')
+        return self._get_json(jwks_uri)
+    
+    def refresh(self, jwks_only=False, blocking=True):
+        """Fetch fresh data and share it with the other workers.
+        
+        Holds an exclusive lock on <cache>.lock while fetching so concurrent
+        refreshes across workers collapse into one; a worker that waited for
+        the lock re-reads the file and skips the fetch if it is now newer.
+        Returns False if blocking=False and another process holds the lock.
+        """
+        started = time.time()
+        with open(self.path + '.lock', 'w') as lock_file:
+            if fcntl is not None:
+                flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                try:
+                    fcntl.flock(lock_file, flags)
+                except BlockingIOError:
+                    return False
+            
+            self._load_disk()
+            current = self._data
+            stamp = 'jwks_fetched_at' if jwks_only else 'fetched_at'
+            if current and current.get(stamp, 0) >= started:
+                return True
+            
+            now = time.time()
+            if jwks_only and current:
+                data = dict(current, jwks=self._fetch_jwks(current['metadata']), jwks_fetched_at=now)
+            else:
+                metadata = self._get_json(self.metadata_url)
+                data = {
+                    'url': self.metadata_url,
+                    'metadata': metadata,
+                    'jwks': self._fetch_jwks(metadata),
+                    'fetched_at': now,
+                    'jwks_fetched_at': now,
+                }
+            self._write_disk(data)
+        return True
+    
+    def _background_refresh(self):
+        try:
+            self.refresh(blocking=False)
+        except Exception as e:
+            self._retry_after = time.time() + 60
+            self.app.logger.error(f"OIDC metadata refresh error: {e}")
+        finally:
+            self._refreshing = False
+    
+    # -- lookups ---------------------------------------------------------
+    
+    def _current(self):
+        """Cached data, refreshed synchronously if missing or expired"""
+        self._load_disk()
+        data = self._data
+        now = time.time()
+        age = now - data['fetched_at'] if data else None
+        
+        if data is None or (age >= self.ttl and now >= self._retry_after):
+            try:
+                self.refresh()
+            except Exception as e:
+                if data is None:
+                    raise
+                # Better a day-old key set than no logins at all; don't
+                # make every login wait on the timeout while it is down
+                self._retry_after = now + 60
+                self.app.logger.error(f"OIDC metadata refresh error, using cached copy: {e}")
+            return self._data
+        if age >= self.ttl:
+            return data
+        
+        if age >= self.ttl - self.refresh_margin and not self._refreshing and now >= self._retry_after:
+            self._refreshing = True
+            threading.Thread(target=self._background_refresh, name='oidc-refresh', daemon=True).start()
+        return data
+    
+    def metadata(self):
+        """The discovery document"""
+        return self._current()['metadata']
+    
+    def jwks(self, force=False):
+        """The signing key set; force=True refetches it (at most once per interval)"""
+        data = self._current()
+        if force and time.time() - data.get('jwks_fetched_at', 0) >= self.jwks_min_interval:
+            self.refresh(jwks_only=True)
+            data = self._data
+        return data['jwks']
+
+
+oidc_cache = OIDCMetadataCache()
+
+
+class CachedOAuth2App(FlaskOAuth2App):
+    """authlib client that takes its metadata and keys from oidc_cache"""
+    
+    def load_server_metadata(self):
+        self.server_metadata.update(oidc_cache.metadata())
+        return self.server_metadata
+    
+    def fetch_jwk_set(self, force=False):
+        return oidc_cache.jwks(force=force)
+
+
+if __name__ == '__main__':
+    from app import create_app
+    
+    app = create_app()
+    
+    with app.app_context():
+        oidc_cache.refresh()
+        metadata = oidc_cache.metadata()
+        print(f"✓ Cached OIDC metadata for {metadata.get('issuer')}")
+        print(f"✓ {len(oidc_cache.jwks().get('keys', []))} signing keys written to {oidc_cache.path}")
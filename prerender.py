@@ -0,0 +1,255 @@
+"""
+Static pre-rendering of published month archives and posts
+
+Every published post page and month archive can be rendered once to an HTML
+file under PRERENDER_DIR (instance/prerendered by default):
+
+    post/<slug>.html
+    archive/<month_key>.html
+    nav.json                 the month menus, shared by every page
+
+The files hold nothing that depends on the viewer. The pages are rendered
+with placeholders (<!--prerender:name-->) where the month menus, the
+logged-in user's header links and the footer year go, and without the
+comments or the viewer's like state. The related-posts list is part of the
+file; related.py re-renders the pages whose list changes. The archive and
+post views still check the login and the conditional-GET validators first,
+then answer from the file: the placeholders are filled from nav.json and
+the session (a few string replacements, no queries, no template
+rendering), and the page's script fetches likes, counts and comments from
+/api/hydrate/... .
+
+A file older than the post's updated_at (or than its related-posts list)
+is ignored, and a missing file just means the page is rendered as before,
+so a stale or partial pre-render never serves outdated content.
+
+When a post is saved or deleted, admin.py calls refresh() with the post's
+old and new slug and month: only those pages and the navigation are
+rendered again. python prerender.py renders (or, with --clean, rebuilds)
+the whole site - run it after deploys that change templates or after
+python content.py.
+"""
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+from flask import current_app, get_template_attribute, render_template, session
+from sqlalchemy.orm import undefer
+from werkzeug.security import safe_join
+from models import db, Post
+from related import related_for
+
+MARKER = '<!--prerender:{}-->'
+NAV_SLOTS = ('nav_archives', 'nav_recent')
+
+
+class Prerenderer:
+    """Writes pre-rendered pages and serves them with the per-user bits filled in"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.directory = None
+        self._lock = threading.Lock()
+        self._nav_signature = None
+        self._nav = None
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('PRERENDER_ENABLED', self.enabled)
+        self.directory = app.config.get('PRERENDER_DIR') or os.path.join(app.instance_path, 'prerendered')
+        app.extensions['prerender'] = self
+    
+    def _path(self, kind, key):
+        # safe_join rejects slugs/month keys that would escape the directory
+        return safe_join(self.directory, kind, f'{key}.html')
+    
+    # -- writing ---------------------------------------------------------
+    
+    def _write(self, path, text):
+        """Replace path atomically, so a reader never sees half a page"""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.prerender')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def _remove(self, path):
+        if path and os.path.exists(path):
+            os.unlink(path)
+    
+    def _render(self, template, **context):
+        # A request of its own: no session, so nothing user-specific leaks
+        # into the file even when called from an admin request
+        with current_app.test_request_context('/'):
+            return render_template(template, prerendering=True, **context)
+    
+    def render_post(self, post):
+        """Write the page of a published post. Returns the path."""
+        path = self._path('post', post.slug)
+        if path is None:
+            raise ValueError(f'Unsafe slug: {post.slug!r}')
+        html = self._render('post.html', post=post, comments=[], like_count=post.like_count,
+                            user_liked=False, next_comment_cursor=None, related_posts=related_for(post.id))
+        self._write(path, html)
+        return path
+    
+    def render_month(self, month_key):
+        """Write a month's archive page, or remove it once the month has no published posts"""
+        path = self._path('archive', month_key)
+        if path is None:
+            raise ValueError(f'Unsafe month key: {month_key!r}')
+        posts = Post.query.filter_by(month_key=month_key, status='published').order_by(Post.published_at.desc()).all()
+        if not posts:
+            self._remove(path)
+            return None
+        featured_posts = posts[:2] if len(posts) >= 2 else posts
+        html = self._render('archive.html', posts=posts, featured_posts=featured_posts, month_key=month_key)
+        self._write(path, html)
+        return path
+    
+    def render_nav(self):
+        """Write the month menus that fill the nav placeholders"""
+        from cache import published_months
+        
+        months = published_months()
+        with current_app.test_request_context('/'):
+            fragments = {
+                'nav_archives': str(get_template_attribute('_nav.html', 'archive_items')(months)),
+                'nav_recent': str(get_template_attribute('_nav.html', 'recent_items')(months)),
+            }
+        self._write(os.path.join(self.directory, 'nav.json'), json.dumps(fragments))
+        return fragments
+    
+    def refresh(self, slugs=(), months=()):
+        """Re-render after a post change, committed already.
+        
+        slugs and months are the post's old and new values; pages of posts
+        that are gone or no longer published are removed. Errors are logged
+        (the page then falls back to normal rendering), never raised.
+        """
+        if not self.enabled:
+            return
+        try:
+            for slug in {s for s in slugs if s}:
+                post = Post.query.options(undefer(Post.compiled_html), undefer(Post.toc)).filter_by(
+                    slug=slug, status='published'
+                ).first()
+                if post is None:
+                    self._remove(self._path('post', slug))
+                else:
+                    self.render_post(post)
+            for month_key in {m for m in months if m}:
+                self.render_month(month_key)
+            self.render_nav()
+        except Exception as e:
+            current_app.logger.error(f"Pre-render error for {sorted(filter(None, slugs))}: {e}")
+    
+    def refresh_image(self, source_path):
+        """Re-render the pages whose hero image just got its derivatives"""
+        if not self.enabled:
+            return
+        posts = db.session.query(Post.slug, Post.month_key).filter_by(
+            hero_image_path=source_path, status='published'
+        ).all()
+        if posts:
+            self.refresh(slugs=[p.slug for p in posts], months=[p.month_key for p in posts])
+    
+    def render_all(self, clean=False):
+        """Render every published post and month and the navigation.
+        
+        clean=True also removes files of posts and months that are no
+        longer published. Returns (posts, months) rendered.
+        """
+        posts = Post.query.options(undefer(Post.compiled_html), undefer(Post.toc)).filter_by(status='published').all()
+        months = sorted({post.month_key for post in posts})
+        for post in posts:
+            self.render_post(post)
+        for month_key in months:
+            self.render_month(month_key)
+        self.render_nav()
+        
+        if clean:
+            keep = {('post', f'{post.slug}.html') for post in posts}
+            keep.update(('archive', f'{month_key}.html') for month_key in months)
+            for kind in ('post', 'archive'):
+                directory = os.path.join(self.directory, kind)
+                if os.path.isdir(directory):
+                    for name in os.listdir(directory):
+                        if name.endswith('.html') and (kind, name) not in keep:
+                            os.unlink(os.path.join(directory, name))
+        return len(posts), len(months)
+    
+    # -- serving ---------------------------------------------------------
+    
+    def _nav_fragments(self):
+        """nav.json, cached per worker until the file is replaced"""
+        path = os.path.join(self.directory, 'nav.json')
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        signature = (st.st_ino, st.st_mtime_ns)
+        if signature != self._nav_signature:
+            with open(path, encoding='utf-8') as f:
+                nav = json.load(f)
+            with self._lock:
+                self._nav, self._nav_signature = nav, signature
+        return self._nav
+    
+    def page(self, kind, key, not_before=None):
+        """The pre-rendered page with this viewer's header filled in, or None.
+        
+        None when pre-rendering is off, the file or the navigation is
+        missing, the file is older than not_before (the content's
+        updated_at), or a flash message is waiting to be shown.
+        """
+        if not self.enabled or '_flashes' in session:
+            return None
+        path = self._path(kind, key)
+        if path is None:
+            return None
+        try:
+            if not_before is not None and datetime.utcfromtimestamp(os.path.getmtime(path)) < not_before:
+                return None
+            with open(path, encoding='utf-8') as f:
+                html = f.read()
+        except FileNotFoundError:
+            return None
+        nav = self._nav_fragments()
+        if nav is None:
+            return None
+        
+        for slot in NAV_SLOTS:
+            html = html.replace(MARKER.format(slot), nav[slot])
+        user_header = get_template_attribute('_nav.html', 'user_header')(session)
+        html = html.replace(MARKER.format('user_header'), str(user_header))
+        return html.replace(MARKER.format('year'), str(datetime.utcnow().year))
+
+
+prerender = Prerenderer()
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import create_app
+    
+    parser = argparse.ArgumentParser(description='Pre-render published posts and month archives')
+    parser.add_argument('--clean', action='store_true', help='also remove pages that are no longer published')
+    args = parser.parse_args()
+    
+    app = create_app()
+    
+    with app.app_context():
+        post_count, month_count = prerender.render_all(clean=args.clean)
+        print(f"✓ Pre-rendered {post_count} posts and {month_count} months to {prerender.directory}")
+        if not prerender.enabled:
+            print("  (PRERENDER_ENABLED is off: the site won't serve them until it is set)")
@@ -0,0 +1,347 @@
+"""
+Precomputed related posts from content similarity and co-reading
+
+Each published post keeps its RELATED_POSTS_COUNT nearest neighbours in
+related_posts, ranked by a blend of two cosine similarities:
+
+    content  TF-IDF over the title (counted twice), category and the
+             tag-stripped compiled body, sublinear term frequency
+    co-read  overlap of the two posts' readers in read_daily (the rolled-up
+             read events, kept after the raw rows are archived)
+
+    score = (1 - w) * content + w * co-read
+    w = (1 - RELATED_CONTENT_WEIGHT) * min(1, readers / COREAD_FULL_READERS)
+
+where readers is the smaller of the two posts' reader counts, so a pair
+with few readers leans on its text. Both matrices are row-normalized and
+kept in CSR and CSC form as plain NumPy arrays; one row of M @ M.T (a
+post's similarity to every other post) is a gather over the columns the
+row touches and a bincount. Building the matrices reads every published
+post and every (post, reader) pair, so it only happens in python
+related.py; after that, only the lists being refreshed are scored.
+
+The post page reads its list with one indexed query (related_for). The
+lists are rewritten by refresh_related(), which only recomputes:
+
+    - the posts passed in, and posts edited since the last run
+    - published posts without a full list
+    - posts read by anyone with new read_daily rows since the last run
+    - lists that name a post that is gone or no longer published
+    - lists an edited post now scores its way into
+
+python related.py runs it from cron, after the rollup. The admin views
+don't recompute anything: a saved post is picked up by its updated_at, a
+deleted one's entries are dropped (forget_post) and the lists it leaves
+short are refilled, and meanwhile only the pre-rendered pages that show
+the post are rendered again. New posts shift the IDF weights of every
+term a little; python related.py --all recomputes everything (nightly,
+and after bulk imports).
+"""
+import math
+import re
+from collections import Counter
+from datetime import datetime
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
+from models import db, Post, ReadDaily, RelatedPost, RollupState
+from search import strip_tags
+
+STATE_NAME = 'related_posts'
+COREAD_FULL_READERS = 20  # shared-reader signal gets its full weight from this many readers
+
+_WORD = re.compile(r'[a-z][a-z0-9]+')
+STOPWORDS = frozenset('''
+    about above after again against all also am an and any are as at be because been before being below
+    between both but by can could did do does doing down during each few for from further had has have
+    having he her here hers herself him himself his how if in into is it its itself just me more most my
+    myself no nor not now of off on once only or other our ours ourselves out over own same she should so
+    some such than that the their theirs them themselves then there these they this those through to too
+    under until up very was we were what when where which while who whom why will with would you your
+    yours yourself yourselves
+'''.split())
+
+
+class _Sparse:
+    """Sparse matrix held as CSR and CSC arrays"""
+    
+    def __init__(self, rows, cols, values, shape):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        self.shape = shape
+        
+        order = np.lexsort((cols, rows))
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=shape[0]))))
+        self.indices = cols[order]
+        self.data = values[order]
+        
+        order = np.lexsort((rows, cols))
+        self.col_indptr = np.concatenate(([0], np.cumsum(np.bincount(cols, minlength=shape[1]))))
+        self.col_rows = rows[order]
+        self.col_data = values[order]
+    
+    def column_rows(self, j):
+        """Rows with an entry in column j"""
+        return self.col_rows[self.col_indptr[j]:self.col_indptr[j + 1]]
+    
+    def dot_row(self, i):
+        """Dot product of row i with every row (column i of M @ M.T)"""
+        start, end = self.indptr[i], self.indptr[i + 1]
+        cols, values = self.indices[start:end], self.data[start:end]
+        if not len(cols):
+            return np.zeros(self.shape[0])
+        starts = self.col_indptr[cols]
+        lengths = self.col_indptr[cols + 1] - starts
+        # Positions of every entry in those columns, in one flat array
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        weights = self.col_data[offsets] * np.repeat(values, lengths)
+        return np.bincount(self.col_rows[offsets], weights=weights, minlength=self.shape[0])
+
+
+def _terms(post):
+    """Term counts of a post row (id, title, category, compiled_html, html_content)"""
+    body = post.compiled_html if post.compiled_html is not None else post.html_content
+    text = ' '.join([post.title, post.title, post.category or '', strip_tags(body)]).lower()
+    return Counter(word for word in _WORD.findall(text) if word not in STOPWORDS)
+
+
+def _normalized(rows, cols, values, shape):
+    """_Sparse with every row scaled to unit length"""
+    rows = np.asarray(rows, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=shape[0]))
+    return _Sparse(rows, cols, values / norms[rows], shape)
+
+
+class _Model:
+    """Both similarity matrices over the published posts"""
+    
+    def __init__(self):
+        posts = db.session.query(
+            Post.id, Post.title, Post.category, Post.compiled_html, Post.html_content
+        ).filter_by(status='published').order_by(Post.id).all()
+        self.ids = np.array([post.id for post in posts], dtype=np.int64)
+        self.index = {post.id: i for i, post in enumerate(posts)}
+        n = len(posts)
+        
+        # TF-IDF with sublinear tf and smoothed idf
+        vocabulary = {}
+        rows, cols, tf = [], [], []
+        for i, post in enumerate(posts):
+            for word, count in _terms(post).items():
+                rows.append(i)
+                cols.append(vocabulary.setdefault(word, len(vocabulary)))
+                tf.append(1.0 + math.log(count))
+        cols = np.asarray(cols, dtype=np.int64)
+        df = np.bincount(cols, minlength=len(vocabulary))
+        idf = np.log((1.0 + n) / (1.0 + df)) + 1.0
+        self.content = _normalized(rows, cols, np.asarray(tf) * idf[cols], (n, len(vocabulary)))
+        
+        # Reader sets, each entry 1/sqrt(readers) so row products are cosines
+        pairs = db.session.query(ReadDaily.post_id, ReadDaily.user_id).distinct().all()
+        users = {}
+        rows, cols = [], []
+        for post_id, user_id in pairs:
+            i = self.index.get(post_id)
+            if i is not None:
+                rows.append(i)
+                cols.append(users.setdefault(user_id, len(users)))
+        self.users = users
+        self.readers = np.bincount(np.asarray(rows, dtype=np.int64), minlength=n)
+        self.coread = _normalized(rows, cols, np.ones(len(rows)), (n, len(users)))
+        
+        self.content_weight = current_app.config['RELATED_CONTENT_WEIGHT']
+    
+    def scores(self, i):
+        """(score, content, co-read) of post i against every published post"""
+        content = self.content.dot_row(i)
+        coread = self.coread.dot_row(i)
+        shared = np.minimum(self.readers[i], self.readers)
+        weight = (1.0 - self.content_weight) * np.minimum(1.0, shared / COREAD_FULL_READERS)
+        score = (1.0 - weight) * content + weight * coread
+        score[i] = 0.0
+        return score, content, coread
+    
+    def neighbours(self, i, k):
+        """The k best (related_id, score, content, co-read), best first"""
+        score, content, coread = self.scores(i)
+        candidates = np.flatnonzero(score > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-score[candidates], k - 1)[:k]]
+        # Ties go to the older post, so the order is stable between runs
+        candidates = candidates[np.lexsort((self.ids[candidates], -score[candidates]))]
+        return [(int(self.ids[j]), float(score[j]), float(content[j]), float(coread[j])) for j in candidates]
+    
+    def posts_read_by(self, user_ids):
+        """Indexes of the posts any of these users has read"""
+        found = set()
+        for user_id in user_ids:
+            j = self.users.get(user_id)
+            if j is not None:
+                found.update(self.coread.column_rows(j).tolist())
+        return found
+
+
+def _current_lists():
+    """post id -> [(related_id, score)] in rank order, and post id -> computed_at"""
+    lists, computed = {}, {}
+    rows = db.session.query(
+        RelatedPost.post_id, RelatedPost.related_id, RelatedPost.score, RelatedPost.computed_at
+    ).order_by(RelatedPost.post_id, RelatedPost.rank)
+    for post_id, related_id, score, computed_at in rows:
+        lists.setdefault(post_id, []).append((related_id, score))
+        computed[post_id] = computed_at
+    return lists, computed
+
+
+def refresh_related(post_ids=(), full=False):
+    """Recompute the lists that new posts, edits or reads may have changed.
+    
+    post_ids are posts just saved, unpublished or deleted; full=True
+    recomputes every list. Commits, and returns the ids of published posts
+    whose list of related posts changed.
+    """
+    started = datetime.utcnow()
+    k = current_app.config['RELATED_POSTS_COUNT']
+    state = db.session.get(RollupState, STATE_NAME)
+    if state is None:
+        state = RollupState(name=STATE_NAME, last_id=0, updated_at=None)
+        db.session.add(state)
+    new_mark = db.session.query(func.max(ReadDaily.id)).scalar() or 0
+    
+    model = _Model()
+    published = set(model.index)
+    current, computed = _current_lists()
+    
+    if full or state.updated_at is None:
+        targets = set(published)
+        edited = set()
+    else:
+        edited = set(post_ids)
+        edited.update(post_id for (post_id,) in db.session.query(Post.id).filter(
+            Post.updated_at > state.updated_at
+        ))
+        targets = edited & published
+        # New posts, and lists a deleted post left short
+        targets.update(post_id for post_id in published if len(current.get(post_id, ())) < k)
+        # Co-read scores move for every post the new readers have read
+        readers = {user_id for (user_id,) in db.session.query(ReadDaily.user_id).filter(
+            ReadDaily.id > state.last_id
+        ).distinct()}
+        targets.update(int(model.ids[i]) for i in model.posts_read_by(readers))
+        # Lists naming a post that is gone or unpublished
+        targets.update(post_id for post_id, items in current.items()
+                       if any(related_id not in published for related_id, _ in items))
+        # Scores are symmetric: an edited post's row says whose list it now enters
+        for post_id in edited & published:
+            score = model.scores(model.index[post_id])[0]
+            for j in np.flatnonzero(score > 0):
+                other = int(model.ids[j])
+                items = current.get(other, [])
+                if len(items) < k or score[j] > items[-1][1]:
+                    targets.add(other)
+        targets.update(post_id for post_id, items in current.items()
+                       if any(related_id in edited for related_id, _ in items))
+    
+    # Lists of posts that are no longer published just go
+    stale = set(current) - published
+    if stale:
+        RelatedPost.query.filter(RelatedPost.post_id.in_(stale)).delete(synchronize_session=False)
+    
+    changed = set()
+    targets &= published
+    if targets:
+        RelatedPost.query.filter(RelatedPost.post_id.in_(targets)).delete(synchronize_session=False)
+        rows = []
+        for post_id in sorted(targets):
+            neighbours = model.neighbours(model.index[post_id], k)
+            computed_at = computed.get(post_id)
+            if [related_id for related_id, *_ in neighbours] != [related_id for related_id, _ in current.get(post_id, [])]:
+                changed.add(post_id)
+                computed_at = started
+            # Scores are refreshed either way; computed_at only moves with the list
+            # itself, since it is part of the post page's validators
+            rows.extend(
+                {'post_id': post_id, 'rank': rank, 'related_id': related_id, 'score': score,
+                 'content_score': content, 'coread_score': coread, 'computed_at': computed_at}
+                for rank, (related_id, score, content, coread) in enumerate(neighbours)
+            )
+        if rows:
+            db.session.execute(RelatedPost.__table__.insert(), rows)
+    
+    state.last_id = new_mark
+    state.updated_at = started
+    db.session.commit()
+    return changed
+
+
+def forget_post(post_id):
+    """Drop a post's list and its entries in other lists, before deleting it.
+    
+    Returns the ids of the posts that listed it, to pass to publish() once
+    the delete is committed; python related.py refills their lists.
+    """
+    listed_by = listing_posts(post_id)
+    RelatedPost.query.filter(
+        (RelatedPost.post_id == post_id) | (RelatedPost.related_id == post_id)
+    ).delete(synchronize_session=False)
+    listed_by.discard(post_id)
+    return listed_by
+
+
+def listing_posts(post_id):
+    """Ids of the posts whose list shows this post"""
+    return {post_id for (post_id,) in db.session.query(RelatedPost.post_id).filter_by(related_id=post_id)}
+
+
+def publish(changed):
+    """Re-render the static pages of posts whose list changed.
+    
+    Their ETags move by themselves: list_changed_at() is part of the post
+    page's validators, so the site-wide content generation is left alone.
+    The admin views also call it for the pages that show a post just
+    edited or deleted, whose title, slug or image is baked into them.
+    """
+    # prerender.py imports this module for related_for()
+    from prerender import prerender
+    
+    if changed and prerender.enabled:
+        prerender.refresh(slugs=[slug for (slug,) in db.session.query(Post.slug).filter(Post.id.in_(changed))])
+
+
+def list_changed_at(post_id_column):
+    """SQL expression: when the related list of the post in post_id_column last changed"""
+    return select(func.max(RelatedPost.computed_at)).where(
+        RelatedPost.post_id == post_id_column
+    ).scalar_subquery()
+
+
+def related_for(post_id, limit=None):
+    """The precomputed related posts of a post, best first (one query)"""
+    limit = limit or current_app.config['RELATED_POSTS_COUNT']
+    return Post.query.join(RelatedPost, RelatedPost.related_id == Post.id).options(
+        joinedload(Post.hero_asset)
+    ).filter(
+        RelatedPost.post_id == post_id, Post.status == 'published'
+    ).order_by(RelatedPost.rank).limit(limit).all()
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import create_app
+    from rollup import run_rollup
+    
+    parser = argparse.ArgumentParser(description='Refresh the precomputed related posts')
+    parser.add_argument('--all', action='store_true', help='recompute every list, not only the ones that may have changed')
+    args = parser.parse_args()
+    
+    app = create_app()
+    
+    with app.app_context():
+        # Co-reading comes from read_daily: fold in the latest read events first
+        run_rollup()
+        changed = refresh_related(full=args.all)
+        publish(changed)
+        print(f"✓ Refreshed related posts ({len(changed)} lists changed)")
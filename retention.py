@@ -0,0 +1,251 @@
+"""
+Retention and cold archival of raw read events
+
+read_events only needs recent rows: everything the admin pages show comes
+from the rollups (read_daily, post_daily_stats), and those are kept
+forever. Events older than READ_EVENT_RETENTION_DAYS that the rollup has
+already folded in (id at or below its high-water mark) are moved to
+gzip-compressed NDJSON files, partitioned by month:
+
+    <READ_EVENT_ARCHIVE_DIR>/2026-01/000000001-000005000.ndjson.gz
+
+one file per chunk, named after the first and last id it holds. A chunk
+is read in id order, written to its files (atomically, fsynced), and then
+deleted from the live table in its own short transaction, so the write lock
+is held for one bounded DELETE at a time. A run interrupted between the two
+steps rewrites the same files on the next run.
+
+iter_archived() reads the archive back with the same filters as export.py,
+and python retention.py query streams it as CSV or NDJSON:
+
+    python retention.py archive [--days 90] [--dry-run] [--vacuum]
+    python retention.py query --since 2025-01-01 --until 2025-03-31 --post-id 7 --format csv
+"""
+import gzip
+import heapq
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from operator import itemgetter
+from flask import current_app
+from sqlalchemy import select
+from models import db, ReadEvent
+from rollup import get_high_water_mark
+
+COLUMNS = ('id', 'post_id', 'user_id', 'percent', 'seconds', 'created_at')
+
+
+def archive_dir():
+    return current_app.config.get('READ_EVENT_ARCHIVE_DIR') or os.path.join(
+        current_app.instance_path, 'archive', 'read_events'
+    )
+
+
+def _eligible(cutoff, mark):
+    table = ReadEvent.__table__
+    return (table.c.created_at < cutoff) & (table.c.id <= mark)
+
+
+def _write_part(path, rows):
+    """Write rows as one gzip NDJSON file, replacing any earlier copy"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as f:
+            for row in rows:
+                record = dict(zip(COLUMNS, row))
+                record['created_at'] = record['created_at'].isoformat()
+                f.write(json.dumps(record).encode('utf-8') + b'\n')
+            f.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def archive_read_events(retention_days=None, chunk_size=None, max_chunks=None, pause=None, dry_run=False):
+    """Move read events older than the retention window to the archive.
+    
+    Only events already folded into the rollups are moved. Returns the
+    number of events archived (or, with dry_run, that would be).
+    """
+    config = current_app.config
+    retention_days = config['READ_EVENT_RETENTION_DAYS'] if retention_days is None else retention_days
+    chunk_size = chunk_size or config['READ_EVENT_ARCHIVE_CHUNK']
+    pause = config['READ_EVENT_ARCHIVE_PAUSE'] if pause is None else pause
+    
+    table = ReadEvent.__table__
+    cutoff = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=retention_days)
+    eligible = _eligible(cutoff, get_high_water_mark())
+    
+    if dry_run:
+        return db.session.query(table).filter(eligible).count()
+    
+    directory = archive_dir()
+    archived = 0
+    chunks = 0
+    last_id = 0
+    while max_chunks is None or chunks < max_chunks:
+        rows = db.session.execute(
+            select(*(table.c[name] for name in COLUMNS))
+            .where(eligible, table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(chunk_size)
+        ).all()
+        db.session.rollback()
+        if not rows:
+            break
+        first_id, last_id = rows[0][0], rows[-1][0]
+        
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row[5].strftime('%Y-%m'), []).append(row)
+        for month, month_rows in by_month.items():
+            _write_part(os.path.join(directory, month, f'{first_id:09d}-{last_id:09d}.ndjson.gz'), month_rows)
+        
+        # The same condition over the chunk's id range is exactly the rows
+        # just written: nothing newer than the mark or the cutoff is touched
+        db.session.execute(table.delete().where(eligible, table.c.id.between(first_id, last_id)))
+        db.session.commit()
+        
+        archived += len(rows)
+        chunks += 1
+        if len(rows) < chunk_size:
+            break
+        if pause:
+            # Let the read-event flushers in between chunks
+            time.sleep(pause)
+    
+    return archived
+
+
+def archived_months():
+    """Months (YYYY-MM) that have archive files, oldest first"""
+    directory = archive_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+
+
+def _read_part(path):
+    """Records of one archive file, in id order (the order they were written)"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def iter_archived(post_id=None, user_id=None, since=None, until=None):
+    """Archived events as row tuples (COLUMNS order), in id order within each month.
+    
+    Takes the filters of export.iter_batches(); until is inclusive. Only
+    the month directories overlapping the range are opened.
+    
+    Ids don't follow created_at, so the files of runs with different
+    cutoffs cover interleaving id ranges. Each month's files are merged by
+    id instead of read one after another, which also lets an event
+    archived twice (a chunk rewritten after an interrupted run) be
+    recognised by its id and read once.
+    """
+    directory = archive_dir()
+    first_month = since.strftime('%Y-%m') if since else None
+    last_month = until.strftime('%Y-%m') if until else None
+    end = until + timedelta(days=1) if until else None
+    
+    for month in archived_months():
+        if (first_month and month < first_month) or (last_month and month > last_month):
+            continue
+        month_dir = os.path.join(directory, month)
+        parts = [_read_part(os.path.join(month_dir, name))
+                 for name in sorted(os.listdir(month_dir)) if name.endswith('.ndjson.gz')]
+        previous_id = None
+        for record in heapq.merge(*parts, key=itemgetter('id')):
+            if record['id'] == previous_id:
+                continue
+            previous_id = record['id']
+            if post_id is not None and record['post_id'] != post_id:
+                continue
+            if user_id is not None and record['user_id'] != user_id:
+                continue
+            created_at = datetime.fromisoformat(record['created_at'])
+            if (since and created_at < since) or (end and created_at >= end):
+                continue
+            yield (record['id'], record['post_id'], record['user_id'], record['percent'],
+                   record['seconds'], created_at)
+
+
+def iter_archived_batches(batch_size=5000, **filters):
+    """iter_archived() in lists of rows, for export.format_batches()"""
+    batch = []
+    for row in iter_archived(**filters):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def vacuum():
+    """Give the space freed by deleted rows back to the filesystem (SQLite).
+    
+    VACUUM rewrites the whole file and blocks writers while it runs, so
+    run it in a quiet period, not after every archive run.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql('VACUUM')
+    return True
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    from app import create_app
+    from export import parse_date, format_batches, gzip_chunks
+    
+    parser = argparse.ArgumentParser(description='Archive old read events, or query the archive')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    archive_parser = commands.add_parser('archive', help='move events past the retention window to the archive')
+    archive_parser.add_argument('--days', type=int, help='retention window (READ_EVENT_RETENTION_DAYS)')
+    archive_parser.add_argument('--chunk-size', type=int, help='events per chunk (READ_EVENT_ARCHIVE_CHUNK)')
+    archive_parser.add_argument('--max-chunks', type=int)
+    archive_parser.add_argument('--dry-run', action='store_true', help='only count the events that would move')
+    archive_parser.add_argument('--vacuum', action='store_true', help='VACUUM the SQLite file afterwards')
+    
+    query_parser = commands.add_parser('query', help='stream archived events')
+    query_parser.add_argument('--format', choices=['csv', 'ndjson'], default='ndjson')
+    query_parser.add_argument('--gzip', action='store_true', help='gzip the output')
+    query_parser.add_argument('--post-id', type=int)
+    query_parser.add_argument('--user-id', type=int)
+    query_parser.add_argument('--since', type=parse_date, help='YYYY-MM-DD, inclusive')
+    query_parser.add_argument('--until', type=parse_date, help='YYYY-MM-DD, inclusive')
+    args = parser.parse_args()
+    
+    app = create_app(web=False)
+    
+    with app.app_context():
+        if args.command == 'archive':
+            if args.dry_run:
+                count = archive_read_events(args.days, dry_run=True)
+                print(f"✓ {count} read events are past the retention window and rolled up")
+            else:
+                count = archive_read_events(args.days, args.chunk_size, args.max_chunks)
+                print(f"✓ Archived {count} read events to {archive_dir()}")
+                if args.vacuum and vacuum():
+                    print("✓ Vacuumed the database file")
+        else:
+            batches = iter_archived_batches(post_id=args.post_id, user_id=args.user_id,
+                                            since=args.since, until=args.until)
+            chunks = format_batches('read_events', batches, args.format)
+            if args.gzip:
+                chunks = gzip_chunks(chunks)
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
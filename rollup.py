@@ -0,0 +1,263 @@
+"""
+Incremental rollups of read events
+
+Raw read_events rows are heartbeats (one every 30 seconds per open tab), so
+anything that scans them gets slower forever. This module folds new events,
+from a stored high-water mark onwards, into:
+
+- read_daily: one row per (user, post, day) with the deepest scroll, the
+  longest time on page and the number of heartbeats collapsed into it
+- post_daily_stats: one row per (post, day) with views, unique readers,
+  total read time and a 10% completion histogram
+
+Run it from cron (python rollup.py). The admin views fold at most one small
+chunk (ROLLUP_REQUEST_CHUNK events) before reading, so a backlog never
+holds the write lock during a page view; cron catches up the rest.
+
+The high-water mark assumes every id below it is visible. On SQLite writes
+are serialized, but on Postgres an id is taken at INSERT and only shows up
+at COMMIT, so a lower id can appear after a higher one was folded, and
+would then be skipped for good (and archived by retention.py without ever
+being counted). Events received in the last ROLLUP_SAFETY_LAG_SECONDS are
+therefore left for the next run: the lag has to outlast an ingest batch's
+transaction plus its time in the write-behind buffer. Events inserted with
+an older created_at than their arrival (bulk imports) bypass the lag;
+load them with the workers stopped, or run the rollup only afterwards.
+"""
+import json
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import case, func, tuple_
+from sqlalchemy.exc import IntegrityError
+from models import db, ReadEvent, ReadDaily, PostDailyStats, RollupState
+
+STATE_NAME = 'read_events'
+HISTOGRAM_BUCKETS = 10
+
+
+def _as_date(value):
+    """func.date() returns a string on SQLite and a date on Postgres"""
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def completion_bucket(column):
+    """SQL expression mapping a 0-100 percentage to a 0-9 histogram bucket"""
+    return case((column >= 100, HISTOGRAM_BUCKETS - 1), else_=column // 10)
+
+
+def get_high_water_mark():
+    """Id of the last read event folded into the rollups"""
+    state = db.session.get(RollupState, STATE_NAME)
+    return state.last_id if state else 0
+
+
+def _upsert(table):
+    """A dialect INSERT that supports ON CONFLICT DO UPDATE, or None"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert(table)
+
+
+def _greater(current, new):
+    """The larger of two columns (max() is an aggregate on Postgres)"""
+    return case((new > current, new), else_=current)
+
+
+def _merge_read_daily(start_id, end_id):
+    """Fold read events with start_id < id <= end_id into read_daily.
+    
+    Returns the set of (post_id, day) pairs that changed and the number of
+    events folded in.
+    """
+    day = func.date(ReadEvent.created_at)
+    grouped = db.session.query(
+        ReadEvent.post_id,
+        ReadEvent.user_id,
+        day,
+        func.max(ReadEvent.percent),
+        func.max(ReadEvent.seconds),
+        func.count(ReadEvent.id),
+    ).filter(
+        ReadEvent.id > start_id,
+        ReadEvent.id <= end_id,
+    ).group_by(ReadEvent.post_id, ReadEvent.user_id, day).all()
+    
+    if not grouped:
+        return set(), 0
+    
+    rows = [{
+        'post_id': post_id,
+        'user_id': user_id,
+        'day': _as_date(event_day),
+        'max_percent': max_percent or 0,
+        'seconds': max_seconds or 0,
+        'event_count': count,
+    } for post_id, user_id, event_day, max_percent, max_seconds, count in grouped]
+    
+    table = ReadDaily.__table__
+    stmt = _upsert(table)
+    if stmt is not None:
+        # One statement for the whole chunk; existing rows keep the deeper
+        # scroll and the longer time and add up the heartbeats
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['post_id', 'user_id', 'day'],
+            set_={
+                'max_percent': _greater(table.c.max_percent, stmt.excluded.max_percent),
+                'seconds': _greater(table.c.seconds, stmt.excluded.seconds),
+                'event_count': table.c.event_count + stmt.excluded.event_count,
+            },
+        )
+        db.session.execute(stmt, rows)
+    else:
+        existing = {
+            (row.post_id, row.user_id, row.day): row
+            for row in ReadDaily.query.filter(
+                ReadDaily.post_id.in_({r['post_id'] for r in rows}), ReadDaily.day.in_({r['day'] for r in rows})
+            )
+        }
+        for values in rows:
+            row = existing.get((values['post_id'], values['user_id'], values['day']))
+            if row is None:
+                db.session.add(ReadDaily(**values))
+            else:
+                row.max_percent = max(row.max_percent, values['max_percent'])
+                row.seconds = max(row.seconds, values['seconds'])
+                row.event_count += values['event_count']
+        db.session.flush()
+    
+    pairs = {(r['post_id'], r['day']) for r in rows}
+    return pairs, sum(r['event_count'] for r in rows)
+
+
+def _refresh_post_daily(pairs):
+    """Recompute post_daily_stats rows for the given (post_id, day) pairs"""
+    if not pairs:
+        return
+    
+    key = tuple_(ReadDaily.post_id, ReadDaily.day)
+    totals = db.session.query(
+        ReadDaily.post_id,
+        ReadDaily.day,
+        func.sum(ReadDaily.event_count),
+        func.count(ReadDaily.id),
+        func.sum(ReadDaily.seconds),
+    ).filter(key.in_(pairs)).group_by(ReadDaily.post_id, ReadDaily.day).all()
+    
+    bucket = completion_bucket(ReadDaily.max_percent)
+    histograms = {pair: [0] * HISTOGRAM_BUCKETS for pair in pairs}
+    for post_id, day, bucket_index, readers in db.session.query(
+        ReadDaily.post_id, ReadDaily.day, bucket, func.count(ReadDaily.id)
+    ).filter(key.in_(pairs)).group_by(ReadDaily.post_id, ReadDaily.day, bucket):
+        histograms[(post_id, _as_date(day))][int(bucket_index)] = readers
+    
+    rows = [{
+        'post_id': post_id,
+        'day': _as_date(day),
+        'views': views or 0,
+        'unique_readers': readers or 0,
+        'total_read_seconds': seconds or 0,
+        'completion_histogram': json.dumps(histograms[(post_id, _as_date(day))]),
+    } for post_id, day, views, readers, seconds in totals]
+    
+    table = PostDailyStats.__table__
+    stmt = _upsert(table)
+    if stmt is not None:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['post_id', 'day'],
+            set_={name: stmt.excluded[name]
+                  for name in ('views', 'unique_readers', 'total_read_seconds', 'completion_histogram')},
+        )
+        db.session.execute(stmt, rows)
+        return
+    
+    existing = {
+        (row.post_id, row.day): row
+        for row in PostDailyStats.query.filter(tuple_(PostDailyStats.post_id, PostDailyStats.day).in_(pairs))
+    }
+    for values in rows:
+        row = existing.get((values['post_id'], values['day']))
+        if row is None:
+            db.session.add(PostDailyStats(**values))
+        else:
+            for name, value in values.items():
+                setattr(row, name, value)
+
+
+def run_rollup(chunk_size=50000, max_chunks=None):
+    """Fold read events newer than the high-water mark into the rollups.
+    
+    Works through the backlog in id ranges of chunk_size, committing each
+    range together with the new mark. The mark is moved first, so a second
+    process folding the same range waits for the first one's commit, then
+    finds the mark moved, rolls back and stops: events are never counted
+    twice. A range ends before the first event younger than
+    ROLLUP_SAFETY_LAG_SECONDS. Returns the number of events processed.
+    """
+    processed = 0
+    chunks = 0
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['ROLLUP_SAFETY_LAG_SECONDS'])
+    
+    while max_chunks is None or chunks < max_chunks:
+        state = db.session.get(RollupState, STATE_NAME)
+        if state is None:
+            state = RollupState(name=STATE_NAME, last_id=0)
+            db.session.add(state)
+            db.session.commit()
+        
+        start_id = state.last_id
+        max_id = db.session.query(func.max(ReadEvent.id)).scalar() or 0
+        if max_id <= start_id:
+            break
+        end_id = min(max_id, start_id + chunk_size)
+        # Stop short of recent events: lower ids may still be uncommitted
+        recent_id = db.session.query(func.min(ReadEvent.id)).filter(
+            ReadEvent.id > start_id, ReadEvent.id <= end_id, ReadEvent.created_at >= cutoff
+        ).scalar()
+        if recent_id is not None:
+            end_id = recent_id - 1
+        if end_id <= start_id:
+            break
+        
+        claimed = RollupState.query.filter_by(name=STATE_NAME, last_id=start_id).update(
+            {RollupState.last_id: end_id, RollupState.updated_at: datetime.utcnow()},
+            synchronize_session=False,
+        )
+        if not claimed:
+            db.session.rollback()
+            break
+        
+        try:
+            pairs, event_count = _merge_read_daily(start_id, end_id)
+            _refresh_post_daily(pairs)
+            db.session.flush()
+        except IntegrityError:
+            # Only the per-row path on other databases: another process
+            # inserted the same new rollup rows first
+            db.session.rollback()
+            break
+        db.session.commit()
+        
+        processed += event_count
+        chunks += 1
+    
+    return processed
+
+
+if __name__ == '__main__':
+    from app import create_app
+    from ingest import prune_beacon_batches
+    
+    app = create_app(web=False)
+    
+    with app.app_context():
+        processed = run_rollup()
+        print(f"✓ Rolled up {processed} read events (high-water mark {get_high_water_mark()})")
+        pruned = prune_beacon_batches(timedelta(hours=app.config['BEACON_KEY_TTL_HOURS']))
+        print(f"✓ Pruned {pruned} beacon idempotency keys")
@@ -0,0 +1,171 @@
+"""
+Full-text search over published posts (SQLite FTS5)
+
+posts_fts is an FTS5 table whose rowid is the post id. It holds the title,
+excerpt, category and the tag-stripped body of every published post. The
+admin views update it in the same transaction as the post itself, and
+python search.py rebuilds it from scratch. Queries are ranked with BM25 and
+return highlighted snippets.
+
+FTS5 is SQLite-only; on other databases indexing is a no-op and search()
+raises SearchUnavailable.
+"""
+import html
+from html.parser import HTMLParser
+from sqlalchemy import text
+from models import db, Post
+
+# Column weights for bm25(): title, excerpt, category, body
+BM25_WEIGHTS = (10.0, 4.0, 2.0, 1.0)
+
+# Private-use markers around matches, swapped for <mark> after escaping
+_MATCH_START = '\ue000'
+_MATCH_END = '\ue001'
+
+
+class SearchUnavailable(Exception):
+    """Raised when the database has no FTS5 support"""
+
+
+class _TextExtractor(HTMLParser):
+    """Collect the text content of an HTML fragment"""
+    
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+    
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+def strip_tags(html_content):
+    """Plain text of an HTML fragment, whitespace collapsed"""
+    if not html_content:
+        return ''
+    extractor = _TextExtractor()
+    extractor.feed(html_content)
+    extractor.close()
+    return ' '.join(' '.join(extractor.parts).split())
+
+
+def is_supported():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def ensure_index():
+    """Create the FTS table if it does not exist yet"""
+    if not is_supported():
+        return
+    db.session.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5("
+        "title, excerpt, category, body, tokenize='porter unicode61')"
+    ))
+
+
+def index_post(post):
+    """Add, refresh or drop one post in the index (within the current transaction).
+    
+    The post must have an id, so call db.session.flush() first for new posts.
+    Only published posts stay in the index.
+    """
+    if not is_supported():
+        return
+    ensure_index()
+    db.session.execute(text("DELETE FROM posts_fts WHERE rowid = :id"), {'id': post.id})
+    if post.status == 'published':
+        db.session.execute(text(
+            "INSERT INTO posts_fts (rowid, title, excerpt, category, body) "
+            "VALUES (:id, :title, :excerpt, :category, :body)"
+        ), {
+            'id': post.id,
+            'title': post.title or '',
+            'excerpt': post.excerpt or '',
+            'category': post.category or '',
+            'body': strip_tags(post.html_content),
+        })
+
+
+def remove_post(post_id):
+    """Drop one post from the index (within the current transaction)"""
+    if not is_supported():
+        return
+    ensure_index()
+    db.session.execute(text("DELETE FROM posts_fts WHERE rowid = :id"), {'id': post_id})
+
+
+def rebuild_index():
+    """Re-index every published post. Returns the number indexed."""
+    if not is_supported():
+        raise SearchUnavailable('Full-text search requires SQLite with FTS5')
+    
+    db.session.execute(text("DROP TABLE IF EXISTS posts_fts"))
+    ensure_index()
+    count = 0
+    for post in Post.query.filter_by(status='published').yield_per(200):
+        index_post(post)
+        count += 1
+    db.session.commit()
+    return count
+
+
+def _match_expression(query):
+    """Turn user input into an FTS5 query: every word must match, as a prefix.
+    
+    Each term is quoted so FTS5 operators and punctuation in the input are
+    treated as text rather than query syntax.
+    """
+    terms = [term.replace('"', '""') for term in query.split()]
+    return ' '.join(f'"{term}"*' for term in terms if term)
+
+
+def _highlight(snippet):
+    escaped = html.escape(snippet or '')
+    return escaped.replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
+
+
+def search(query, page=1, per_page=10):
+    """Ranked search over published posts.
+    
+    Returns {'total': int, 'results': [...]} where each result carries the
+    post fields plus an HTML-safe snippet with <mark> highlights.
+    """
+    if not is_supported():
+        raise SearchUnavailable('Full-text search requires SQLite with FTS5')
+    
+    expression = _match_expression(query)
+    if not expression:
+        return {'total': 0, 'results': []}
+    
+    ensure_index()
+    params = {'q': expression}
+    
+    total = db.session.execute(text(
+        "SELECT count(*) FROM posts_fts JOIN posts ON posts.id = posts_fts.rowid "
+        "WHERE posts_fts MATCH :q AND posts.status = 'published'"
+    ), params).scalar()
+    
+    weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+    rows = db.session.execute(text(
+        "SELECT posts.id, posts.slug, posts.title, posts.excerpt, posts.category, "
+        "posts.month_key, posts.published_at, "
+        f"snippet(posts_fts, -1, '{_MATCH_START}', '{_MATCH_END}', '…', 24) AS snippet, "
+        f"bm25(posts_fts, {weights}) AS rank "
+        "FROM posts_fts JOIN posts ON posts.id = posts_fts.rowid "
+        "WHERE posts_fts MATCH :q AND posts.status = 'published' "
+        "ORDER BY rank LIMIT :limit OFFSET :offset"
+    ), dict(params, limit=per_page, offset=(page - 1) * per_page)).mappings().all()
+    
+    return {
+        'total': total,
+        'results': [dict(row, snippet=_highlight(row['snippet'])) for row in rows],
+    }
+
+
+if __name__ == '__main__':
+    from app import create_app
+    
+    app = create_app(web=False)
+    
+    with app.app_context():
+        count = rebuild_index()
+        print(f"✓ Search index rebuilt with {count} published posts")
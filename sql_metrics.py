@@ -0,0 +1,219 @@
+"""
+Per-request SQL instrumentation
+
+Every statement the app's engines execute inside a request is counted and
+timed through the before/after_cursor_execute events. At the end of the
+request this module:
+
+- adds a Server-Timing header (db time and statement count, total time), so
+  the browser's network panel shows where a slow page spent its time
+- logs requests that run more than SQL_MAX_QUERIES statements or take longer
+  than SQL_SLOW_REQUEST_MS
+- flags a suspected N+1 when the same statement shape (the SQL with literals
+  and bind parameters collapsed) runs SQL_N_PLUS_ONE_THRESHOLD times or more
+  in one request, which is what a lazy load or a query inside a loop does
+- adds the request to per-endpoint totals (this worker only), which the
+  admin "SQL stats" page lists worst first
+
+Statements run outside a request (the read-event flusher, scripts) are not
+counted.
+"""
+import os
+import re
+import threading
+import time
+from flask import g, request, has_request_context, current_app
+from sqlalchemy import event
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_BIND_PARAM = re.compile(r'%\(\w+\)s|%s|\$\d+|(?<![:\w]):\w+')
+_PARAM_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_VALUES_ROWS = re.compile(r'(\([?, .]+\))(?:\s*,\s*\1)+')
+
+
+def statement_shape(statement):
+    """The statement with literals and parameter lists collapsed.
+    
+    Two executions of the same query with different ids (or a different
+    number of ids in an IN list) have the same shape.
+    """
+    shape = _WHITESPACE.sub(' ', statement).strip()
+    shape = _STRING_LITERAL.sub('?', shape)
+    shape = _BIND_PARAM.sub('?', shape)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    shape = _PARAM_LIST.sub('?, ...', shape)
+    return _VALUES_ROWS.sub(r'\1, ...', shape)
+
+
+class RequestSQLStats:
+    """Statements executed while handling one request"""
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.shapes = {}
+    
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.db_seconds += seconds
+        shape = statement_shape(statement)
+        self.shapes[shape] = self.shapes.get(shape, 0) + 1
+    
+    def repeated(self, threshold):
+        """(count, shape) pairs executed at least threshold times, most first"""
+        return sorted(((count, shape) for shape, count in self.shapes.items() if count >= threshold), reverse=True)
+
+
+class SQLMetrics:
+    """Counts statements per request and keeps per-endpoint totals"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.server_timing = True
+        self.slow_request_ms = 500
+        self.max_queries = 30
+        self.n_plus_one_threshold = 5
+        self._lock = threading.Lock()
+        self._pid = None
+        self._endpoints = {}
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """Listen on the app's engines and wrap every request. Call after db.init_app()."""
+        from models import db
+        
+        self.app = app
+        self.enabled = app.config.get('SQL_INSTRUMENTATION', self.enabled)
+        self.server_timing = app.config.get('SQL_SERVER_TIMING', self.server_timing)
+        self.slow_request_ms = app.config.get('SQL_SLOW_REQUEST_MS', self.slow_request_ms)
+        self.max_queries = app.config.get('SQL_MAX_QUERIES', self.max_queries)
+        self.n_plus_one_threshold = app.config.get('SQL_N_PLUS_ONE_THRESHOLD', self.n_plus_one_threshold)
+        app.extensions['sql_metrics'] = self
+        if not self.enabled:
+            return
+        
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        
+        # Registered before the other extensions' hooks, so the after_request
+        # handler runs last and the total includes their work
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+    
+    # -- engine events ---------------------------------------------------
+    
+    # The start time lives on the statement's execution context, not the
+    # connection: a statement that raises gets no after event, and the
+    # context is dropped with it instead of leaving state on a pooled
+    # connection.
+    
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._sql_metrics_started = time.perf_counter()
+    
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_sql_metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        if has_request_context():
+            stats = g.get('sql_stats')
+            if stats is not None:
+                stats.record(statement, elapsed)
+    
+    # -- request hooks ---------------------------------------------------
+    
+    @staticmethod
+    def _start_request():
+        g.sql_stats = RequestSQLStats()
+    
+    def _finish_request(self, response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+        
+        total_ms = (time.perf_counter() - stats.started) * 1000
+        db_ms = stats.db_seconds * 1000
+        endpoint = f"{request.method} {request.endpoint or '<unmatched>'}"
+        repeated = stats.repeated(self.n_plus_one_threshold)
+        
+        if self.server_timing:
+            response.headers.add('Server-Timing', f'db;dur={db_ms:.1f};desc="{stats.queries} queries"')
+            response.headers.add('Server-Timing', f'total;dur={total_ms:.1f}')
+        
+        if total_ms >= self.slow_request_ms or stats.queries > self.max_queries:
+            current_app.logger.warning(
+                f"Slow request {request.method} {request.full_path.rstrip('?')}: {total_ms:.0f} ms, "
+                f"{stats.queries} queries ({db_ms:.0f} ms in SQL)"
+            )
+        for count, shape in repeated:
+            current_app.logger.warning(f"Possible N+1 in {endpoint}: {count}x {shape[:300]}")
+        
+        self._record(endpoint, stats.queries, db_ms, total_ms, repeated)
+        return response
+    
+    # -- per-endpoint totals ---------------------------------------------
+    
+    def _record(self, endpoint, queries, db_ms, total_ms, repeated):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: don't report the parent's requests
+                self._endpoints = {}
+                self._pid = os.getpid()
+            row = self._endpoints.get(endpoint)
+            if row is None:
+                row = self._endpoints[endpoint] = {
+                    'endpoint': endpoint,
+                    'requests': 0,
+                    'queries': 0,
+                    'max_queries': 0,
+                    'db_ms': 0.0,
+                    'max_db_ms': 0.0,
+                    'total_ms': 0.0,
+                    'max_total_ms': 0.0,
+                    'slow': 0,
+                    'n_plus_one': 0,
+                    'n_plus_one_shape': None,
+                }
+            row['requests'] += 1
+            row['queries'] += queries
+            row['max_queries'] = max(row['max_queries'], queries)
+            row['db_ms'] += db_ms
+            row['max_db_ms'] = max(row['max_db_ms'], db_ms)
+            row['total_ms'] += total_ms
+            row['max_total_ms'] = max(row['max_total_ms'], total_ms)
+            if total_ms >= self.slow_request_ms or queries > self.max_queries:
+                row['slow'] += 1
+            if repeated:
+                row['n_plus_one'] += 1
+                row['n_plus_one_shape'] = f"{repeated[0][0]}x {repeated[0][1]}"
+    
+    def endpoints(self, sort='db_ms', limit=50):
+        """Per-endpoint totals with averages, worst first.
+        
+        sort is one of db_ms, avg_queries, max_total_ms or n_plus_one.
+        """
+        with self._lock:
+            rows = [dict(row) for row in self._endpoints.values()] if self._pid == os.getpid() else []
+        for row in rows:
+            row['avg_queries'] = row['queries'] / row['requests']
+            row['avg_db_ms'] = row['db_ms'] / row['requests']
+            row['avg_total_ms'] = row['total_ms'] / row['requests']
+        rows.sort(key=lambda row: row.get(sort, row['db_ms']), reverse=True)
+        return rows[:limit]
+    
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+sql_metrics = SQLMetrics()
@@ -0,0 +1,201 @@
+"""
+Fingerprinted, precompressed static assets
+
+python static_assets.py walks the static folder (assets/) and writes, next to
+each file, a copy whose name carries a content hash (css/style.css ->
+css/style.1a2b3c4d5e.css), plus .gz and .br variants of text files. Relative
+url() and @import references inside CSS are rewritten to the fingerprinted
+names first, so a stylesheet's hash also covers everything it pulls in. The
+mapping is written to assets/manifest.json.
+
+At runtime templates call asset_url('css/style.css'), which resolves through
+the manifest (falling back to the plain file before the first build). The
+static view serves fingerprinted files with the best precompressed variant
+the client accepts and a one-year immutable Cache-Control, so browsers never
+revalidate them and workers never compress on the fly.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+from flask import current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip variants are always built
+    brotli = None
+
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 10
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Text formats worth precompressing (woff/woff2 and images already are)
+COMPRESSIBLE = {'.css', '.js', '.svg', '.eot', '.ttf', '.json', '.txt', '.map', '.ico'}
+
+_GENERATED = re.compile(r'\.[0-9a-f]{%d}\.[^./]+(\.gz|\.br)?$' % HASH_LENGTH)
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+class AssetBuilder:
+    """Builds fingerprinted copies of everything in a static folder"""
+    
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.manifest = {}
+    
+    def _path(self, rel):
+        return os.path.join(self.static_folder, *rel.split('/'))
+    
+    def _sources(self):
+        for root, _, files in os.walk(self.static_folder):
+            for name in files:
+                rel = posixpath.relpath(posixpath.join(root.replace(os.sep, '/'), name),
+                                        self.static_folder.replace(os.sep, '/'))
+                if rel == MANIFEST_NAME or name.startswith('.') or _GENERATED.search(name):
+                    continue
+                yield rel
+    
+    def _rewrite_css(self, rel, content, stack):
+        """Point relative url()s at fingerprinted names, building them first"""
+        base = posixpath.dirname(rel)
+        
+        def replace(match):
+            quote, target = match.group(1), match.group(2)
+            if re.match(r'^([a-z]+:|/|#|data:)', target, re.I):
+                return match.group(0)
+            path, suffix = re.match(r'^([^?#]*)(.*)$', target).groups()
+            dep = posixpath.normpath(posixpath.join(base, path))
+            if dep.startswith('..') or not os.path.isfile(self._path(dep)):
+                return match.group(0)
+            hashed = self.fingerprint(dep, stack)
+            new_target = posixpath.relpath(hashed, base or '.') + suffix
+            return f'url({quote}{new_target}{quote})'
+        
+        return _CSS_URL.sub(replace, content)
+    
+    def fingerprint(self, rel, stack=()):
+        """Write the fingerprinted copy of one file and return its name"""
+        if rel in self.manifest:
+            return self.manifest[rel]
+        if rel in stack:  # circular @import - leave the reference as is
+            return rel
+        
+        with open(self._path(rel), 'rb') as f:
+            content = f.read()
+        if rel.endswith('.css'):
+            text = content.decode('utf-8', errors='surrogateescape')
+            content = self._rewrite_css(rel, text, stack + (rel,)).encode('utf-8', errors='surrogateescape')
+        
+        digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+        stem, ext = posixpath.splitext(rel)
+        hashed = f'{stem}.{digest}{ext}'
+        target = self._path(hashed)
+        if not os.path.exists(target):
+            with open(target, 'wb') as f:
+                f.write(content)
+        
+        if ext.lower() in COMPRESSIBLE:
+            if not os.path.exists(target + '.gz'):
+                with open(target + '.gz', 'wb') as f:
+                    f.write(gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None and not os.path.exists(target + '.br'):
+                with open(target + '.br', 'wb') as f:
+                    f.write(brotli.compress(content, quality=11))
+        
+        self.manifest[rel] = hashed
+        return hashed
+    
+    def build(self):
+        """Fingerprint every file, remove outputs of older builds, write the manifest"""
+        manifest_path = self._path(MANIFEST_NAME)
+        try:
+            with open(manifest_path) as f:
+                previous = json.load(f)
+        except (FileNotFoundError, ValueError):
+            previous = {}
+        
+        for rel in sorted(self._sources()):
+            self.fingerprint(rel)
+        
+        current = set(self.manifest.values())
+        for old in set(previous.values()) - current:
+            for suffix in ('', '.gz', '.br'):
+                try:
+                    os.remove(self._path(old + suffix))
+                except FileNotFoundError:
+                    pass
+        
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, manifest_path)
+        return self.manifest
+
+
+class StaticAssets:
+    """Manifest lookup for templates and the precompressed static view"""
+    
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.fingerprinted = set()
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        self.load_manifest(app.static_folder)
+        app.jinja_env.globals['asset_url'] = asset_url
+        app.view_functions['static'] = serve_static
+        app.extensions['static_assets'] = self
+    
+    def load_manifest(self, static_folder):
+        try:
+            with open(os.path.join(static_folder, MANIFEST_NAME)) as f:
+                self.manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.manifest = {}
+        self.fingerprinted = set(self.manifest.values())
+
+
+static_assets = StaticAssets()
+
+
+def asset_url(filename):
+    """url_for('static') replacement that returns the fingerprinted URL when built"""
+    return url_for('static', filename=static_assets.manifest.get(filename, filename))
+
+
+def serve_static(filename):
+    """Static view: precompressed and immutable for fingerprinted files"""
+    if filename not in static_assets.fingerprinted:
+        return current_app.send_static_file(filename)
+    
+    static_folder = current_app.static_folder
+    accepted = request.accept_encodings
+    served, encoding = filename, None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if accepted[candidate] and os.path.isfile(os.path.join(static_folder, filename + suffix)):
+            served, encoding = filename + suffix, candidate
+            break
+    
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_from_directory(static_folder, served, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+if __name__ == '__main__':
+    from app import create_app
+    
+    app = create_app(web=False)
+    
+    manifest = AssetBuilder(app.static_folder).build()
+    print(f"✓ Fingerprinted {len(manifest)} static files")
+    print(f"✓ Manifest written to {os.path.join(app.static_folder, MANIFEST_NAME)}")
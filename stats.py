@@ -0,0 +1,165 @@
+"""
+Engagement stats service for the admin views
+
+Every function here answers with a fixed number of grouped queries, no
+matter how many posts, readers or days are involved. Like, comment and
+viewer counts come from the counters stored on Post; reading depth and time
+come from the read_daily rollup and per-day series from post_daily_stats
+(see rollup.py). Unique readers over a post's history or a date range are
+estimated from the HyperLogLog sketches in hll.py.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import case, func, select
+from models import db, Post, User, ReadDaily, PostDailyStats
+from rollup import HISTOGRAM_BUCKETS, completion_bucket
+from hll import unique_readers
+
+# Keep IN lists well below SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def post_metrics(post_ids):
+    """Per-post metrics for the given post ids.
+    
+    Returns {post_id: {'views', 'likes', 'comments', 'avg_completion',
+    'avg_read_seconds'}}. Uses two queries per chunk of ids: one over the
+    stored counters and one grouped over read_daily.
+    """
+    metrics = {}
+    
+    for chunk in _chunks(set(post_ids)):
+        counters = db.session.query(
+            Post.id, Post.unique_viewer_count, Post.like_count, Post.comment_count
+        ).filter(Post.id.in_(chunk))
+        for post_id, views, likes, comments in counters:
+            metrics[post_id] = {
+                'views': views,
+                'likes': likes,
+                'comments': comments,
+                'avg_completion': 0.0,
+                'avg_read_seconds': 0.0,
+            }
+        
+        reading = db.session.query(
+            ReadDaily.post_id, func.avg(ReadDaily.max_percent), func.avg(ReadDaily.seconds)
+        ).filter(ReadDaily.post_id.in_(chunk)).group_by(ReadDaily.post_id)
+        for post_id, avg_completion, avg_seconds in reading:
+            if post_id in metrics:
+                metrics[post_id]['avg_completion'] = round(float(avg_completion or 0), 1)
+                metrics[post_id]['avg_read_seconds'] = round(float(avg_seconds or 0), 1)
+    
+    return metrics
+
+
+def site_totals(today=None):
+    """Headline numbers for the dashboard: one round trip plus this month's reader sketch"""
+    row = db.session.execute(select(
+        select(func.count(Post.id)).where(Post.status == 'published').scalar_subquery(),
+        select(func.count(User.id)).scalar_subquery(),
+        select(func.coalesce(func.sum(Post.comment_count), 0)).scalar_subquery(),
+        select(func.coalesce(func.sum(Post.like_count), 0)).scalar_subquery(),
+    )).one()
+    
+    today = today or datetime.utcnow().date()  # sketch days are UTC
+    return {
+        'total_posts': row[0],
+        'total_users': row[1],
+        'total_comments': row[2],
+        'total_likes': row[3],
+        'readers_this_month': unique_readers(start=today.replace(day=1), end=today),
+    }
+
+
+# Upper bounds (seconds, exclusive) and labels of the time-on-page buckets
+TIME_BUCKETS = [(10, '< 10s'), (30, '10-30s'), (60, '30s-1m'), (120, '1-2m'), (300, '2-5m'), (600, '5-10m'), (None, '10m+')]
+
+
+def post_reading_summary(post_id):
+    """Readers (from the sketches), reads and averages (from read_daily) for one post"""
+    reads, avg_completion, avg_seconds = db.session.query(
+        func.coalesce(func.sum(ReadDaily.event_count), 0),
+        func.avg(ReadDaily.max_percent),
+        func.avg(ReadDaily.seconds),
+    ).filter(ReadDaily.post_id == post_id).one()
+    
+    return {
+        'readers': unique_readers(post_id),
+        'reads': reads,
+        'avg_completion': round(float(avg_completion or 0), 1),
+        'avg_read_seconds': round(float(avg_seconds or 0), 1),
+    }
+
+
+def completion_histogram(post_id):
+    """Reader-days per 10% completion bucket: a list of HISTOGRAM_BUCKETS counts"""
+    bucket = completion_bucket(ReadDaily.max_percent)
+    histogram = [0] * HISTOGRAM_BUCKETS
+    for bucket_index, readers in db.session.query(bucket, func.count(ReadDaily.id)).filter(
+        ReadDaily.post_id == post_id
+    ).group_by(bucket):
+        histogram[int(bucket_index)] = readers
+    return histogram
+
+
+def time_on_page_distribution(post_id):
+    """[(label, reader-days)] over TIME_BUCKETS"""
+    bucket = case(
+        *((ReadDaily.seconds < bound, index) for index, (bound, _) in enumerate(TIME_BUCKETS) if bound is not None),
+        else_=len(TIME_BUCKETS) - 1,
+    )
+    counts = [0] * len(TIME_BUCKETS)
+    for bucket_index, readers in db.session.query(bucket, func.count(ReadDaily.id)).filter(
+        ReadDaily.post_id == post_id
+    ).group_by(bucket):
+        counts[int(bucket_index)] = readers
+    return [(label, count) for (_, label), count in zip(TIME_BUCKETS, counts)]
+
+
+def daily_series(post_id, days=30, today=None):
+    """Reads, unique readers and read time per day for the last `days` days.
+    
+    Returns a list of dicts with 'day', 'reads', 'readers' and 'seconds',
+    oldest first, with zeros for days without reads. Distinct readers over
+    the whole window are range_readers(post_id, days).
+    """
+    today = today or datetime.utcnow().date()  # post_daily_stats days are UTC
+    start = today - timedelta(days=days - 1)
+    rows = {
+        day: (views, readers, seconds)
+        for day, views, readers, seconds in db.session.query(
+            PostDailyStats.day, PostDailyStats.views, PostDailyStats.unique_readers, PostDailyStats.total_read_seconds
+        ).filter(PostDailyStats.post_id == post_id, PostDailyStats.day >= start, PostDailyStats.day <= today)
+    }
+    
+    series = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        views, readers, seconds = rows.get(day, (0, 0, 0))
+        series.append({'day': day, 'reads': views, 'readers': readers, 'seconds': seconds})
+    return series
+
+
+def range_readers(post_id, days=30, today=None):
+    """Estimated distinct readers of a post over the last `days` days"""
+    today = today or datetime.utcnow().date()  # sketch days are UTC
+    return unique_readers(post_id, today - timedelta(days=days - 1), today)
+
+
+def post_viewers(post_id, page=1, per_page=20):
+    """Paginated readers of a post, most recent first.
+    
+    Items are (user, last_day, max_percent, seconds) rows, one grouped query
+    per page plus the count.
+    """
+    last_day = func.max(ReadDaily.day)
+    return db.session.query(
+        User, last_day, func.max(ReadDaily.max_percent), func.sum(ReadDaily.seconds)
+    ).join(ReadDaily, ReadDaily.user_id == User.id).filter(
+        ReadDaily.post_id == post_id
+    ).group_by(User.id).order_by(last_day.desc(), User.id).paginate(page=page, per_page=per_page, error_out=False)
@@ -71,8 +71,10 @@ def test_app_context():
     print("\n🔍 Testing app context...")
     
     try:
-        from app import app, db
-        from models import User, Post, Comment, Like, ReadEvent
+        from app import create_app
+        from models import db, User, Post, Comment, Like, ReadEvent
+        
+        app = create_app()
         
         with app.app_context():
             print("✓ App context created")
@@ -90,8 +92,9 @@ def test_blueprints():
     print("\n🔍 Testing blueprints...")
     
     try:
-        from app import app
+        from app import create_app
         
+        app = create_app()
         blueprints = list(app.blueprints.keys())
         print(f"✓ Registered blueprints: {', '.join(blueprints)}")
         
@@ -114,8 +117,9 @@ def test_routes():
     print("\n🔍 Testing routes...")
     
     try:
-        from app import app
+        from app import create_app
         
+        app = create_app()
         routes = []
         for rule in app.url_map.iter_rules():
             routes.append(str(rule))
@@ -147,6 +151,83 @@ def test_routes():
         return False
 
 
+def test_like_toggle_concurrency():
+    """Hammer one post's like toggle from many threads"""
+    print("\n🔍 Testing concurrent like toggles...")
+    
+    import os
+    import tempfile
+    import threading
+    from flask import Flask
+    from models import db, User, Post, Like
+    
+    threads_per_user = 4
+    toggles_per_thread = 25
+    tmp_dir = tempfile.mkdtemp()
+    
+    try:
+        # Separate throwaway database so the real one is never touched
+        test_app = Flask(__name__)
+        test_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp_dir, 'likes.db')}"
+        test_app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
+        db.init_app(test_app)
+        
+        with test_app.app_context():
+            db.create_all()
+            users = [User(entra_oid=f'oid-{i}', email=f'user{i}@example.com', name=f'User {i}') for i in range(5)]
+            post = Post(slug='like-race', title='Like race', html_content='<p>x</p>',
+                        month_key='2026-01', status='published')
+            db.session.add_all(users + [post])
+            db.session.commit()
+            user_ids = [user.id for user in users]
+            post_id = post.id
+        
+        errors = []
+        start = threading.Barrier(len(user_ids) * threads_per_user)
+        
+        def hammer(user_id):
+            # Several threads per user, like a burst of double clicks
+            with test_app.app_context():
+                start.wait()
+                for _ in range(toggles_per_thread):
+                    try:
+                        liked, like_count = Like.toggle(post_id, user_id)
+                        db.session.commit()
+                    except Exception as e:
+                        db.session.rollback()
+                        errors.append(e)
+        
+        workers = [threading.Thread(target=hammer, args=(user_id,))
+                   for user_id in user_ids for _ in range(threads_per_user)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        
+        with test_app.app_context():
+            stored = db.session.get(Post, post_id).like_count
+            actual = Like.query.filter_by(post_id=post_id).count()
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+        
+        print(f"✓ {len(workers) * toggles_per_thread} toggles from {len(workers)} threads")
+        if errors:
+            print(f"✗ {len(errors)} toggles failed, e.g. {errors[0]}")
+            return False
+        if stored != actual:
+            print(f"✗ like_count is {stored} but {actual} likes exist")
+            return False
+        print(f"✓ like_count matches the likes table ({actual})")
+        return True
+    except Exception as e:
+        print(f"✗ Like concurrency test failed: {e}")
+        return False
+    finally:
+        import shutil
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
 def main():
     """Run all tests"""
     print("=" * 60)
@@ -157,7 +238,8 @@ def main():
         test_imports,
         test_app_context,
         test_blueprints,
-        test_routes
+        test_routes,
+        test_like_toggle_concurrency
     ]
     
     results = []